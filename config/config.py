@@ -27,27 +27,101 @@ config = {
             ConfigKey.UNSTAGE_PATH:     f''
         },
     },
+    # Number of collections processed at the same time, collections share
+    #   a hash cache so a file reachable from several collections is only
+    #   read once
+    ConfigKey.COLLECTION_WORKERS: 4,
     # BUF_SIZE is to prevent hashing of large files from consuming
     #   system resources by hashing the file in BUF_SIZE chunks
     ConfigKey.BUF_SIZE: 65536,
+    # Patterns that select which files are read when crawling a collection.
+    #   Glob patterns without a '/' match file and folder names, patterns
+    #   with a '/' match paths relative to the collection root, and
+    #   patterns starting with 're:' are regular expressions searched in
+    #   the relative path.
+    # Excluded folders are never listed, for example :
+    #   ['node_modules', '.git', '.cache', '__pycache__']
+    ConfigKey.CRAWL_EXCLUDE: [],
+    # An empty include list includes every file that is not excluded
+    ConfigKey.CRAWL_INCLUDE: [],
+    # Folder the folder listings of each crawl are saved to, folders whose
+    #   modification time is unchanged are not listed again by the next
+    #   crawl, their files are still read. An empty value disables saving
+    ConfigKey.CRAWL_CACHE_PATH: f'',
+    # Folder each archive's index is exported to once it is hashed, as
+    #   <collection>.idx, a binary file of records sorted by digest that
+    #   other tools can map and search without loading it, see
+    #   BinaryIndexReader. An empty value disables the export
+    ConfigKey.BINARY_INDEX_PATH: f'',
     # Toggle if you want a default path structure to be made for archive
     #   paths which includes the archive and unstage path
     ConfigKey.CREATE_DEFAULT_ARCHIVE_PATHS: True,
     # Toggle if you want a default path structure to be made for source
     #   paths which includes the graveyard, source, and stage path
     ConfigKey.CREATE_DEFAULT_SOURCE_PATHS: True,
-    # Value chosen to be beyond reasonable file path lengths
-    #   It is used for the file length sorting algorithm
-    ConfigKey.FILE_NAME_LEN_MAX_VALUE: 9999,
     # Maximum and minimum file sizes to hash, without a hash, a file will not
-    #   be acted on.
+    #   be acted on. Files outside the limits are skipped while crawling.
     # For minimum size, 0 sets no size limit
     # For maximum size, 0 sets no size limit
     ConfigKey.FILE_SIZE_TO_HASH_MIN: 0,
     ConfigKey.FILE_SIZE_TO_HASH_MAX: 0,
-    # Available values : MD5, SHA1
+    # Available values : BLAKE2B, BLAKE2S, MD5, SHA1, SHA256, SHA512
     #   Determines which hashing algorithm to use
     ConfigKey.HASH_ALGO: 'MD5',
+    # Replaces HASH_ALGO with the fastest of HASH_AUTO_TUNE_ALGOS on this
+    #   host, and BUF_SIZE with the fastest read size for each device, using
+    #   a sample of the archive. The choices are saved per host and device to
+    #   HASH_AUTO_TUNE_PATH and reused, delete the file to tune again.
+    #   Hashes differ between algorithms, so they are only comparable
+    #   between runs that use the same one
+    ConfigKey.HASH_AUTO_TUNE: False,
+    ConfigKey.HASH_AUTO_TUNE_ALGOS: [
+        'BLAKE2B',
+        'BLAKE2S',
+        'MD5',
+        'SHA1',
+        'SHA256',
+        'SHA512'
+    ],
+    ConfigKey.HASH_AUTO_TUNE_PATH: f'{home}/_PYSHEPHERD/hash_tune.json',
+    # Bytes of archive files read from each device to tune its read size
+    ConfigKey.HASH_AUTO_TUNE_SAMPLE_SIZE: 134217728,
+    # Available values : BUFFERED, CACHE_POLITE, DIRECT
+    #   Determines how files are read to be hashed
+    #   BUFFERED reads through the page cache, evicting the working set of
+    #   other programs when hashing large archives
+    #   CACHE_POLITE advises sequential reads and evicts each window of the
+    #   file once it has been hashed
+    #   DIRECT bypasses the page cache, where the filesystem supports it,
+    #   and otherwise falls back to CACHE_POLITE
+    ConfigKey.HASH_READ_MODE: 'BUFFERED',
+    # Bytes hashed between evictions in CACHE_POLITE mode
+    ConfigKey.HASH_CACHE_DROP_WINDOW: 8388608,
+    # Flag to only read the allocated extents of sparse files, such as disk
+    #   and database images, the holes between them are hashed as zeros
+    #   without reading them. Hashes are the same as a full read. Sparse
+    #   files are evicted from the page cache once hashed unless
+    #   HASH_READ_MODE is BUFFERED, they are never read DIRECT
+    ConfigKey.HASH_SPARSE_FILES: False,
+    # Files larger than this are hashed as a tree of blocks, hashed in
+    #   parallel and resumable if interrupted. The tree hash of a file
+    #   differs from its plain hash, so changing this value between runs
+    #   changes the hashes of the files it affects.
+    # A value of 0 disables block tree hashing
+    ConfigKey.HASH_TREE_THRESHOLD: 0,
+    ConfigKey.HASH_TREE_BLOCK_SIZE: 67108864,
+    # Number of blocks of a single file hashed at the same time
+    ConfigKey.HASH_TREE_WORKERS: 4,
+    # Folder the block hashes are saved to, so an interrupted hash can be
+    #   resumed, an empty value disables saving
+    ConfigKey.HASH_TREE_STATE_PATH: f'',
+    # Files smaller than this are read whole with a single read and hashed
+    #   without progress reporting, several at a time, since their hashing
+    #   time is spent opening them rather than reading them
+    # A value of 0 disables the small file path
+    ConfigKey.SMALL_FILE_THRESHOLD: 65536,
+    # Number of small files hashed at the same time
+    ConfigKey.SMALL_FILE_WORKERS: 8,
     # Flag to toggle sorting files to determine original
     # This feature will compare the original and duplicate files, sorting them
     #   alphabetically, and declares the "alphabetically first" file as the
@@ -56,18 +130,79 @@ config = {
     #   affects the verboseness of some console output, for example, a
     #   loading bar will be displayed when hashing files larger than this
     ConfigKey.LARGE_FILE_THRESHOLD: 100000000,
+    # Available values : DICT, FOLDERS, SQLITE
+    #   Determines where file metadata is kept, DICT keeps it in memory,
+    #   FOLDERS keeps it in memory grouped by folder, holding each folder
+    #   path once, for deep archives, at the cost of slower lookups, only
+    #   the file table is grouped, duplicate records keep full paths,
+    #   SQLITE keeps it in a database on disk for collections too large
+    #   to fit in memory
+    ConfigKey.METADATA_BACKEND: 'DICT',
+    # The database file used by the SQLITE backend
+    ConfigKey.METADATA_STORE_PATH: f'{home}/_PYSHEPHERD/metadata.sqlite',
+    # Number of files written to the database per transaction, this also
+    #   bounds the number of hashes held in memory before they are saved
+    ConfigKey.METADATA_STORE_BATCH_SIZE: 10000,
+    # Available values : MEMORY, EXTERNAL_SORT
+    #   Determines how files are grouped by hash to find duplicates, MEMORY
+    #   groups them in a dictionary (or a query for the SQLITE backend),
+    #   EXTERNAL_SORT sorts (size, hash, path) records in runs on disk and
+    #   merges them, using a fixed amount of memory for any collection size
+    ConfigKey.DUPLICATE_GROUPING: 'MEMORY',
+    # The folder the EXTERNAL_SORT runs are written to while grouping
+    ConfigKey.EXTERNAL_SORT_PATH: f'{home}/_PYSHEPHERD/sort',
+    # Number of records sorted in memory for each EXTERNAL_SORT run
+    ConfigKey.EXTERNAL_SORT_RUN_SIZE: 1000000,
     # Determines whether soft links will be considered when searching for
     #   duplicate files. Disabled by default to prevent moving soft links
     ConfigKey.SKIP_SOFT_LINKS: True,
-    # Toggles the feature that reads the duplicate (parent and children)
-    #   file names and re-assigns the parent role to one of the children
-    #   using two methods.
-    # Method 1 (Prioritized) : Declares the file with the shortest file
-    #   name to be the parent
-    # Method 2 (Fall back) : If multiple files match the shortest file length
-    #   then the file paths will be sorted alphabetically, with the 'first'
-    #   (closest to 'A') file being declared to be the parent file and all
-    #   others declared to be duplicates
+    # Keeps running after the collections are validated, rehashing files as
+    #   they change and keeping the duplicate groups up to date, nothing is
+    #   unstaged. Can also be enabled by launching with the --watch flag
+    ConfigKey.WATCH: False,
+    # Seconds between the folder rescans that catch changes inotify missed,
+    #   or the only way changes are seen where inotify is not available
+    ConfigKey.WATCH_RESCAN_INTERVAL: 300,
+    # While watching, other programs can ask whether a file or digest is
+    #   already held by a collection over this Unix domain socket, one json
+    #   request per line, see QueryServer. An empty value disables queries
+    ConfigKey.QUERY_SOCKET_PATH: f'',
+    # Reads the duplicate (parent and children) file names and assigns the
+    #   parent role to one of them, all others are declared to be duplicates.
+    # The policies are applied in order, each later policy only breaks ties
+    #   left by the earlier ones. Available values :
+    #   PREFERRED_PREFIX : the file under the earliest preferred prefix
+    #   FEWEST_COMPONENTS : the file with the fewest folders in its path
+    #   SHORTEST_PATH : the file with the shortest file path
+    #   OLDEST_MTIME : the file with the oldest modification time
+    #   ALPHABETICAL : the file path closest to 'A'
+    ConfigKey.PARENT_SELECTION_POLICIES: [
+        'SHORTEST_PATH',
+        'ALPHABETICAL'
+    ],
+    # Folders whose files are preferred as parents, most preferred first,
+    #   used by the PREFERRED_PREFIX policy
+    ConfigKey.PARENT_PREFERRED_PREFIXES: [],
+    # Number of files unstaged at the same time from each source device,
+    #   every device has its own workers so a slow device does not hold
+    #   back the others
+    ConfigKey.UNSTAGE_WORKERS: 4,
+    # Number of source files hashed at the same time while they are
+    #   ingested, each file is moved to the stage or the graveyard as soon
+    #   as its hash is ready
+    ConfigKey.INGEST_WORKERS: 4,
+    # Folder the unstaging journals are written to, one per collection.
+    #   Every unstaging action is written to the journal before it runs, so
+    #   an interrupted unstaging is finished by the next run without crawling
+    #   or hashing, and the last unstaging can be undone. An empty value
+    #   disables the journal
+    ConfigKey.UNSTAGE_JOURNAL_PATH: f'{home}/_PYSHEPHERD/journal',
+    # Number of actions run between syncs of the journal to disk
+    ConfigKey.UNSTAGE_JOURNAL_SYNC_COUNT: 1000,
+    # Moves the files of the last unstaging of each collection back to where
+    #   they were, using its journal, instead of running. Can also be
+    #   enabled by launching with the --undo-unstage flag
+    ConfigKey.UNDO_UNSTAGE: False,
 
     # FILE MANAGER VALUES BELOW
     ConfigKey.DEFAULT_PARENT_FOLDER: '_PYSHEPHERD',
@@ -81,6 +216,17 @@ config = {
     # LOGGER VALUES BELOW
     # LOGGER VALUES ABOVE
 
+    # PROFILING VALUES BELOW
+    # Wraps each manager stage in cProfile and tracemalloc, can also be
+    #   enabled by launching with the --profile flag
+    ConfigKey.PROFILE: False,
+    # Folder the per-stage .pstats and allocation files are written to,
+    #   an empty value writes them to the current working directory
+    ConfigKey.PROFILE_PATH: f'',
+    # Number of allocation sites to report for each stage
+    ConfigKey.PROFILE_TOP_ALLOCATIONS: 25,
+    # PROFILING VALUES ABOVE
+
     # PROGRESS VALUES BELOW
     # How often to update the progress bar, a value of 1 would mean to
     #   update the loading bar every time it has moved 1%
@@ -92,18 +238,21 @@ config = {
     # SYSTEM MANAGER VALUES BELOW
     # Time to wait between checks of the network interfaces
     #   This is used to ensure that they are active, so some
-    #   delay must be used to allow the ifconfig command to
-    #   update.
+    #   delay must be used to allow the interface counters to
+    #   change.
     ConfigKey.NETWORK_CHECK_DELAY: 1,
     # Note that each time a network check count is added, each
-    #   check requires a wait time of network_check_delay. This
-    #   will create a total wait time of :
-    #       network_check_delay * network_check_count
+    #   check after the first requires a wait time of
+    #   network_check_delay. This will create a total wait time of :
+    #       network_check_delay * (network_check_count - 1)
     # At the moment, there is no practical reason to change this value
     #   since only the first and last snapshots are compared.
     ConfigKey.NETWORK_CHECK_COUNT: 2,
     # If enabled, requires internet connectivity
     ConfigKey.REQUIRE_NETWORK: False,
+    # Run the disk and network checks while the collections are crawled
+    #   and hashed, they must pass before any file is moved
+    ConfigKey.SYSTEM_CHECKS_IN_BACKGROUND: True,
     # SYSTEM MANAGER VALUES ABOVE
 
 }
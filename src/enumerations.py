@@ -7,6 +7,11 @@ import os
 user = os.environ.get('USER')
 
 
+class BinaryIndex:
+    MAGIC = b'PYSHIDX\0'
+    VERSION = 1
+
+
 class Class:
     COLLECTION_MANAGER = 'COLLECTION_MANAGER'
     CONFIG_MANAGER = 'CONFIG_MANAGER'
@@ -18,48 +23,65 @@ class Class:
 
 class CollectionType:
     ARCHIVE = 'ARCHIVE'
+    GRAVEYARD = 'GRAVEYARD'
     SOURCE = 'SOURCE'
+    STAGE = 'STAGE'
 
 
 class Command:
-    class Disk:
-        df = 'df'
-
     class SoftLink:
         root = ['ln', '-s']
 
-    class Network:
-        ifconfig = 'ifconfig'
-
-    class Output:
-        df = {
-            'Header Columns': [
-                'Filesystem',
-                '1K-blocks',
-                'Used',
-                'Available',
-                'Use%',
-                'Mounted on'
-            ]
-        }
-
 
 class ConfigKey:
     # Parent Keys, Main
     DEBUG = 'DEBUG'
 
     # Parent Keys, Archive Manager
+    ARCHIVES = 'ARCHIVES'
+    BINARY_INDEX_PATH = 'BINARY_INDEX_PATH'
     BUF_SIZE = 'BUF_SIZE'
-    COLLECTION = 'COLLECTION'
+    COLLECTION_WORKERS = 'COLLECTION_WORKERS'
+    CRAWL_CACHE_PATH = 'CRAWL_CACHE_PATH'
+    CRAWL_EXCLUDE = 'CRAWL_EXCLUDE'
+    CRAWL_INCLUDE = 'CRAWL_INCLUDE'
     CREATE_DEFAULT_ARCHIVE_PATHS = 'CREATE_DEFAULT_ARCHIVE_PATHS'
     CREATE_DEFAULT_SOURCE_PATHS = 'CREATE_DEFAULT_SOURCE_PATHS'
-    DEFAULT_COLLECTION = 'DEFAULT_COLLECTION'
-    FILE_NAME_LEN_MAX_VALUE = 'FILE_NAME_LEN_MAX_VALUE'
+    DEFAULT_ARCHIVE = 'DEFAULT_ARCHIVE'
+    DUPLICATE_GROUPING = 'DUPLICATE_GROUPING'
+    EXTERNAL_SORT_PATH = 'EXTERNAL_SORT_PATH'
+    EXTERNAL_SORT_RUN_SIZE = 'EXTERNAL_SORT_RUN_SIZE'
     FILE_SIZE_TO_HASH_MAX = 'FILE_SIZE_TO_HASH_MAX'
     FILE_SIZE_TO_HASH_MIN = 'FILE_SIZE_TO_HASH_MIN'
     HASH_ALGO = 'HASH_ALGO'
+    HASH_AUTO_TUNE = 'HASH_AUTO_TUNE'
+    HASH_AUTO_TUNE_ALGOS = 'HASH_AUTO_TUNE_ALGOS'
+    HASH_AUTO_TUNE_PATH = 'HASH_AUTO_TUNE_PATH'
+    HASH_AUTO_TUNE_SAMPLE_SIZE = 'HASH_AUTO_TUNE_SAMPLE_SIZE'
+    HASH_CACHE_DROP_WINDOW = 'HASH_CACHE_DROP_WINDOW'
+    HASH_READ_MODE = 'HASH_READ_MODE'
+    HASH_SPARSE_FILES = 'HASH_SPARSE_FILES'
+    HASH_TREE_BLOCK_SIZE = 'HASH_TREE_BLOCK_SIZE'
+    HASH_TREE_STATE_PATH = 'HASH_TREE_STATE_PATH'
+    HASH_TREE_THRESHOLD = 'HASH_TREE_THRESHOLD'
+    HASH_TREE_WORKERS = 'HASH_TREE_WORKERS'
+    INGEST_WORKERS = 'INGEST_WORKERS'
     LARGE_FILE_THRESHOLD = 'LARGE_FILE_THRESHOLD'
+    METADATA_BACKEND = 'METADATA_BACKEND'
+    METADATA_STORE_BATCH_SIZE = 'METADATA_STORE_BATCH_SIZE'
+    METADATA_STORE_PATH = 'METADATA_STORE_PATH'
+    PARENT_PREFERRED_PREFIXES = 'PARENT_PREFERRED_PREFIXES'
+    PARENT_SELECTION_POLICIES = 'PARENT_SELECTION_POLICIES'
+    QUERY_SOCKET_PATH = 'QUERY_SOCKET_PATH'
     SKIP_SOFT_LINKS = 'SKIP_SOFT_LINKS'
+    SMALL_FILE_THRESHOLD = 'SMALL_FILE_THRESHOLD'
+    SMALL_FILE_WORKERS = 'SMALL_FILE_WORKERS'
+    UNDO_UNSTAGE = 'UNDO_UNSTAGE'
+    UNSTAGE_JOURNAL_PATH = 'UNSTAGE_JOURNAL_PATH'
+    UNSTAGE_JOURNAL_SYNC_COUNT = 'UNSTAGE_JOURNAL_SYNC_COUNT'
+    UNSTAGE_WORKERS = 'UNSTAGE_WORKERS'
+    WATCH = 'WATCH'
+    WATCH_RESCAN_INTERVAL = 'WATCH_RESCAN_INTERVAL'
 
     # Child Keys, Archive Manager
     ARCHIVE_PATH = 'ARCHIVE_PATH'
@@ -77,6 +99,11 @@ class ConfigKey:
     # Parent Keys, Logging
     DEFAULT_LEVEL = 'DEBUG'
 
+    # Parent Keys, Profiling
+    PROFILE = 'PROFILE'
+    PROFILE_PATH = 'PROFILE_PATH'
+    PROFILE_TOP_ALLOCATIONS = 'PROFILE_TOP_ALLOCATIONS'
+
     # Parent Keys, Progress
     PROGRESS_BAR_INCREMENT = 'PROGRESS_BAR_INCREMENT'
     TERMINAL_DIALOG_PADDING = 'TERMINAL_DIALOG_PADDING'
@@ -85,6 +112,21 @@ class ConfigKey:
     NETWORK_CHECK_DELAY = 'NETWORK_CHECK_DELAY'
     NETWORK_CHECK_COUNT = 'NETWORK_CHECK_COUNT'
     REQUIRE_NETWORK = 'REQUIRE_NETWORK'
+    SYSTEM_CHECKS_IN_BACKGROUND = 'SYSTEM_CHECKS_IN_BACKGROUND'
+
+
+class CrawlCache:
+    CURRENT_VERSION = 2
+    FOLDERS = 'FOLDERS'
+    # Folders changed this close to the crawl start are listed again next time
+    RACY_WINDOW_NS = 2000000000
+    VERSION = 'VERSION'
+
+
+class CrawlFilter:
+    EXCLUDE = 'EXCLUDE'
+    INCLUDE = 'INCLUDE'
+    REGEX_PREFIX = 're:'
 
 
 class Disk:
@@ -98,14 +140,84 @@ class Disk:
         ]
 
 
+class DuplicateGrouping:
+    EXTERNAL_SORT = 'EXTERNAL_SORT'
+    MEMORY = 'MEMORY'
+
+
+class ExternalSort:
+    # Runs merged at the same time, more runs are merged in several passes
+    MAX_OPEN_RUNS = 256
+
+
 class FileAttribute:
     HASH = 'HASH'
+    ST_DEV = 'ST_DEV'
+    ST_INO = 'ST_INO'
+    ST_MTIME_NS = 'ST_MTIME_NS'
     ST_SIZE = 'ST_SIZE'
 
 
+class Flag:
+    PROFILE = '--profile'
+    UNDO_UNSTAGE = '--undo-unstage'
+    WATCH = '--watch'
+
+
+class Journal:
+    ABANDONED = 'ABANDONED'
+    COMPLETE = 'COMPLETE'
+    DONE = 'DONE'
+    LINK = 'LINK'
+    MKDIR = 'MKDIR'
+    MOVE = 'MOVE'
+
+
 class Hash:
+    BLAKE2B = 'BLAKE2B'
+    BLAKE2S = 'BLAKE2S'
     MD5 = 'MD5'
     SHA1 = 'SHA1'
+    SHA256 = 'SHA256'
+    SHA512 = 'SHA512'
+
+
+class HashTune:
+    BUF_SIZE = 'BUF_SIZE'
+    DEVICES = 'DEVICES'
+    HASH_ALGO = 'HASH_ALGO'
+    # Bytes hashed in memory by each algorithm, and the size of each update
+    ALGO_SAMPLE_SIZE = 67108864
+    ALGO_CHUNK_SIZE = 1048576
+    # Read sizes tried, as multiples of the device block size, up to a limit
+    BLOCK_SIZE_MULTIPLES = (16, 64, 256, 1024, 4096)
+    MAX_BUF_SIZE = 16777216
+    # Devices with fewer sample bytes than this keep the configured read size
+    MIN_SAMPLE_SIZE = 8388608
+    # Files smaller than this are left out of the sample, they measure the
+    #   cost of opening files rather than the read size
+    MIN_SAMPLE_FILE_SIZE = 1048576
+
+
+class HashTree:
+    BLOCK_SIZE = 'BLOCK_SIZE'
+    BLOCKS = 'BLOCKS'
+    FILE_KEY = 'FILE_KEY'
+    HASH_ALGO = 'HASH_ALGO'
+    # Seconds between saves of the block digests
+    SAVE_INTERVAL = 5
+
+
+class MetadataBackend:
+    DICT = 'DICT'
+    FOLDERS = 'FOLDERS'
+    SQLITE = 'SQLITE'
+
+
+class MetadataIndex:
+    DIGEST = 'DIGEST'
+    INODE = 'INODE'
+    SIZE = 'SIZE'
 
 
 class MetadataKey:
@@ -136,13 +248,59 @@ class Network:
     class Interface:
         # Define interfaces to ignore and skip
         skip = [
-            'lo:'
+            'lo'
         ]
 
 
+class ParentPolicy:
+    ALPHABETICAL = 'ALPHABETICAL'
+    FEWEST_COMPONENTS = 'FEWEST_COMPONENTS'
+    OLDEST_MTIME = 'OLDEST_MTIME'
+    PREFERRED_PREFIX = 'PREFERRED_PREFIX'
+    SHORTEST_PATH = 'SHORTEST_PATH'
+
+
+class Plan:
+    CROSS_DEVICE = 'CROSS_DEVICE'
+    DEFERRED = 'DEFERRED'
+    DEVICES = 'DEVICES'
+    FREE = 'FREE'
+    RECLAIMABLE = 'RECLAIMABLE'
+    REQUIRED = 'REQUIRED'
+    SAME_DEVICE = 'SAME_DEVICE'
+    UNSTAGE_PATH = 'UNSTAGE_PATH'
+
+
+class Proc:
+    meminfo = '/proc/meminfo'
+    mountinfo = '/proc/self/mountinfo'
+    net_dev = '/proc/net/dev'
+
+
 class Progress:
     DATA_READ_SUM = 'DATA_READ_SUM'
     DATA_SIZE = 'DATA_SIZE'
     PERCENTAGE_LAST_UPDATE = 'PERCENTAGE_LAST_UPDATE'
     PERCENTAGE_NOW = 'PERCENTAGE_NOW'
     UPDATE_INCREMENT = 'UPDATE_INCREMENT'
+
+
+class Query:
+    DIGEST = 'digest'
+    DIGESTS = 'digests'
+    ERROR = 'error'
+    FILES = 'files'
+    PATHS = 'paths'
+
+
+class ReadMode:
+    BUFFERED = 'BUFFERED'
+    CACHE_POLITE = 'CACHE_POLITE'
+    DIRECT = 'DIRECT'
+
+
+class Watch:
+    # Bytes of inotify events read at a time
+    READ_SIZE = 65536
+    # Seconds without a change before a burst of changes is handled
+    SETTLE_DELAY = 1
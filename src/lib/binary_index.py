@@ -0,0 +1,147 @@
+# A compact index of digests, sizes and paths that is searched in place
+
+# imports, python
+from mmap import ACCESS_READ
+from mmap import mmap
+from os import makedirs
+from os import replace
+from os.path import dirname
+import struct
+
+# imports, project
+from src.enumerations import BinaryIndex as bi
+from src.enumerations import FileAttribute
+
+# Header : magic, version, hash algorithm, digest length, record count,
+#   offset of the records, offset of the paths
+_HEADER = struct.Struct('<8sI16sIQQQ')
+
+
+def write_binary_index(index_file: str, files, hash_algo: str) -> int:
+    """Atomically write the hashed files of a collection to an index file
+
+    The file holds a header, then the paths, then fixed size records sorted
+        by digest and size, pointing to the paths. Each record is :
+        digest (raw bytes), size (u64), path offset (u64), path length (u32)
+
+    :param index_file: the file to write
+    :param files: an iterable of (path, file metadata) tuples, each file
+        metadata holding the HASH and ST_SIZE
+    :param hash_algo: the name of the hash algorithm of the digests
+    :return: the number of records written
+    """
+    if dirname(index_file):
+        makedirs(dirname(index_file), exist_ok=True)
+    index_file_tmp = index_file + '.tmp'
+    with open(index_file_tmp, 'wb') as idx:
+        # The paths are written as they are read, only the records are sorted
+        idx.seek(_HEADER.size)
+        records = []
+        path_offset = 0
+        digest_len = 0
+        for path, file_metadata in files:
+            encoded_path = path.encode(errors='surrogateescape')
+            digest = bytes.fromhex(file_metadata[FileAttribute.HASH])
+            digest_len = digest_len or len(digest)
+            records.append((digest, file_metadata[FileAttribute.ST_SIZE],
+                            path_offset, len(encoded_path)))
+            idx.write(encoded_path)
+            path_offset += len(encoded_path)
+        records.sort()
+
+        record = _get_record_struct(digest_len)
+        records_offset = _HEADER.size + path_offset
+        for digest, size, offset, length in records:
+            idx.write(record.pack(digest, size, offset, length))
+        idx.seek(0)
+        idx.write(_HEADER.pack(
+            bi.MAGIC, bi.VERSION, hash_algo.encode(), digest_len,
+            len(records), records_offset, _HEADER.size))
+    replace(index_file_tmp, index_file)
+    return len(records)
+
+
+class BinaryIndexReader:
+    """Searches an index file in place, through a read only memory map, so
+        opening it costs nothing however many records it holds"""
+
+    def __init__(self, index_file: str):
+        """Map an index file written by write_binary_index
+
+        :param index_file: the file to map
+        :raises ValueError: when the file is not a supported index file
+        """
+        with open(index_file, 'rb') as idx:
+            self._map = mmap(idx.fileno(), 0, access=ACCESS_READ)
+        (magic, version, hash_algo, self._digest_len, self._count,
+         self._records_offset, self._paths_offset) = \
+            _HEADER.unpack_from(self._map)
+        if magic != bi.MAGIC or version != bi.VERSION:
+            self._map.close()
+            raise ValueError(f'Not a supported index file : {index_file}')
+        self.hash_algo = hash_algo.rstrip(b'\0').decode()
+        self._record = _get_record_struct(self._digest_len)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        """Iterate over every record, sorted by digest and size
+
+        :return: a generator of (digest, size, path) tuples
+        """
+        for record_idx in range(self._count):
+            yield self._read_record(record_idx)
+
+    def close(self) -> None:
+        self._map.close()
+
+    def find(self, digest: str) -> list:
+        """Find the files holding a digest with a binary search
+
+        :param digest: the hash of a file
+        :return: the (size, path) of each file holding the digest
+        """
+        try:
+            digest_bytes = bytes.fromhex(digest)
+        except ValueError:
+            return []
+        if len(digest_bytes) != self._digest_len:
+            return []
+
+        # Find the first record holding the digest
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if self._read_digest(mid) < digest_bytes:
+                low = mid + 1
+            else:
+                high = mid
+        found = []
+        while low < self._count and self._read_digest(low) == digest_bytes:
+            _, size, path = self._read_record(low)
+            found.append((size, path))
+            low += 1
+        return found
+
+    def _read_digest(self, record_idx: int) -> bytes:
+        record_start = self._records_offset + record_idx * self._record.size
+        return self._map[record_start:record_start + self._digest_len]
+
+    def _read_record(self, record_idx: int) -> tuple:
+        digest, size, path_offset, path_len = self._record.unpack_from(
+            self._map, self._records_offset + record_idx * self._record.size)
+        path_start = self._paths_offset + path_offset
+        path = self._map[path_start:path_start + path_len].decode(
+            errors='surrogateescape')
+        return digest.hex(), size, path
+
+
+def _get_record_struct(digest_len: int) -> struct.Struct:
+    return struct.Struct(f'<{digest_len}sQQI')
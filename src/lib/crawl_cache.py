@@ -0,0 +1,115 @@
+# Folder listings saved between crawls, so unchanged folders are not listed
+
+# imports, python
+from hashlib import sha1
+from os import makedirs
+from os import replace
+from os import scandir
+from os import stat
+from os.path import islink
+from pathlib import Path
+from time import time_ns
+import json
+
+# imports, project
+from src.enumerations import CrawlCache
+
+
+def load_crawl_cache(crawl_cache_path: str, path: str) -> dict:
+    """Load the folder listings saved by the last crawl of a path
+
+    :param crawl_cache_path: folder the listings are saved to
+    :param path: the crawl root
+    :return: the folder listings, see walk_with_cache, empty if none are saved
+    """
+    try:
+        with open(_get_cache_file(crawl_cache_path, path)) as cf:
+            crawl_cache = json.load(cf)
+    except (OSError, ValueError):
+        return {}
+    if crawl_cache.get(CrawlCache.VERSION) != CrawlCache.CURRENT_VERSION:
+        return {}
+    return crawl_cache[CrawlCache.FOLDERS]
+
+
+def save_crawl_cache(crawl_cache_path: str, path: str, listings: dict) -> None:
+    """Atomically save the folder listings of a complete crawl
+
+    :param crawl_cache_path: folder the listings are saved to
+    :param path: the crawl root
+    :param listings: the folder listings, see walk_with_cache
+    """
+    makedirs(crawl_cache_path, exist_ok=True)
+    cache_file = _get_cache_file(crawl_cache_path, path)
+    cache_file_tmp = cache_file + '.tmp'
+    with open(cache_file_tmp, 'w') as cf:
+        json.dump({
+            CrawlCache.VERSION: CrawlCache.CURRENT_VERSION,
+            CrawlCache.FOLDERS: listings
+        }, cf)
+    replace(cache_file_tmp, cache_file)
+
+
+def walk_with_cache(path: str, cached_listings: dict, listings: dict):
+    """Walk a folder tree top down like os.walk, listing only the folders
+        whose modification time changed since they were cached
+
+    Adding or removing an entry changes the modification time of its folder,
+        so an unchanged folder still holds the cached entries. As with os.walk,
+        folders removed from dirs are not walked, and soft links to folders
+        are listed in dirs but not walked.
+
+    A folder changed within CrawlCache.RACY_WINDOW_NS of the crawl start may
+        change again without its modification time changing, its listing is
+        kept without a modification time so it is listed again next time.
+
+    :param path: the folder to walk
+    :param cached_listings: the listings from the last crawl
+    :param listings: filled with the listings of this crawl, for each folder
+        [st_mtime_ns, folder names, file names]
+    :return: a generator of (root, dirs, files) tuples
+    """
+    racy_mtime_ns = time_ns() - CrawlCache.RACY_WINDOW_NS
+    folders = [path.rstrip('/') or '/']
+    while folders:
+        folder = folders.pop()
+        try:
+            mtime_ns = stat(folder).st_mtime_ns
+        except OSError:
+            continue  # Removed while it was walked
+
+        cached_listing = cached_listings.get(folder)
+        if cached_listing is not None and cached_listing[0] == mtime_ns:
+            dirs, files = list(cached_listing[1]), list(cached_listing[2])
+        else:
+            dirs, files = [], []
+            try:
+                with scandir(folder) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        (dirs if is_dir else files).append(entry.name)
+            except OSError:
+                continue
+
+        listings[folder] = [
+            mtime_ns if mtime_ns < racy_mtime_ns else None,
+            list(dirs),
+            list(files)
+        ]
+        yield folder, dirs, files
+
+        # Walk the folders left in dirs, in listing order
+        for folder_name in reversed(dirs):
+            sub_folder = folder.rstrip('/') + '/' + folder_name
+            if not islink(sub_folder):
+                folders.append(sub_folder)
+
+
+def _get_cache_file(crawl_cache_path: str, path: str) -> str:
+    # Named by a hash of the crawl root, so every root has its own file
+    cache_name = sha1(
+        (path.rstrip('/') or '/').encode(errors='surrogateescape')).hexdigest()
+    return str(Path(crawl_cache_path, f'{cache_name}.json'))
@@ -0,0 +1,78 @@
+# Group file records by size and hash with a fixed amount of memory
+
+# imports, python
+from heapq import merge
+from itertools import groupby
+from os import makedirs
+from tempfile import TemporaryDirectory
+import pickle
+
+# imports, project
+from src.enumerations import ExternalSort
+
+
+def iter_sorted_groups(records, run_size: int, run_path: str = ''):
+    """Group (size, hash, path) records that share a size and hash
+
+    Records are sorted in runs of at most run_size, each run is written to
+        its own file, then the runs are merged with a k-way heap merge. Only
+        one run and one record per open run are held in memory at a time.
+
+    :param records: an iterable of (size, hash, path) tuples
+    :param run_size: the number of records sorted in memory at a time
+    :param run_path: folder the run files are written to, the system
+        temporary folder if empty
+    :return: a generator of (hash, paths) tuples for groups of two or more
+        files, in (size, hash) order, paths sorted within each group
+    """
+    if run_path:
+        makedirs(run_path, exist_ok=True)
+    with TemporaryDirectory(prefix='sort_', dir=run_path or None) as run_dir:
+        run_files = []
+        run = []
+        for record in records:
+            run.append(record)
+            if len(run) >= run_size:
+                run_files.append(_write_run(run_dir, len(run_files), run))
+                run = []
+        if run:
+            run_files.append(_write_run(run_dir, len(run_files), run))
+        del run
+
+        # Merge in passes when there are more runs than files kept open
+        while len(run_files) > ExternalSort.MAX_OPEN_RUNS:
+            merged_run_files = []
+            for run_idx in range(0, len(run_files), ExternalSort.MAX_OPEN_RUNS):
+                merged_run_files.append(_write_run(
+                    run_dir,
+                    f'{len(run_files)}_{run_idx}',
+                    merge(*[_read_run(run_file) for run_file in
+                            run_files[run_idx:run_idx + ExternalSort.MAX_OPEN_RUNS]]),
+                    presorted=True))
+            run_files = merged_run_files
+
+        sorted_records = merge(*[_read_run(run_file) for run_file in run_files])
+        for (_, file_hash), group in groupby(
+                sorted_records, key=lambda record: record[:2]):
+            paths = [record[2] for record in group]
+            if len(paths) > 1:
+                yield file_hash, paths
+
+
+def _read_run(run_file: str):
+    with open(run_file, 'rb') as rf:
+        while True:
+            try:
+                yield pickle.load(rf)
+            except EOFError:
+                return
+
+
+def _write_run(run_dir: str, run_id, records, presorted=False) -> str:
+    run_file = f'{run_dir}/{run_id}.run'
+    if not presorted:
+        records = sorted(records)
+    with open(run_file, 'wb') as rf:
+        for record in records:
+            pickle.dump(record, rf, pickle.HIGHEST_PROTOCOL)
+    return run_file
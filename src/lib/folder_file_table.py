@@ -0,0 +1,74 @@
+# File metadata kept in memory, grouped by folder so folder paths are held once
+
+# imports, python
+from collections.abc import MutableMapping
+
+
+class FolderFileTable(MutableMapping):
+    """The files of one collection, as a mapping of path to file metadata
+
+    Files are stored as folder path to file name to file metadata, each
+        folder path is held once however many files it holds, and file paths
+        are only joined back together when they are read. Paths read out of
+        the table, such as those of duplicate records, are full strings.
+    """
+
+    def __init__(self):
+        self._folders = {}
+        self._file_count = 0
+
+    def __getitem__(self, path: str) -> dict:
+        folder, _, file_name = path.rpartition('/')
+        try:
+            return self._folders[folder][file_name]
+        except KeyError:
+            raise KeyError(path) from None
+
+    def __setitem__(self, path: str, file_metadata: dict) -> None:
+        folder, _, file_name = path.rpartition('/')
+        files = self._folders.get(folder)
+        if files is None:
+            files = self._folders[folder] = {}
+        if file_name not in files:
+            self._file_count += 1
+        files[file_name] = file_metadata
+
+    def __delitem__(self, path: str) -> None:
+        folder, _, file_name = path.rpartition('/')
+        files = self._folders.get(folder)
+        if files is None or file_name not in files:
+            raise KeyError(path)
+        del files[file_name]
+        self._file_count -= 1
+        if not files:
+            del self._folders[folder]
+
+    def __contains__(self, path) -> bool:
+        folder, _, file_name = path.rpartition('/')
+        return file_name in self._folders.get(folder, ())
+
+    def __iter__(self):
+        for folder, files in self._folders.items():
+            for file_name in files:
+                yield folder + '/' + file_name
+
+    def __len__(self) -> int:
+        return self._file_count
+
+    def items(self):
+        """Iterate over the files and their metadata, without looking them up"""
+        for folder, files in self._folders.items():
+            for file_name, file_metadata in files.items():
+                yield folder + '/' + file_name, file_metadata
+
+    def entries(self):
+        """Iterate over the files as (folder, file name) tuples and their
+            metadata, the tuples share the folder and file name strings held
+            by the table"""
+        for folder, files in self._folders.items():
+            for file_name, file_metadata in files.items():
+                yield (folder, file_name), file_metadata
+
+    def values(self):
+        for files in self._folders.values():
+            yield from files.values()
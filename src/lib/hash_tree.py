@@ -0,0 +1,189 @@
+# Block tree hashing, to hash single huge files in parallel and resumably
+
+# imports, python
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from os import makedirs
+from os import replace
+from pathlib import Path
+from time import monotonic
+import json
+import os
+
+# imports, project
+from src.enumerations import HashTree
+from src.enumerations import ReadMode
+from src.lib.reading import is_sparse
+from src.lib.reading import read_sparse_chunks
+
+
+def generate_tree_hash(path: str,
+                       file_key: tuple,
+                       hasher_algo,
+                       hash_algo_name: str,
+                       block_size: int,
+                       buf_size: int,
+                       workers: int,
+                       state_path: str = '',
+                       read_mode: str = ReadMode.BUFFERED,
+                       on_block=None,
+                       sparse: bool = False) -> str:
+    """Hash a file as a tree of fixed size blocks
+
+    Each block is hashed on its own, in parallel, and the root is the hash
+        of the concatenated block digests. Block digests are saved to
+        state_path as they complete, so an interrupted hash resumes with
+        the blocks that are left. The saved blocks are only reused while
+        the file identity is unchanged.
+
+    Root digests differ from whole file digests, files of equal size always
+        use the same mode so duplicates are still found.
+
+    :param path: the path to a file
+    :param file_key: the file identity, (st_dev, st_ino, st_size, st_mtime_ns)
+    :param hasher_algo: the hashlib constructor
+    :param hash_algo_name: the name of the hash algorithm, saved with the state
+    :param block_size: the size of each block
+    :param buf_size: the size of each read within a block
+    :param workers: the number of blocks hashed at the same time
+    :param state_path: folder the block digests are saved to, empty to disable
+    :param read_mode: a ReadMode value, blocks are evicted from the page cache
+        once hashed unless BUFFERED
+    :param on_block: called with the block size each time a block completes
+    :param sparse: whether to skip reading the holes of a sparse file
+    :return: the root hash string
+    """
+    file_size = file_key[2]
+    block_count = max(1, -(-file_size // block_size))
+    state_file = _get_state_file(state_path, file_key)
+    state = _load_state(state_file, file_key, hash_algo_name, block_size)
+    block_digests = state[HashTree.BLOCKS]
+
+    # Report the blocks recovered from a previous run
+    if on_block is not None:
+        for block_idx in block_digests:
+            on_block(_get_block_length(block_idx, block_size, file_size))
+
+    pending_blocks = [block_idx for block_idx in range(block_count)
+                      if block_idx not in block_digests]
+    if pending_blocks:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            sparse = sparse and is_sparse(os.fstat(fd))
+            with ThreadPoolExecutor(
+                    max_workers=workers,
+                    thread_name_prefix='hash_tree') as executor:
+                block_hashes = {
+                    executor.submit(
+                        _hash_block, fd, hasher_algo, block_idx,
+                        block_size, file_size, buf_size, read_mode,
+                        sparse): block_idx
+                    for block_idx in pending_blocks}
+                last_save = monotonic()
+                try:
+                    for block_hash in as_completed(block_hashes):
+                        block_idx = block_hashes[block_hash]
+                        block_digests[block_idx] = block_hash.result()
+                        if on_block is not None:
+                            on_block(_get_block_length(
+                                block_idx, block_size, file_size))
+                        if monotonic() - last_save > HashTree.SAVE_INTERVAL:
+                            _save_state(state_file, state)
+                            last_save = monotonic()
+                finally:
+                    # Keep the completed blocks, even when interrupted
+                    for block_hash in block_hashes:
+                        block_hash.cancel()
+                    _save_state(state_file, state)
+        finally:
+            os.close(fd)
+
+    hasher = hasher_algo()
+    for block_idx in range(block_count):
+        hasher.update(bytes.fromhex(block_digests[block_idx]))
+    return hasher.hexdigest()
+
+
+def _get_block_length(block_idx: int, block_size: int, file_size: int) -> int:
+    return max(0, min(block_size, file_size - block_idx * block_size))
+
+
+def _get_state_file(state_path: str, file_key: tuple):
+    if not state_path:
+        return None
+    st_dev, st_ino = file_key[:2]
+    return str(Path(state_path, f'{st_dev}_{st_ino}.json'))
+
+
+def _hash_block(fd: int,
+                hasher_algo,
+                block_idx: int,
+                block_size: int,
+                file_size: int,
+                buf_size: int,
+                read_mode: str,
+                sparse: bool) -> str:
+    """Hash a single block of a file, reading it with positional reads so
+        blocks can share the file descriptor
+
+    :return: the block hash string
+    """
+    hasher = hasher_algo()
+    block_start = offset = block_idx * block_size
+    block_end = min(block_start + block_size, file_size)
+    if sparse:
+        for data in read_sparse_chunks(fd, block_start, block_end, buf_size):
+            hasher.update(data)
+    else:
+        while offset < block_end:
+            data = os.pread(fd, min(buf_size, block_end - offset), offset)
+            if not data:
+                break  # The file was truncated while it was hashed
+            hasher.update(data)
+            offset += len(data)
+    if read_mode != ReadMode.BUFFERED:
+        os.posix_fadvise(fd, block_start, block_end - block_start,
+                         os.POSIX_FADV_DONTNEED)
+    return hasher.hexdigest()
+
+
+def _load_state(state_file,
+                file_key: tuple,
+                hash_algo_name: str,
+                block_size: int) -> dict:
+    """Load the saved block digests, discarding them if the file has changed
+        or they were made with other settings
+
+    :return: the block tree state
+    """
+    state = {
+        HashTree.FILE_KEY: list(file_key),
+        HashTree.HASH_ALGO: hash_algo_name,
+        HashTree.BLOCK_SIZE: block_size,
+        HashTree.BLOCKS: {}
+    }
+    if state_file is None:
+        return state
+    try:
+        with open(state_file) as sf:
+            saved_state = json.load(sf)
+    except (OSError, ValueError):
+        return state
+    for key in (HashTree.FILE_KEY, HashTree.HASH_ALGO, HashTree.BLOCK_SIZE):
+        if saved_state.get(key) != state[key]:
+            return state
+    state[HashTree.BLOCKS] = {
+        int(block_idx): block_digest
+        for block_idx, block_digest in saved_state[HashTree.BLOCKS].items()}
+    return state
+
+
+def _save_state(state_file, state: dict) -> None:
+    """Atomically save the block tree state"""
+    if state_file is None:
+        return
+    makedirs(str(Path(state_file).parent), exist_ok=True)
+    state_file_tmp = state_file + '.tmp'
+    with open(state_file_tmp, 'w') as sf:
+        json.dump(state, sf)
+    replace(state_file_tmp, state_file)
@@ -0,0 +1,151 @@
+# Benchmark hash algorithms and read sizes, to pick the fastest for each host
+#   and device
+
+# imports, python
+from hashlib import blake2b
+from hashlib import blake2s
+from hashlib import md5
+from hashlib import sha1
+from hashlib import sha256
+from hashlib import sha512
+from os import makedirs
+from os import replace
+from os.path import dirname
+from time import perf_counter
+import json
+import os
+
+# imports, project
+from src.enumerations import Hash
+from src.enumerations import HashTune
+from src.lib.reading import read_file_chunks
+
+_HASHER_ALGOS = {
+    Hash.BLAKE2B: blake2b,
+    Hash.BLAKE2S: blake2s,
+    Hash.MD5: md5,
+    Hash.SHA1: sha1,
+    Hash.SHA256: sha256,
+    Hash.SHA512: sha512
+}
+
+
+def get_hasher_algo(hash_algo: str):
+    """Get the hashlib constructor of a hash algorithm
+
+    :param hash_algo: a Hash value
+    :return: the hashlib constructor
+    :raises RuntimeError: for an unknown algorithm
+    """
+    if hash_algo not in _HASHER_ALGOS:
+        raise RuntimeError(f'Unknown hash_algo value set : {hash_algo}')
+    return _HASHER_ALGOS[hash_algo]
+
+
+def get_device_name(st_dev: int, disk_state: dict) -> str:
+    """Name a device so it is recognised across reboots, where st_dev numbers
+        may change
+
+    :param st_dev: the device number of a file
+    :param disk_state: see system_manager.read_disk_state
+    :return: the mount source of the device, or major:minor if not mounted
+    """
+    device = f'{os.major(st_dev)}:{os.minor(st_dev)}'
+    for source, disk_details in disk_state.items():
+        if disk_details['Device'] == device:
+            return source
+    return device
+
+
+def get_host_name() -> str:
+    return os.uname().nodename
+
+
+def load_hash_tune(tune_file: str) -> dict:
+    """Load the tuned settings of every host
+
+    :param tune_file: the file the settings are saved to
+    :return: for each host, its HASH_ALGO and the BUF_SIZE of each of its
+        DEVICES, empty if none are saved
+    """
+    try:
+        with open(tune_file) as tf:
+            return json.load(tf)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_hash_tune(tune_file: str, hash_tune: dict) -> None:
+    """Atomically save the tuned settings, see load_hash_tune
+
+    :param tune_file: the file to save the settings to
+    :param hash_tune: the tuned settings of every host
+    """
+    if dirname(tune_file):
+        makedirs(dirname(tune_file), exist_ok=True)
+    tune_file_tmp = tune_file + '.tmp'
+    with open(tune_file_tmp, 'w') as tf:
+        json.dump(hash_tune, tf, indent=2)
+    replace(tune_file_tmp, tune_file)
+
+
+def tune_hash_algo(hash_algos: list) -> str:
+    """Find the fastest hash algorithm on this host
+
+    Hashing speed depends on the processor and not on the data, so each
+        algorithm hashes the same buffer in memory, away from any device.
+
+    :param hash_algos: the Hash values to compare
+    :return: the fastest of them
+    """
+    data = memoryview(os.urandom(HashTune.ALGO_SAMPLE_SIZE))
+    algo_seconds = {}
+    for hash_algo in hash_algos:
+        hasher = get_hasher_algo(hash_algo)()
+        hash_start = perf_counter()
+        for offset in range(0, len(data), HashTune.ALGO_CHUNK_SIZE):
+            hasher.update(data[offset:offset + HashTune.ALGO_CHUNK_SIZE])
+        algo_seconds[hash_algo] = perf_counter() - hash_start
+        print(f'{hash_algo} hashes '
+              f'{len(data) / algo_seconds[hash_algo] / 1e6:.1f} MB/s')
+    return min(algo_seconds, key=algo_seconds.get)
+
+
+def tune_buf_size(sample_files: list, hasher_algo, buf_size: int) -> int:
+    """Find the fastest read size for hashing files of a device
+
+    The read sizes tried are multiples of the device block size, along with
+        the configured one. The sample is evicted from the page cache before
+        each read, so every read size reads from the device.
+
+    :param sample_files: files of the device to read
+    :param hasher_algo: the hashlib constructor of the hash algorithm
+    :param buf_size: the configured read size
+    :return: the fastest read size
+    """
+    block_size = os.stat(sample_files[0]).st_blksize
+    buf_sizes = sorted({buf_size, *(
+        block_size * multiple for multiple in HashTune.BLOCK_SIZE_MULTIPLES
+        if block_size * multiple <= HashTune.MAX_BUF_SIZE)})
+    buf_seconds = {}
+    for candidate_buf_size in buf_sizes:
+        _evict(sample_files)
+        hash_start = perf_counter()
+        for sample_file in sample_files:
+            hasher = hasher_algo()
+            for data in read_file_chunks(sample_file, candidate_buf_size):
+                hasher.update(data)
+        buf_seconds[candidate_buf_size] = perf_counter() - hash_start
+    return min(buf_seconds, key=buf_seconds.get)
+
+
+def _evict(sample_files: list) -> None:
+    for sample_file in sample_files:
+        try:
+            fd = os.open(sample_file, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
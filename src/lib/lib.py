@@ -1,12 +1,19 @@
 # General purpose functions
 
 # imports, python
+from fnmatch import translate
+from os import lstat
 from os import stat
 from os import walk
-from os.path import exists
-from os.path import islink
+from stat import S_ISLNK
+import re
 from src.enumerations import Command
+from src.enumerations import CrawlFilter
 from src.enumerations import FileAttribute
+from src.enumerations import ParentPolicy
+from src.lib.crawl_cache import load_crawl_cache
+from src.lib.crawl_cache import save_crawl_cache
+from src.lib.crawl_cache import walk_with_cache
 import shutil
 import sys
 
@@ -22,6 +29,83 @@ def build_soft_link_command(path_to_target: str, soft_link_name: str) -> list:
     return [* Command.SoftLink.root, path_to_target, path_to_soft_link]
 
 
+def build_parent_selection_key(policies: list,
+                               preferred_prefixes: list,
+                               collection_metadata: dict):
+    """Build a key function that ranks files by their fitness as the parent of
+        a duplicate group, the lowest key is the best parent
+
+    All policies are evaluated in a single key, so selecting a parent from a
+        group of k files costs k key evaluations.
+
+    :param policies: ParentPolicy values, later policies only break ties
+    :param preferred_prefixes: folders preferred for parents, most preferred first
+    :param collection_metadata: the file metadata, used for modification times
+    :return: a key function for min and sorted
+    """
+    preferred_prefixes = [prefix.rstrip('/') + '/' for prefix in preferred_prefixes]
+
+    def preferred_prefix(file: str) -> int:
+        for idx, prefix in enumerate(preferred_prefixes):
+            if file.startswith(prefix):
+                return idx
+        return len(preferred_prefixes)
+
+    policy_keys = {
+        ParentPolicy.ALPHABETICAL: lambda file: file,
+        ParentPolicy.FEWEST_COMPONENTS: lambda file: file.count('/'),
+        ParentPolicy.OLDEST_MTIME: lambda file: collection_metadata[
+            file][FileAttribute.ST_MTIME_NS],
+        ParentPolicy.PREFERRED_PREFIX: preferred_prefix,
+        ParentPolicy.SHORTEST_PATH: len,
+    }
+    for policy in policies:
+        if policy not in policy_keys:
+            raise RuntimeError(f'Unknown parent selection policy : {policy}')
+    keys = [policy_keys[policy] for policy in policies]
+    # The path itself settles any remaining tie, keeping selection stable
+    keys.append(policy_keys[ParentPolicy.ALPHABETICAL])
+
+    def parent_selection_key(file: str) -> tuple:
+        return tuple(key(file) for key in keys)
+
+    return parent_selection_key
+
+
+def compile_crawl_filters(include: list, exclude: list) -> dict:
+    """Compile the include and exclude patterns once, before crawling
+
+    :param include: patterns of files to read, empty to read every file
+    :param exclude: patterns of files and folders to skip
+    :return: the compiled filters, None where no patterns are set
+    """
+    return {
+        CrawlFilter.INCLUDE: _compile_crawl_patterns(include),
+        CrawlFilter.EXCLUDE: _compile_crawl_patterns(exclude)
+    }
+
+
+def _compile_crawl_patterns(patterns: list):
+    """Combine crawl patterns into a single regular expression, matched
+        against paths relative to the crawl root
+
+    :param patterns: glob patterns, or regular expressions prefixed with 're:'
+    :return: the compiled expression, or None if there are no patterns
+    """
+    if not patterns:
+        return None
+    expressions = []
+    for pattern in patterns:
+        if pattern.startswith(CrawlFilter.REGEX_PREFIX):
+            expression = pattern[len(CrawlFilter.REGEX_PREFIX):]
+            expressions.append(f'.*(?:{expression}).*')
+        elif '/' in pattern:
+            expressions.append(translate(pattern.strip('/')))
+        else:
+            expressions.append('(?:.*/)?' + translate(pattern))
+    return re.compile('|'.join(f'(?:{expression})' for expression in expressions))
+
+
 def convert_filepath_to_filename(file_path: str) -> str:
     """Replaces /'s with _'s to convert a filepath into a filename
 
@@ -44,32 +128,141 @@ def convert_filepath_to_soft_link_name(file_path: str) -> str:
     return soft_link_name
 
 
-def read_all_files(path: str, skip_soft_links: bool) -> dict:
-    """Recursively fetch all files in a path
+def iter_all_files(path: str,
+                   skip_soft_links: bool,
+                   file_size_min: int = 0,
+                   file_size_max: int = 0,
+                   crawl_filters: dict = None,
+                   crawl_root: str = '',
+                   crawl_cache_path: str = ''):
+    """Recursively fetch all files in a path, one file at a time as each
+        folder is listed
 
     :param path: the path to recursively crawl
     :param skip_soft_links: a toggle to ignore soft links
-    :return: a dictionary of all files, with their file size
+    :param file_size_min: files smaller than this are skipped, 0 for no limit
+    :param file_size_max: files larger than this are skipped, 0 for no limit
+    :param crawl_filters: see compile_crawl_filters, excluded folders are
+        pruned before they are listed
+    :param crawl_root: the folder the crawl filters are relative to, path if
+        empty, for crawling only part of a collection
+    :param crawl_cache_path: folder the folder listings are saved to between
+        crawls, folders unchanged since the last crawl are not listed again,
+        an empty value disables saving
+    :return: a generator of (file path, file details) tuples, see
+        read_file_details
     """
-    all_files = {}
-    for root, _, files in walk(path):
+    exclude = crawl_filters[CrawlFilter.EXCLUDE] if crawl_filters else None
+    # Normalised once, so a trailing slash changes neither the paths nor
+    #   how the crawl filters match them
+    path = path.rstrip('/') or '/'
+    root_len = len((crawl_root or path).rstrip('/')) + 1
+
+    listings = {}
+    if crawl_cache_path:
+        walker = walk_with_cache(
+            path, load_crawl_cache(crawl_cache_path, path), listings)
+    else:
+        walker = walk(path)
+    for root, dirs, files in walker:
         sys.stdout.write(f'\rReading files in {root}')
+        relative_root = root[root_len:] + '/' if len(root) > root_len else ''
+        root = root.rstrip('/')
+        if exclude:
+            # Prune in place so walk never descends into excluded folders
+            dirs[:] = [folder for folder in dirs
+                       if not exclude.fullmatch(relative_root + folder)]
         for file in files:
+            if not is_crawled(relative_root + file, crawl_filters):
+                continue
             file_path = root + '/' + file
-            if exists(file_path):
-                if skip_soft_links and islink(file_path):
-                    # print(f'Skipping soft-link {file_path} ')
-                    continue
-                file_stat = stat(file_path)
-                # TODO compare sizes against size limits
-                all_files[file_path] = {
-                    FileAttribute.ST_SIZE: file_stat.st_size
-                }
-            else:
+            try:
+                file_details = read_file_details(
+                    file_path, skip_soft_links, file_size_min, file_size_max)
+            except FileNotFoundError:
                 print(f'Error, file does not exist : {file_path}')
+                continue
+            if file_details is not None:
+                yield file_path, file_details
+    if crawl_cache_path:
+        save_crawl_cache(crawl_cache_path, path, listings)
+
+
+def read_all_files(path: str,
+                   skip_soft_links: bool,
+                   file_size_min: int = 0,
+                   file_size_max: int = 0,
+                   crawl_filters: dict = None,
+                   all_files=None,
+                   crawl_root: str = '',
+                   crawl_cache_path: str = '') -> dict:
+    """Recursively fetch all files in a path, see iter_all_files
+
+    :param all_files: a mapping to add the files to, a new dictionary if None
+    :return: a dictionary of all files, with their file size and identity
+    """
+    if all_files is None:
+        all_files = {}
+    for file_path, file_details in iter_all_files(
+            path,
+            skip_soft_links,
+            file_size_min,
+            file_size_max,
+            crawl_filters,
+            crawl_root,
+            crawl_cache_path):
+        all_files[file_path] = file_details
     return all_files
 
 
+def read_file_details(file_path: str,
+                      skip_soft_links: bool,
+                      file_size_min: int = 0,
+                      file_size_max: int = 0):
+    """Get the size and identity of a single file
+
+    :param file_path: the path to a file
+    :param skip_soft_links: a toggle to ignore soft links
+    :param file_size_min: files smaller than this are skipped, 0 for no limit
+    :param file_size_max: files larger than this are skipped, 0 for no limit
+    :return: the file details, or None if the file is skipped
+    """
+    file_stat = lstat(file_path)
+    if S_ISLNK(file_stat.st_mode):
+        if skip_soft_links:
+            # print(f'Skipping soft-link {file_path} ')
+            return None
+        file_stat = stat(file_path)
+    if file_size_min and file_stat.st_size < file_size_min:
+        return None
+    if file_size_max and file_stat.st_size > file_size_max:
+        return None
+    return {
+        FileAttribute.ST_DEV: file_stat.st_dev,
+        FileAttribute.ST_INO: file_stat.st_ino,
+        FileAttribute.ST_MTIME_NS: file_stat.st_mtime_ns,
+        FileAttribute.ST_SIZE: file_stat.st_size
+    }
+
+
+def is_crawled(relative_path: str, crawl_filters: dict = None) -> bool:
+    """Check a file against the crawl filters
+
+    :param relative_path: the path to a file, relative to the crawl root
+    :param crawl_filters: see compile_crawl_filters
+    :return: True if the file is read
+    """
+    if not crawl_filters:
+        return True
+    include = crawl_filters[CrawlFilter.INCLUDE]
+    exclude = crawl_filters[CrawlFilter.EXCLUDE]
+    if exclude and exclude.fullmatch(relative_path):
+        return False
+    if include and not include.fullmatch(relative_path):
+        return False
+    return True
+
+
 def loading_dialog(percentage: float, terminal_dialog_padding: int) -> str:
     """Construct the loading dialog from a percentage, taking into account
         the width of the parent terminal
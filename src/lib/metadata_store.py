@@ -0,0 +1,278 @@
+# Disk backed storage for file metadata that does not fit in memory
+
+# imports, python
+from collections.abc import MutableMapping
+from os import makedirs
+from os.path import dirname
+from threading import RLock
+import json
+import sqlite3
+
+# imports, project
+from src.enumerations import FileAttribute
+from src.enumerations import MetadataKey as mk
+
+# File metadata keys stored in their own columns, others are stored as json
+_COLUMNS = {
+    FileAttribute.ST_SIZE: 'size',
+    FileAttribute.ST_DEV: 'dev',
+    FileAttribute.ST_INO: 'ino',
+    FileAttribute.ST_MTIME_NS: 'mtime_ns',
+    mk.HASH: 'hash',
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    collection TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    dev INTEGER,
+    ino INTEGER,
+    mtime_ns INTEGER,
+    hash TEXT,
+    extra TEXT,
+    UNIQUE (collection, file_type, path)
+);
+CREATE INDEX IF NOT EXISTS files_by_size ON files (collection, file_type, size);
+CREATE INDEX IF NOT EXISTS files_by_hash ON files (hash);
+CREATE INDEX IF NOT EXISTS files_by_inode ON files (dev, ino);
+CREATE TABLE IF NOT EXISTS hash_cache (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns)
+);
+"""
+
+
+class SqliteMetadataStore:
+    """An embedded SQLite database holding the file metadata of every
+        collection, indexed by size and by hash
+
+    Writes are committed in batches. Long reads stream from their own
+        connection, which sees the last committed state, so memory use does
+        not grow with the number of files.
+    """
+
+    def __init__(self, path: str, batch_size: int):
+        """Open or create the database, discarding any previous run's hashes
+
+        :param path: the database file
+        :param batch_size: the number of writes per transaction
+        """
+        print(f'Init {self.__class__.__name__}')
+        if dirname(path):
+            makedirs(dirname(path), exist_ok=True)
+        self._path = path
+        self._batch_size = batch_size
+        self._lock = RLock()
+        self._pending_writes = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript('PRAGMA journal_mode=WAL;')
+        self._connection.executescript('PRAGMA synchronous=OFF;')
+        self._connection.executescript(_SCHEMA)
+        self.clear_hash_cache()
+        self._connection.commit()
+
+    def clear_collection(self, collection_name: str) -> None:
+        self.write('DELETE FROM files WHERE collection = ?', (collection_name,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def files(self, collection_name: str, file_type: str):
+        """Get the file metadata of a collection as a mapping of path to
+            file metadata
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :return: a SqliteFileTable
+        """
+        return SqliteFileTable(self, collection_name, file_type)
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        """Run a short read on the shared connection, seeing pending writes"""
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def stream(self, sql: str, params: tuple = ()):
+        """Run a long read on its own connection, yielding rows as they are
+            read, pending writes are committed first"""
+        self.commit()
+        connection = sqlite3.connect(self._path)
+        try:
+            yield from connection.execute(sql, params)
+        finally:
+            connection.close()
+
+    def write(self, sql: str, params: tuple = ()) -> None:
+        with self._lock:
+            self._connection.execute(sql, params)
+            self._pending_writes += 1
+            if self._pending_writes >= self._batch_size:
+                self.commit()
+
+    # Hash cache
+
+    def clear_hash_cache(self) -> None:
+        self.write('DELETE FROM hash_cache')
+
+    def get_cached_hash(self, file_key: tuple):
+        rows = self.query(
+            'SELECT hash FROM hash_cache '
+            'WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?',
+            file_key)
+        return rows[0][0] if rows else None
+
+    def set_cached_hash(self, file_key: tuple, file_hash: str) -> None:
+        self.write(
+            'INSERT OR REPLACE INTO hash_cache '
+            '(dev, ino, size, mtime_ns, hash) VALUES (?, ?, ?, ?, ?)',
+            (*file_key, file_hash))
+
+    # Digest index
+
+    def get_collections_holding(self, digest: str) -> list:
+        rows = self.query(
+            'SELECT DISTINCT collection FROM files WHERE hash = ?', (digest,))
+        return [row[0] for row in rows]
+
+    def get_files_by(self, collection_name: str, file_type: str,
+                     **columns) -> list:
+        """Get the files of a collection whose columns hold these values
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :param columns: column names and values, see _COLUMNS
+        :return: the paths of the matching files
+        """
+        conditions = ''.join(f' AND {column} = ?' for column in columns)
+        rows = self.query(
+            f'SELECT path FROM files WHERE collection = ? AND file_type = ?'
+            f'{conditions} ORDER BY path',
+            (collection_name, file_type, *columns.values()))
+        return [row[0] for row in rows]
+
+    def get_cross_collection_duplicates(self) -> dict:
+        cross_collection_duplicates = {}
+        for digest, collection_name, path in self.stream(
+                'SELECT hash, collection, path FROM files WHERE hash IN ('
+                '    SELECT hash FROM files WHERE hash IS NOT NULL'
+                '    GROUP BY hash'
+                '    HAVING COUNT(DISTINCT collection) > 1'
+                '    AND COUNT(DISTINCT dev || \':\' || ino) > 1) '
+                'ORDER BY hash'):
+            cross_collection_duplicates.setdefault(
+                digest, {}).setdefault(collection_name, []).append(path)
+        return cross_collection_duplicates
+
+    def iter_hash_groups(self, collection_name: str, file_type: str):
+        """Stream the files of a collection that share a hash with another
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :return: a generator of (hash, paths) tuples
+        """
+        group_hash, group_paths = None, []
+        for file_hash, path in self.stream(
+                'SELECT hash, path FROM files '
+                'WHERE collection = ? AND file_type = ? AND hash IN ('
+                '    SELECT hash FROM files'
+                '    WHERE collection = ? AND file_type = ?'
+                '    AND hash IS NOT NULL'
+                '    GROUP BY hash HAVING COUNT(*) > 1) '
+                'ORDER BY hash, rowid',
+                (collection_name, file_type) * 2):
+            if file_hash != group_hash and group_paths:
+                yield group_hash, group_paths
+                group_paths = []
+            group_hash = file_hash
+            group_paths.append(path)
+        if group_paths:
+            yield group_hash, group_paths
+
+
+class SqliteFileTable(MutableMapping):
+    """The files of one collection, as a mapping of path to file metadata
+
+    Values are copies, a changed value must be assigned back to be saved.
+    """
+
+    def __init__(self, store: SqliteMetadataStore, collection_name: str,
+                 file_type: str):
+        self._store = store
+        self._collection_name = collection_name
+        self._file_type = file_type
+        self._where = 'collection = ? AND file_type = ?'
+        self._params = (collection_name, file_type)
+
+    def __getitem__(self, path: str) -> dict:
+        rows = self._store.query(
+            f'SELECT size, dev, ino, mtime_ns, hash, extra FROM files '
+            f'WHERE {self._where} AND path = ?', (*self._params, path))
+        if not rows:
+            raise KeyError(path)
+        return _decode_row(rows[0])
+
+    def __setitem__(self, path: str, file_metadata: dict) -> None:
+        columns = [file_metadata.get(key) for key in _COLUMNS]
+        extra = {key: value for key, value in file_metadata.items()
+                 if key not in _COLUMNS}
+        self._store.write(
+            'INSERT INTO files '
+            '(collection, file_type, path, size, dev, ino, mtime_ns, hash, extra) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (collection, file_type, path) DO UPDATE SET '
+            'size = excluded.size, dev = excluded.dev, ino = excluded.ino, '
+            'mtime_ns = excluded.mtime_ns, hash = excluded.hash, '
+            'extra = excluded.extra',
+            (*self._params, path, *columns,
+             json.dumps(extra) if extra else None))
+
+    def __delitem__(self, path: str) -> None:
+        if path not in self:
+            raise KeyError(path)
+        self._store.write(
+            f'DELETE FROM files WHERE {self._where} AND path = ?',
+            (*self._params, path))
+
+    def __contains__(self, path) -> bool:
+        return bool(self._store.query(
+            f'SELECT 1 FROM files WHERE {self._where} AND path = ?',
+            (*self._params, path)))
+
+    def __iter__(self):
+        for row in self._store.stream(
+                f'SELECT path FROM files WHERE {self._where} ORDER BY rowid',
+                self._params):
+            yield row[0]
+
+    def __len__(self) -> int:
+        return self._store.query(
+            f'SELECT COUNT(*) FROM files WHERE {self._where}',
+            self._params)[0][0]
+
+    def items(self):
+        """Stream the files and their metadata in one read"""
+        for row in self._store.stream(
+                f'SELECT path, size, dev, ino, mtime_ns, hash, extra FROM files '
+                f'WHERE {self._where} ORDER BY rowid', self._params):
+            yield row[0], _decode_row(row[1:])
+
+
+def _decode_row(row: tuple) -> dict:
+    file_metadata = {key: value for key, value in zip(_COLUMNS, row)
+                     if value is not None}
+    if row[-1]:
+        file_metadata.update(json.loads(row[-1]))
+    return file_metadata
@@ -0,0 +1,87 @@
+# Optional profiling of the manager stages
+
+# imports, python
+from os import getcwd
+from os import makedirs
+from pathlib import Path
+import cProfile
+import pstats
+import tracemalloc
+
+
+def run_stage(conf, stage_name: str, stage, *args, **kwargs):
+    """Run a manager stage, profiling it if profiling is enabled in config
+
+    :param conf: the config manager
+    :param stage_name: a label for the stage, used to name the output files
+    :param stage: the callable to run
+    :return: the return value of the stage
+    """
+    if not conf.profile:
+        return stage(*args, **kwargs)
+    return profile_stage(
+        stage_name,
+        conf.profile_path or getcwd(),
+        conf.profile_top_allocations,
+        stage, *args, **kwargs)
+
+
+def profile_stage(stage_name: str,
+                  profile_path: str,
+                  top_allocations: int,
+                  stage, *args, **kwargs):
+    """Run a stage under cProfile and tracemalloc, then write the results
+
+    :param stage_name: a label for the stage, used to name the output files
+    :param profile_path: the folder the profile results are written to
+    :param top_allocations: the number of allocation sites to report
+    :param stage: the callable to profile
+    :return: the return value of the stage
+    """
+    print(f'Profiling stage : {stage_name}')
+    profiler = cProfile.Profile()
+    tracemalloc_was_tracing = tracemalloc.is_tracing()
+    if not tracemalloc_was_tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        return stage(*args, **kwargs)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        if not tracemalloc_was_tracing:
+            tracemalloc.stop()
+        _write_profile(stage_name, profile_path, top_allocations,
+                       profiler, snapshot)
+
+
+def _write_profile(stage_name: str,
+                   profile_path: str,
+                   top_allocations: int,
+                   profiler: cProfile.Profile,
+                   snapshot: tracemalloc.Snapshot) -> None:
+    """Dump the cProfile stats and the top allocation sites of a stage
+
+    :param stage_name: a label for the stage, used to name the output files
+    :param profile_path: the folder the profile results are written to
+    :param top_allocations: the number of allocation sites to report
+    :param profiler: the profiler that observed the stage
+    :param snapshot: the tracemalloc snapshot taken at the end of the stage
+    """
+    makedirs(profile_path, exist_ok=True)
+    stats_file = str(Path(profile_path, f'{stage_name}.pstats'))
+    allocations_file = str(Path(profile_path, f'{stage_name}.allocations.txt'))
+
+    profiler.dump_stats(stats_file)
+    print(f'Wrote profile for {stage_name} : {stats_file}')
+
+    allocation_stats = snapshot.statistics('lineno')[:top_allocations]
+    with open(allocations_file, 'w') as af:
+        af.write(f'Top {len(allocation_stats)} allocation sites '
+                 f'for {stage_name}\n')
+        for allocation_stat in allocation_stats:
+            af.write(f'{allocation_stat}\n')
+    print(f'Wrote allocations for {stage_name} : {allocations_file}')
+
+    # Summarize the slowest calls in the console
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(10)
@@ -0,0 +1,107 @@
+# Answer duplicate lookups from other programs over a Unix domain socket
+
+# imports, python
+from os import chmod
+from os import remove
+from os.path import exists
+from socketserver import StreamRequestHandler
+from socketserver import ThreadingUnixStreamServer
+from threading import Thread
+import json
+
+# imports, project
+from src.enumerations import Query
+
+
+class QueryServer(ThreadingUnixStreamServer):
+    """Serves lookups against the index of a running shepherd
+
+    Each request is one line of json, each response is one line of json, a
+        connection may send any number of requests. A request holds lists of
+        digests and paths to look up, so bulk queries are answered at once :
+        {"digests": ["5d41..."], "paths": ["/incoming/photo.jpg"]}
+    The response holds, for each digest, the files holding it in each
+        collection, and for each path, its digest and the files holding it :
+        {"digests": {"5d41...": {"archive": ["/archive/x.txt"]}},
+         "paths": {"/incoming/photo.jpg": {"digest": "..", "files": {..}}}}
+    A path is only read when a collection holds a file of the same size.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, query_digest, query_path):
+        """Bind the socket, replacing a socket left by an earlier run
+
+        :param socket_path: the path of the Unix domain socket
+        :param query_digest: called with a digest, returns the files holding
+            it in each collection
+        :param query_path: called with a path, returns its digest and the
+            files holding it in each collection
+        """
+        if exists(socket_path):
+            remove(socket_path)
+        super().__init__(socket_path, _QueryHandler)
+        chmod(socket_path, 0o600)
+        self.socket_path = socket_path
+        self.query_digest = query_digest
+        self.query_path = query_path
+        self._thread = None
+
+    def start(self) -> None:
+        """Serve in the background until stop is called"""
+        print(f'Serving queries on {self.socket_path}')
+        self._thread = Thread(
+            target=self.serve_forever, name='query_server', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if exists(self.socket_path):
+            remove(self.socket_path)
+
+    def answer(self, request: dict) -> dict:
+        """Look up every digest and path of a request
+
+        :param request: the decoded request
+        :return: the response to encode
+        :raises ValueError: when the digests or paths are not lists of strings
+        """
+        response = {}
+        digests = _get_strings(request, Query.DIGESTS)
+        if digests:
+            response[Query.DIGESTS] = {
+                digest: self.query_digest(digest) for digest in digests}
+        paths = _get_strings(request, Query.PATHS)
+        if paths:
+            response[Query.PATHS] = {}
+            for path in paths:
+                try:
+                    response[Query.PATHS][path] = self.query_path(path)
+                except OSError as exc:
+                    response[Query.PATHS][path] = {Query.ERROR: str(exc)}
+        return response
+
+
+class _QueryHandler(StreamRequestHandler):
+
+    def handle(self):
+        for request_line in self.rfile:
+            if not request_line.strip():
+                continue
+            try:
+                request = json.loads(request_line)
+                if not isinstance(request, dict):
+                    raise ValueError('A request must be a json object')
+                response = self.server.answer(request)
+            except (KeyError, OSError, TypeError, ValueError) as exc:
+                response = {Query.ERROR: str(exc)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+def _get_strings(request: dict, field: str) -> list:
+    strings = request.get(field, [])
+    if not isinstance(strings, list) or \
+            not all(isinstance(string, str) for string in strings):
+        raise ValueError(f'{field} must be a list of strings')
+    return strings
@@ -0,0 +1,232 @@
+# Strategies for reading file contents to be hashed
+
+# imports, python
+from errno import EINVAL
+from errno import ENXIO
+from mmap import PAGESIZE
+from mmap import mmap
+import os
+
+# imports, project
+from src.enumerations import Proc
+from src.enumerations import ReadMode
+
+# Shared zeros fed to hashers for the holes of sparse files
+_ZEROS = memoryview(bytes(1048576))
+
+
+def read_file_chunks(path: str,
+                     buf_size: int,
+                     read_mode: str = ReadMode.BUFFERED,
+                     drop_window: int = 0,
+                     sparse: bool = False):
+    """Read a file in chunks of at most buf_size bytes
+
+    Chunks may share a buffer, each chunk must be consumed before the next
+        one is requested.
+
+    :param path: the path to a file
+    :param buf_size: the size of each read
+    :param read_mode: a ReadMode value
+        BUFFERED reads through the page cache as usual
+        CACHE_POLITE reads sequentially and evicts what it has read
+        DIRECT bypasses the page cache, falling back to CACHE_POLITE where
+            the filesystem does not support it
+    :param drop_window: bytes read between evictions, for CACHE_POLITE
+    :param sparse: whether to skip reading the holes of sparse files, see
+        read_sparse_chunks, a sparse file read DIRECT is read CACHE_POLITE
+    :return: a generator of bytes-like chunks
+    """
+    if sparse and is_sparse(os.stat(path)):
+        yield from _read_file_chunks_sparse(path, buf_size, read_mode)
+    elif read_mode == ReadMode.BUFFERED:
+        yield from _read_file_chunks_buffered(path, buf_size)
+    elif read_mode == ReadMode.CACHE_POLITE:
+        yield from _read_file_chunks_cache_polite(path, buf_size, drop_window)
+    elif read_mode == ReadMode.DIRECT:
+        try:
+            yield from _read_file_chunks_direct(path, buf_size)
+        except _DirectReadUnsupported:
+            yield from _read_file_chunks_cache_polite(path, buf_size, drop_window)
+    else:
+        raise RuntimeError(f'Unknown read_mode : {read_mode}')
+
+
+def read_small_file(path: str,
+                    file_size: int,
+                    read_mode: str = ReadMode.BUFFERED) -> bytes:
+    """Read a small file whole, reading one byte past its expected size so
+        the end of the file is usually found by the same read
+
+    :param path: the path to a file
+    :param file_size: the size of the file when it was crawled
+    :param read_mode: a ReadMode value, the file is evicted from the page
+        cache once read unless BUFFERED, small files are never read DIRECT
+    :return: the contents of the file
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        data = os.read(fd, file_size + 1)
+        if len(data) > file_size:
+            # The file grew since it was crawled, read the rest
+            chunks = [data]
+            while data:
+                data = os.read(fd, max(file_size, PAGESIZE))
+                chunks.append(data)
+            data = b''.join(chunks)
+        if read_mode != ReadMode.BUFFERED:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return data
+    finally:
+        os.close(fd)
+
+
+def is_sparse(file_stat: os.stat_result) -> bool:
+    """Check whether a file has fewer blocks allocated than its size needs,
+        holes being the usual reason
+
+    :param file_stat: the stat of a file
+    :return: whether the file is sparse
+    """
+    return file_stat.st_blocks * 512 < file_stat.st_size
+
+
+def read_sparse_chunks(fd: int, start: int, end: int, buf_size: int):
+    """Read a range of a file in chunks of at most buf_size bytes, reading
+        only its data extents and yielding zeros for its holes, so the chunks
+        are the same bytes as a full read
+
+    Chunks of zeros may be larger than buf_size, they share one buffer and
+        cost no memory. Chunks must be consumed before the next one is
+        requested.
+
+    :param fd: an open file descriptor, read with positional reads
+    :param start: the offset to start reading from
+    :param end: the offset to stop reading at
+    :param buf_size: the size of each read
+    :return: a generator of bytes-like chunks
+    """
+    for offset, length, is_data in _iter_extents(fd, start, end):
+        extent_end = offset + length
+        while offset < extent_end:
+            if is_data:
+                data = os.pread(
+                    fd, min(buf_size, extent_end - offset), offset)
+                if not data:
+                    return  # The file was truncated while it was read
+            else:
+                data = _ZEROS[:min(len(_ZEROS), extent_end - offset)]
+            offset += len(data)
+            yield data
+
+
+def read_page_cache_size(path: str = Proc.meminfo) -> int:
+    """Get the system wide size of the page cache
+
+    :param path: the kernel memory summary
+    :return: the size of the page cache in bytes
+    """
+    with open(path) as meminfo:
+        for meminfo_line in meminfo:
+            if meminfo_line.startswith('Cached:'):
+                return int(meminfo_line.split()[1]) * 1024
+    return 0
+
+
+class _DirectReadUnsupported(Exception):
+    """Raised before any data is read when O_DIRECT cannot be used"""
+
+
+def _iter_extents(fd: int, offset: int, end: int):
+    """Find the data extents and holes of a range of a file
+
+    :return: a generator of (offset, length, is data) tuples, covering the
+        range until end, or until the end of a file truncated meanwhile
+    """
+    while offset < end:
+        try:
+            data_start = min(os.lseek(fd, offset, os.SEEK_DATA), end)
+        except OSError as exc:
+            if exc.errno != ENXIO:
+                raise
+            # No data past offset, the rest is a hole unless truncated
+            end = min(end, os.fstat(fd).st_size)
+            data_start = end
+        if data_start > offset:
+            yield offset, min(data_start, end) - offset, False
+        if data_start >= end:
+            return
+        data_end = min(os.lseek(fd, data_start, os.SEEK_HOLE), end)
+        yield data_start, data_end - data_start, True
+        offset = data_end
+
+
+def _read_file_chunks_buffered(path: str, buf_size: int):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(buf_size)
+            if not data:
+                return
+            yield data
+
+
+def _read_file_chunks_cache_polite(path: str, buf_size: int, drop_window: int):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        drop_window = max(drop_window, buf_size)
+        window_start = offset = 0
+        while True:
+            data = os.read(fd, buf_size)
+            if not data:
+                break
+            offset += len(data)
+            yield data
+
+            # Evict the window once it has been hashed
+            if offset - window_start >= drop_window:
+                os.posix_fadvise(
+                    fd, window_start, offset - window_start,
+                    os.POSIX_FADV_DONTNEED)
+                window_start = offset
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _read_file_chunks_sparse(path: str, buf_size: int, read_mode: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        yield from read_sparse_chunks(
+            fd, 0, os.fstat(fd).st_size, buf_size)
+        if read_mode != ReadMode.BUFFERED:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _read_file_chunks_direct(path: str, buf_size: int):
+    # O_DIRECT needs an aligned buffer and a read size that is a multiple of
+    #   the block size, an anonymous map is page aligned
+    buf_size = max(PAGESIZE, buf_size // PAGESIZE * PAGESIZE)
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+    except OSError as exc:
+        if exc.errno == EINVAL:
+            raise _DirectReadUnsupported from exc
+        raise
+    try:
+        # The map is left to be released with the last chunk referencing it
+        buffer = mmap(-1, buf_size)
+        view = memoryview(buffer)
+        try:
+            read_size = os.readv(fd, [buffer])
+        except OSError as exc:
+            if exc.errno == EINVAL:
+                raise _DirectReadUnsupported from exc
+            raise
+        while read_size:
+            yield view[:read_size]
+            read_size = os.readv(fd, [buffer])
+    finally:
+        os.close(fd)
@@ -0,0 +1,149 @@
+# A write-ahead journal of the unstaging actions, so an interrupted unstaging
+#   can be finished, or undone, without crawling and hashing again
+
+# imports, python
+from os import fsync
+from os import makedirs
+from os import remove
+from os.path import dirname
+from os.path import exists
+from pathlib import Path
+from threading import Lock
+import json
+
+# imports, project
+from src.enumerations import Journal
+
+
+class UnstageJournal:
+    """Appends the unstaging actions to a journal file before they are run
+
+    Every action is written, and synced to disk, before any of them is run.
+        Each action is then marked done once it has run, these marks are only
+        synced every sync_count actions, since an action found without its
+        mark is checked against the file system when the journal is replayed.
+
+    Each line of the journal is a json list :
+        [MKDIR, folder, existed], [LINK, original, soft link, existed],
+        [MOVE, file, destination] for the actions, numbered in the order they
+        are written, existed telling whether the folder or soft link was
+        there before the unstaging, then
+        [DONE, action number] as they run and [COMPLETE] once all of them
+        have run, or [ABANDONED] once resuming them has failed.
+    """
+
+    def __init__(self, journal_file: str, sync_count: int,
+                 resume: bool = False):
+        """Start a journal, replacing the journal of an earlier unstaging, or
+            resume one to mark the actions left over as done
+
+        :param journal_file: the file to write
+        :param sync_count: number of actions marked done between syncs
+        :param resume: whether to append to the journal instead
+        """
+        if dirname(journal_file):
+            makedirs(dirname(journal_file), exist_ok=True)
+        self._journal = open(journal_file, 'a' if resume else 'w',
+                             encoding='utf-8', errors='surrogateescape')
+        self._sync_count = sync_count
+        self._unsynced_count = 0
+        self._action_count = 0
+        self._lock = Lock()
+        if resume and self._journal.tell():
+            # End a line cut short by a crash, so it is read on its own
+            self._journal.write('\n')
+
+    def close(self) -> None:
+        with self._lock:
+            self._sync()
+            self._journal.close()
+
+    def abandon(self) -> None:
+        """Record that the actions left could not be run, the journal is then
+            no longer resumed, only kept to undo the actions that did run"""
+        with self._lock:
+            self._write([Journal.ABANDONED])
+            self._sync()
+
+    def complete(self) -> None:
+        """Record that every action has run, the journal is then only kept to
+            undo the unstaging"""
+        with self._lock:
+            self._write([Journal.COMPLETE])
+            self._sync()
+
+    def mark_done(self, action_number: int) -> None:
+        """Record that an action has run, called from any thread
+
+        :param action_number: the number returned by write_action
+        """
+        with self._lock:
+            self._write([Journal.DONE, action_number])
+            self._unsynced_count += 1
+            if self._unsynced_count >= self._sync_count:
+                self._sync()
+
+    def sync(self) -> None:
+        """Sync the actions written so far, they may run once this returns"""
+        with self._lock:
+            self._sync()
+
+    def write_action(self, *action) -> int:
+        """Append an action, it is only durable once sync is called
+
+        :param action: the action and its paths, see the class documentation
+        :return: the action number
+        """
+        with self._lock:
+            self._write(list(action))
+            self._action_count += 1
+            return self._action_count - 1
+
+    def _sync(self) -> None:
+        self._journal.flush()
+        fsync(self._journal.fileno())
+        self._unsynced_count = 0
+
+    def _write(self, record: list) -> None:
+        self._journal.write(
+            json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def get_journal_file(journal_path: str, collection_name: str) -> str:
+    return str(Path(journal_path, f'{collection_name}.journal'))
+
+
+def read_journal(journal_file: str) -> tuple:
+    """Read a journal written by UnstageJournal
+
+    A line cut short by a crash is ignored.
+
+    :param journal_file: the journal to read
+    :return: (actions, done action numbers, complete), actions in the order
+        they were written, complete once no action is left to resume, None
+        when there is no journal
+    """
+    if not exists(journal_file):
+        return None
+    actions = []
+    done = set()
+    complete = False
+    with open(journal_file, encoding='utf-8',
+              errors='surrogateescape') as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Cut short by a crash
+            if record[0] == Journal.DONE:
+                done.add(record[1])
+            elif record[0] in (Journal.ABANDONED, Journal.COMPLETE):
+                complete = True
+            else:
+                actions.append(record)
+    return actions, done, complete
+
+
+def remove_journal(journal_file: str) -> None:
+    if exists(journal_file):
+        remove(journal_file)
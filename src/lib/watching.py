@@ -0,0 +1,256 @@
+# Detect changes below a set of folders, with inotify where it is available
+#   and by comparing folder modification times otherwise
+
+# imports, python
+from ctypes import CDLL
+from ctypes import get_errno
+from os import fsencode
+from os import scandir
+from os import stat
+from select import select
+from time import monotonic
+from time import sleep
+import errno
+import os
+import struct
+
+# imports, project
+from src.enumerations import Watch
+
+# Kernel inotify interface, see inotify(7)
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_WATCH_MASK = (_IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+                  | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_IN_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """Watches every folder of a tree with the kernel inotify interface"""
+
+    def __init__(self):
+        """Open an inotify instance
+
+        :raises OSError: when inotify is not available
+        """
+        try:
+            self._libc = CDLL(None, use_errno=True)
+            inotify_init1 = self._libc.inotify_init1
+        except (AttributeError, OSError) as exc:
+            raise OSError(errno.ENOSYS, 'inotify is not available') from exc
+        self._fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(get_errno(), 'inotify_init1 failed')
+        self._watches = {}  # Watch descriptor to folder
+
+    def add_tree(self, path: str) -> None:
+        """Watch a folder and every folder below it
+
+        :param path: the folder to watch
+        :raises OSError: when a folder cannot be watched, for example once
+            fs.inotify.max_user_watches is reached
+        """
+        folders = [path]
+        while folders:
+            folder = folders.pop()
+            if not self._add_watch(folder):
+                continue  # Removed before it could be watched
+            try:
+                with scandir(folder) as entries:
+                    folders.extend(entry.path for entry in entries
+                                   if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def read_changes(self, timeout: float) -> tuple:
+        """Wait for changes and read them
+
+        :param timeout: the longest time to wait for a change, in seconds
+        :return: (changed paths, overflow), overflow is True when the kernel
+            dropped events and the changes are incomplete
+        """
+        changed_paths = set()
+        overflow = False
+        if not select([self._fd], [], [], timeout)[0]:
+            return changed_paths, overflow
+        while True:
+            try:
+                events = os.read(self._fd, Watch.READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(events):
+                wd, mask, _, name_len = _IN_EVENT.unpack_from(events, offset)
+                offset += _IN_EVENT.size
+                name = events[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                folder = self._watches.get(wd)
+                if mask & _IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                if folder is None:
+                    continue
+                if mask & _IN_ISDIR and mask & _IN_ATTRIB:
+                    continue  # Folder attributes, its files are unchanged
+                if not name:
+                    changed_paths.add(folder)  # The watched folder itself
+                    continue
+                path = folder + '/' + os.fsdecode(name)
+                changed_paths.add(path)
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    try:
+                        self.add_tree(path)
+                    except OSError as exc:
+                        print(f'{exc}, changes below it are only seen '
+                              f'by rescans')
+        return changed_paths, overflow
+
+    def _add_watch(self, folder: str) -> bool:
+        wd = self._libc.inotify_add_watch(
+            self._fd, fsencode(folder), _IN_WATCH_MASK | _IN_ONLYDIR)
+        if wd < 0:
+            error = get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return False
+            raise OSError(error, f'Could not watch folder : {folder}')
+        self._watches[wd] = folder
+        return True
+
+
+def iter_changes(paths: list, rescan_interval: float):
+    """Wait for changes below the paths, forever
+
+    Changes are read with inotify as they happen. Every rescan_interval the
+        folder modification times are also compared to the last rescan, to
+        catch changes inotify missed. Without inotify only the rescans are
+        used, they see files being added, removed or renamed but not files
+        changed in place.
+
+    :param paths: the folders to watch
+    :param rescan_interval: seconds between rescans
+    :return: a generator of sets of changed paths, files or folders that were
+        added, changed or removed
+    """
+    try:
+        inotify = Inotify()
+        for path in paths:
+            inotify.add_tree(path)
+        print(f'Watching {len(paths)} path(s) with inotify')
+    except OSError as exc:
+        inotify = None
+        print(f'Watching {len(paths)} path(s) by rescanning, {exc}')
+
+    folder_listings = {}
+    for path in paths:
+        folder_listings.update(scan_folders(path))
+    try:
+        next_rescan = monotonic() + rescan_interval
+        while True:
+            changed_paths = set()
+            if inotify is not None:
+                changed_paths, overflow = inotify.read_changes(
+                    max(0.0, next_rescan - monotonic()))
+                # Let a burst of changes settle, to handle it at once
+                settle_paths = changed_paths
+                while settle_paths:
+                    settle_paths, settle_overflow = inotify.read_changes(
+                        Watch.SETTLE_DELAY)
+                    changed_paths |= settle_paths
+                    overflow |= settle_overflow
+                if overflow:
+                    print(f'Watch events were dropped, rescanning')
+                    next_rescan = 0
+            else:
+                sleep(max(0.0, next_rescan - monotonic()))
+
+            if monotonic() >= next_rescan:
+                changed_paths |= rescan_folders(folder_listings)
+                next_rescan = monotonic() + rescan_interval
+            if changed_paths:
+                yield changed_paths
+    finally:
+        if inotify is not None:
+            inotify.close()
+
+
+def rescan_folders(folder_listings: dict) -> set:
+    """Find the entries added or removed since the folders were listed,
+        listing again only the folders whose modification time changed
+
+    :param folder_listings: see scan_folders, updated in place
+    :return: the paths of the entries added or removed
+    """
+    changed_paths = set()
+    for folder, (mtime_ns, entries) in list(folder_listings.items()):
+        if folder not in folder_listings:
+            continue  # Removed with a parent folder
+        try:
+            folder_mtime_ns = stat(folder).st_mtime_ns
+        except OSError:
+            folder_mtime_ns = None
+        if folder_mtime_ns == mtime_ns:
+            continue
+
+        new_listings = scan_folders(folder, recursive=False) \
+            if folder_mtime_ns is not None else {}
+        _, new_entries = new_listings.get(folder, (None, {}))
+        for name in entries.keys() | new_entries.keys():
+            if entries.get(name) == new_entries.get(name):
+                continue
+            path = folder + '/' + name
+            changed_paths.add(path)
+            if entries.get(name):
+                # A folder was removed or replaced, forget everything below it
+                for sub_folder in [sub_folder for sub_folder in folder_listings
+                                   if sub_folder == path
+                                   or sub_folder.startswith(path + '/')]:
+                    del folder_listings[sub_folder]
+            if new_entries.get(name):
+                folder_listings.update(scan_folders(path))
+        if folder_mtime_ns is None:
+            del folder_listings[folder]
+        else:
+            folder_listings[folder] = new_listings[folder]
+    return changed_paths
+
+
+def scan_folders(path: str, recursive: bool = True) -> dict:
+    """List folders along with their modification times
+
+    :param path: the folder to list
+    :param recursive: whether to list the folders below it as well
+    :return: for each folder, (st_mtime_ns, {entry name: is a folder})
+    """
+    folder_listings = {}
+    folders = [path]
+    while folders:
+        folder = folders.pop()
+        try:
+            mtime_ns = stat(folder).st_mtime_ns
+            with scandir(folder) as scanned_entries:
+                entries = {entry.name: entry.is_dir(follow_symlinks=False)
+                           for entry in scanned_entries}
+        except OSError:
+            continue  # Removed while it was listed
+        folder_listings[folder] = (mtime_ns, entries)
+        if recursive:
+            folders.extend(folder + '/' + name
+                           for name, is_folder in entries.items() if is_folder)
+    return folder_listings
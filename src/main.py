@@ -1,8 +1,13 @@
 # The python entry-point
 
+# imports, python
+import sys
+
 # imports, project
 from config.config import config
 from src.enumerations import Class
+from src.enumerations import ConfigKey
+from src.enumerations import Flag
 from src.managers.collection_manager import CollectionManager
 from src.managers.config_manager import ConfigManager
 from src.managers.file_manager import FileManager
@@ -20,6 +25,14 @@ managers = {
     Class.SYSTEM_MANAGER: SystemManager
 }
 
+# Command line flags override their config values
+if Flag.PROFILE in sys.argv[1:]:
+    config[ConfigKey.PROFILE] = True
+if Flag.UNDO_UNSTAGE in sys.argv[1:]:
+    config[ConfigKey.UNDO_UNSTAGE] = True
+if Flag.WATCH in sys.argv[1:]:
+    config[ConfigKey.WATCH] = True
+
 shepherd = Shepherd(
     config=config,
     managers=managers
@@ -2,21 +2,51 @@
 #   and the files themselves
 
 # imports, python
-from collections import namedtuple
-from hashlib import md5
-from hashlib import sha1
-import copy
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from os import lstat
+from os.path import exists
+from os.path import lexists
+from pathlib import Path
+from stat import S_ISDIR
+from threading import Lock
+from time import perf_counter
 import sys
 
 # imports, project
 from src.enumerations import CollectionType
 from src.enumerations import Class
 from src.enumerations import FileAttribute
-from src.enumerations import Hash
+from src.enumerations import HashTune
+from src.enumerations import MetadataIndex
 from src.enumerations import MetadataKey as mk
 from src.enumerations import Progress
+from src.enumerations import Query
+from src.lib.binary_index import write_binary_index
+from src.lib.hash_tree import generate_tree_hash
+from src.lib.hash_tune import get_device_name
+from src.lib.hash_tune import get_hasher_algo
+from src.lib.hash_tune import get_host_name
+from src.lib.hash_tune import load_hash_tune
+from src.lib.hash_tune import save_hash_tune
+from src.lib.hash_tune import tune_buf_size
+from src.lib.hash_tune import tune_hash_algo
+from src.lib.lib import build_parent_selection_key
+from src.lib.lib import compile_crawl_filters
+from src.lib.lib import is_crawled
+from src.lib.lib import iter_all_files
 from src.lib.lib import loading_dialog
 from src.lib.lib import read_all_files
+from src.lib.lib import read_file_details
+from src.lib.profiling import run_stage
+from src.lib.query_server import QueryServer
+from src.lib.reading import read_file_chunks
+from src.lib.reading import read_page_cache_size
+from src.lib.reading import read_small_file
+from src.lib.unstage_journal import get_journal_file
+from src.lib.watching import iter_changes
+from src.managers.system_manager import read_disk_state
 
 
 class CollectionManager:
@@ -35,7 +65,6 @@ class CollectionManager:
             source ~> graveyard
             archive ~> unstage
 
-    # TODO This feature has not been started yet
     Source Files
         "New" files that are introduced to the system must first be compared
             against every file in the archive. If the source file is found to
@@ -95,17 +124,25 @@ class CollectionManager:
         self.conf = managers[Class.CONFIG_MANAGER]
         self._debug = self.conf.debug
         self.file = managers[Class.FILE_MANAGER](managers)
-        self.meta = managers[Class.METADATA_MANAGER]()
+        meta = self.meta = managers[Class.METADATA_MANAGER](managers)
+        managers[Class.METADATA_MANAGER] = meta
         self.stage = managers[Class.STAGE_MANAGER](managers)
+        self.system = managers[Class.SYSTEM_MANAGER]
 
-        # Setup hash generator, selection defined in config
-        if self.conf.hash_algo == Hash.SHA1:
-            self.conf.hasher_algo = sha1
-        elif self.conf.hash_algo == Hash.MD5:
-            self.conf.hasher_algo = md5
-        else:
-            raise RuntimeError(f'Unknown hash_algo value set : '
-                               f'{self.conf.hash_algo}')
+        # Setup hash generator, selection defined in config or tuned for
+        #   this host
+        if self.conf.hash_auto_tune:
+            self.tune_hash_algo()
+        self.conf.hasher_algo = get_hasher_algo(self.conf.hash_algo)
+
+        # The read size of each device, tuned as their files are first hashed
+        self._device_buf_sizes = {}
+        self._device_buf_sizes_lock = Lock()
+
+        # Compile the crawl filters once, they are shared by every collection
+        self.crawl_filters = compile_crawl_filters(
+            self.conf.crawl_include,
+            self.conf.crawl_exclude)
 
     def run(self) -> None:
         """
@@ -115,14 +152,16 @@ class CollectionManager:
             If the archive is invalid, the archive will be parsed.
         """
         print(f'Running {self.__class__.__name__}')
+        collection_config = self.conf.collection_config
 
-        # Iterate through each collection
-        for collection_name, collection_paths in self.conf.collection_config.items():
-            self.meta.init_collection_metadata(collection_name, collection_paths)
-
-            self.validate_paths(collection_name)
-            self.validate_archive(collection_name)
+        # An interrupted unstaging is finished first, from its journal, before
+        #   the collections are crawled
+        self.resume_unstaging()
+        self.validate_collections()
 
+        # Files are only moved once every collection has been hashed, since
+        #   collections may overlap
+        for collection_name in collection_config:
             # If there is metadata then some duplicates were found
             collection_archive_file_metadata = \
                 self.meta.get_collection_metadata(
@@ -131,9 +170,275 @@ class CollectionManager:
 
             # TODO bug, archive metadata is never empty since files are always present
             if collection_archive_file_metadata:
-                self.unstage_archive(collection_name)
-            else:
-                pass  # TODO, handle a source
+                # Files are only moved once the system checks have passed
+                self.system.wait_until_ready()
+                run_stage(self.conf, f'{collection_name}_unstage_archive',
+                          self.unstage_archive, collection_name)
+
+            # Source files are only ingested where the source, stage and
+            #   graveyard are all set up
+            if self.validate_collection_paths(collection_name, CollectionType.SOURCE):
+                self.system.wait_until_ready()
+                run_stage(self.conf, f'{collection_name}_ingest_source',
+                          self.ingest_source, collection_name)
+
+        self.meta.close()
+
+    def resume_unstaging(self) -> None:
+        """Finish the unstaging of each collection that was interrupted, from
+            its journal"""
+        if not self.conf.unstage_journal_path:
+            return
+        journal_files = {
+            collection_name: get_journal_file(
+                self.conf.unstage_journal_path, collection_name)
+            for collection_name in self.conf.collection_config}
+        interrupted = [collection_name
+                       for collection_name, journal_file in journal_files.items()
+                       if self.stage.is_unstage_interrupted(journal_file)]
+        for collection_name in interrupted:
+            print(f'Resuming the interrupted unstaging of {collection_name}')
+            self.system.wait_until_ready()
+            run_stage(self.conf, f'{collection_name}_resume_unstage',
+                      self.stage.resume_unstage,
+                      journal_files[collection_name], self.file)
+
+    def undo_unstage(self) -> None:
+        """Move the files of the last unstaging of each collection back to
+            where they were, from its journal"""
+        print(f'Undoing {self.__class__.__name__}')
+        if not self.conf.unstage_journal_path:
+            raise RuntimeError(f'Undoing requires unstage_journal_path')
+        for collection_name in self.conf.collection_config:
+            journal_file = get_journal_file(
+                self.conf.unstage_journal_path, collection_name)
+            if not exists(journal_file):
+                print(f'No unstaging to undo for {collection_name}')
+                continue
+            self.system.wait_until_ready()
+            run_stage(self.conf, f'{collection_name}_undo_unstage',
+                      self.stage.undo_unstage, journal_file, self.file)
+        self.meta.close()
+
+    def watch(self) -> None:
+        """Validate the collections, then keep their metadata and duplicate
+            groups up to date as files change, until interrupted
+
+        Only the files that changed are read again and rehashed. Nothing is
+            unstaged while watching. If a query socket is configured, other
+            programs can look up duplicates while watching, see QueryServer.
+        """
+        print(f'Watching {self.__class__.__name__}')
+        self.validate_collections()
+        # Hashes are only shared between collections while they are hashed
+        #   together, kept for the whole watch they would grow without end
+        self.meta.clear_hash_cache()
+
+        archive_paths = {
+            self.conf.get_path_archive(collection_name).rstrip('/'): collection_name
+            for collection_name in self.conf.collection_config}
+        for collection_name in archive_paths.values():
+            # Index now, so the first change or query does not wait for it
+            for index_name in (MetadataIndex.DIGEST, MetadataIndex.SIZE):
+                self.meta.index_files(
+                    collection_name, CollectionType.ARCHIVE, index_name)
+            self.report_duplicate_groups(collection_name)
+
+        query_server = None
+        if self.conf.query_socket_path:
+            query_server = QueryServer(
+                self.conf.query_socket_path,
+                self.query_digest,
+                self.query_path)
+            query_server.start()
+        try:
+            for changed_paths in iter_changes(
+                    list(archive_paths),
+                    self.conf.watch_rescan_interval):
+                for path_archive, collection_name in archive_paths.items():
+                    collection_changed_paths = [
+                        path for path in changed_paths
+                        if path == path_archive
+                        or path.startswith(path_archive + '/')]
+                    if collection_changed_paths:
+                        self.apply_changes(
+                            collection_name,
+                            path_archive,
+                            collection_changed_paths)
+                        self.report_duplicate_groups(collection_name)
+                self.meta.clear_hash_cache()
+        except KeyboardInterrupt:
+            print(f'Stopped watching')
+        finally:
+            if query_server is not None:
+                query_server.stop()
+            self.meta.close()
+
+    def apply_changes(self,
+                      collection_name: str,
+                      path_archive: str,
+                      changed_paths: list) -> None:
+        """Read the changed paths of a collection again, rehashing the files
+            that changed and updating the duplicate groups
+
+        Files are read and hashed first, the indexes are then updated at
+            once so queries never wait for a hash.
+
+        :param collection_name: the collection label
+        :param path_archive: the path to the archive
+        :param changed_paths: files or folders that were added, changed or
+            removed
+        """
+        files = self.meta.get_files(collection_name, CollectionType.ARCHIVE)
+        read_files = {}
+        removed_files = set()
+        removed_folders = []
+        for path in changed_paths:
+            try:
+                is_folder = S_ISDIR(lstat(path).st_mode)
+            except OSError:
+                is_folder = None  # Removed
+            if is_folder:
+                read_all_files(
+                    path,
+                    self.conf.skip_soft_links,
+                    self.conf.file_size_limit_min,
+                    self.conf.file_size_limit_max,
+                    self.crawl_filters,
+                    read_files,
+                    path_archive)
+            elif is_folder is not None and is_crawled(
+                    path[len(path_archive) + 1:], self.crawl_filters):
+                try:
+                    file_details = read_file_details(
+                        path,
+                        self.conf.skip_soft_links,
+                        self.conf.file_size_limit_min,
+                        self.conf.file_size_limit_max)
+                except OSError:
+                    file_details = None  # Removed since it was changed
+                if file_details is not None:
+                    read_files[path] = file_details
+            if path not in read_files and path in files:
+                removed_files.add(path)
+            elif is_folder is None:
+                removed_folders.append(path + '/')
+
+        # Find the files below removed folders, in a single pass
+        if removed_folders:
+            removed_folders = tuple(removed_folders)
+            removed_files.update(file for file in files
+                                 if file.startswith(removed_folders))
+
+        # Rehash only the files whose identity changed
+        changed_files = {}
+        for file, file_details in read_files.items():
+            if file in files:
+                file_metadata = files[file]
+                if mk.HASH in file_metadata and all(
+                        file_metadata[key] == value
+                        for key, value in file_details.items()):
+                    continue
+            file_key = self.meta.get_file_key(read_files, file)
+            changed_files[file] = dict(file_details, **{
+                FileAttribute.HASH: self.meta.get_cached_hash(
+                    file_key,
+                    self.generate_hash,
+                    file,
+                    file_details[FileAttribute.ST_SIZE],
+                    len(changed_files),
+                    len(read_files),
+                    file_key)})
+
+        self.meta.update_files(collection_name, CollectionType.ARCHIVE,
+                               removed_files, changed_files)
+        print(f'{len(changed_paths)} path(s) changed in {collection_name}, '
+              f'{len(changed_files)} file(s) rehashed')
+
+    def query_digest(self, digest: str) -> dict:
+        """Find the files holding a digest, while watching
+
+        :param digest: the hash of a file
+        :return: for each collection holding the digest, its files
+        """
+        found = {}
+        for collection_name in self.conf.collection_config:
+            files = self.meta.get_files_by_digest(
+                collection_name, CollectionType.ARCHIVE, digest)
+            if files:
+                found[collection_name] = files
+        return found
+
+    def query_path(self, path: str) -> dict:
+        """Find the files holding the same contents as a file, while watching
+
+        The file is only hashed when a collection holds a file of the same size.
+
+        :param path: the path to a file, inside or outside the collections
+        :return: the digest of the file, None when it was not hashed, and for
+            each collection holding the digest, its files
+        """
+        file_details = read_file_details(path, False)
+        file_size = file_details[FileAttribute.ST_SIZE]
+        sized = any(self.meta.has_files_of_size(
+                        collection_name, CollectionType.ARCHIVE, file_size)
+                    for collection_name in self.conf.collection_config)
+        if not sized:
+            return {Query.DIGEST: None, Query.FILES: {}}
+        # Hashed without the hash cache, which would otherwise hold every
+        #   path ever queried
+        file_key = self.meta.get_file_key({path: file_details}, path)
+        digest = self.generate_hash(path, file_size, 0, 1, file_key)
+        return {Query.DIGEST: digest, Query.FILES: self.query_digest(digest)}
+
+    def get_duplicate_groups(self, collection_name: str) -> dict:
+        """Get the files of a collection that currently share a hash, kept up
+            to date while watching
+
+        :param collection_name: the collection label
+        :return: for each hash held by more than one file, the files holding it
+        """
+        return dict(self.meta.iter_hash_groups(
+            collection_name, CollectionType.ARCHIVE))
+
+    def report_duplicate_groups(self, collection_name: str) -> None:
+        duplicate_groups = self.get_duplicate_groups(collection_name)
+        duplicate_count = sum(
+            len(files) - 1 for files in duplicate_groups.values())
+        print(f'{collection_name} holds {len(duplicate_groups)} duplicate '
+              f'group(s) with {duplicate_count} duplicate file(s)')
+
+    def validate_collections(self) -> None:
+        """Read and hash every collection, then check them against each other
+        """
+        # Validate the collections concurrently, profiles are taken one
+        #   collection at a time so the stages do not overlap
+        collection_config = self.conf.collection_config
+        collection_workers = 1 if self.conf.profile else self.conf.collection_workers
+        with ThreadPoolExecutor(
+                max_workers=collection_workers,
+                thread_name_prefix='collection') as executor:
+            collection_validations = [
+                executor.submit(self.validate_collection, collection_name, collection_paths)
+                for collection_name, collection_paths in collection_config.items()]
+            for collection_validation in collection_validations:
+                collection_validation.result()
+
+        # Collections are only checked against each other once all are hashed
+        if len(collection_config) > 1:
+            self.report_cross_collection_duplicates()
+
+    def validate_collection(self, collection_name: str, collection_paths: dict) -> None:
+        """Read and hash a single collection into its own metadata namespace
+
+        :param collection_name: the collection label
+        :param collection_paths: the paths configured for the collection
+        """
+        self.meta.init_collection_metadata(collection_name, collection_paths)
+
+        self.validate_paths(collection_name)
+        run_stage(self.conf, f'{collection_name}_validate_archive',
+                  self.validate_archive, collection_name)
 
     def validate_paths(self, collection_name) -> None:
         # Validate collection paths, create defaults if option enabled
@@ -193,11 +498,18 @@ class CollectionManager:
         path_archive = self.conf.get_path_archive(collection_name)
 
         # Read all files at path
-        duplicate_metadata = read_all_files(path_archive, self.conf.skip_soft_links)
+        archive_files = read_all_files(
+            path_archive,
+            self.conf.skip_soft_links,
+            self.conf.file_size_limit_min,
+            self.conf.file_size_limit_max,
+            self.crawl_filters,
+            self.meta.init_file_store(collection_name, CollectionType.ARCHIVE),
+            crawl_cache_path=self.conf.crawl_cache_path)
 
         self.meta.init_file_metadata(
             collection_name,
-            duplicate_metadata,
+            archive_files,
             CollectionType.ARCHIVE)
 
         # If no files are found
@@ -207,20 +519,30 @@ class CollectionManager:
             print(f'Archive is empty or path is incorrect : {path_archive}')
             exit()
 
-        # Read the files and populate the metadata instructions for unstaging
-        file_hashes = \
-            self.generate_hashes(collection_name, CollectionType.ARCHIVE)
+        # Read the files and update the collection metadata with their hashes
+        self.generate_hashes(collection_name, CollectionType.ARCHIVE)
+        if self.conf.binary_index_path:
+            self.export_binary_index(collection_name)
+        # The content index is only used to check collections against each other
+        if len(self.conf.collection_config) > 1:
+            self.meta.index_file_hashes(collection_name, CollectionType.ARCHIVE)
 
-        # Update collection metadata with file hashes
-        self.meta.update_file_hashes(
-            collection_name,
-            CollectionType.ARCHIVE,
-            file_hashes)
-        duplicate_metadata = (
-            self.archive_metadata_sorting_algorithm(collection_name))
+        # Find, sort and save the metadata instructions to the detail manager
+        self.archive_metadata_sorting_algorithm(collection_name)
 
-        # Save the metadata instructions to the detail manager
-        self.meta.set_duplicate_metadata(collection_name, duplicate_metadata)
+    def export_binary_index(self, collection_name: str) -> None:
+        """Export the hashed archive files to the collection's index file
+
+        :param collection_name: the collection label
+        """
+        print(f'export_binary_index')
+        index_file = str(Path(
+            self.conf.binary_index_path, f'{collection_name}.idx'))
+        record_count = write_binary_index(
+            index_file,
+            self.meta.get_files(collection_name, CollectionType.ARCHIVE).items(),
+            self.conf.hash_algo)
+        print(f'Exported {record_count} file(s) to {index_file}')
 
     def unstage_archive(self, collection_name: str) -> None:
         print(f'unstage_archive')
@@ -229,187 +551,318 @@ class CollectionManager:
             self.meta.get_collection_metadata(
                 collection_name,
                 CollectionType.ARCHIVE)
-        self.stage.load_metadata(
-            collection_metadata,
-            unstage_path,
-            CollectionType.ARCHIVE)
-        self.stage.unstage_files(collection_metadata, self.file)
-
-    def parse_source(self, source_files):
-        print(f'parse_source')  # TODO
-
-    def stage_unique(self, source_files):
-        print(f'stage_unique')  # TODO
+        unstage_plan = self.stage.plan_unstage(collection_metadata, unstage_path)
+        journal_file = ''
+        if self.conf.unstage_journal_path:
+            journal_file = get_journal_file(
+                self.conf.unstage_journal_path, collection_name)
+        self.stage.unstage_files(unstage_plan, self.file, journal_file)
+
+    def ingest_source(self, collection_name: str) -> None:
+        """Move each source file to the stage if it is unique, or to the
+            graveyard if the archive already holds it, as soon as it is known
+
+        Files are crawled, hashed and moved in a single pass. Hashing runs on
+            workers while the crawl goes on, and each file is moved as soon as
+            its hash is ready. A file whose size no archive file has is unique
+            without being hashed. Source files are also checked against each
+            other, later copies of a staged file go to the graveyard.
+
+        :param collection_name: the collection label
+        """
+        print(f'ingest_source')
+        path_source = self.conf.get_path_source(collection_name)
+        ingest_workers = 1 if self.conf.profile else self.conf.ingest_workers
+        ingest_start = perf_counter()
+        ingest_counts = {CollectionType.STAGE: 0, CollectionType.GRAVEYARD: 0}
+        staged_files = {}  # Size to the staged files and their hashes
+        with ThreadPoolExecutor(
+                max_workers=ingest_workers,
+                thread_name_prefix='ingest') as executor:
+            # Only a few files are read ahead of the moves, so each waits for
+            #   its own hash rather than for the whole crawl
+            classifications = set()
+            for source_file, file_details in iter_all_files(
+                    path_source,
+                    self.conf.skip_soft_links,
+                    self.conf.file_size_limit_min,
+                    self.conf.file_size_limit_max,
+                    self.crawl_filters):
+                classifications.add(executor.submit(
+                    self._classify_source_file,
+                    collection_name,
+                    source_file,
+                    file_details))
+                if len(classifications) < 2 * ingest_workers:
+                    continue
+                done, classifications = wait(
+                    classifications, return_when=FIRST_COMPLETED)
+                for classification in done:
+                    ingest_counts[self._route_source_file(
+                        collection_name,
+                        staged_files,
+                        *classification.result())] += 1
+            for classification in classifications:
+                ingest_counts[self._route_source_file(
+                    collection_name,
+                    staged_files,
+                    *classification.result())] += 1
+
+        ingest_seconds = perf_counter() - ingest_start
+        print(f'Ingested {sum(ingest_counts.values())} source file(s) in '
+              f'{ingest_seconds:.2f} s, '
+              f'{ingest_counts[CollectionType.STAGE]} staged, '
+              f'{ingest_counts[CollectionType.GRAVEYARD]} sent to the graveyard')
+
+    def _classify_source_file(self,
+                              collection_name: str,
+                              source_file: str,
+                              file_details: dict) -> tuple:
+        """Find the archive files holding the same contents as a source file,
+            hashing it only when the archive holds a file of its size
+
+        :param collection_name: the collection label
+        :param source_file: the path to the source file
+        :param file_details: the source file details
+        :return: (source file, file details, hash or None, archive files
+            holding the same contents)
+        """
+        if not self.meta.has_files_of_size(
+                collection_name,
+                CollectionType.ARCHIVE,
+                file_details[FileAttribute.ST_SIZE]):
+            return source_file, file_details, None, []
+        file_hash = self._hash_file(source_file, file_details)
+        # Unstaged duplicates are still in the metadata, only the files left
+        #   in the archive are kept
+        archive_files = [
+            archive_file for archive_file in self.meta.get_files_by_digest(
+                collection_name, CollectionType.ARCHIVE, file_hash)
+            if exists(archive_file)]
+        return source_file, file_details, file_hash, archive_files
+
+    def _route_source_file(self,
+                           collection_name: str,
+                           staged_files: dict,
+                           source_file: str,
+                           file_details: dict,
+                           file_hash,
+                           archive_files: list) -> str:
+        """Move a classified source file to the stage or the graveyard
+
+        :param collection_name: the collection label
+        :param staged_files: the files staged so far, by size then path to
+            hash, None until a file of the same size needs comparing
+        :param source_file: the path to the source file
+        :param file_details: the source file details
+        :param file_hash: the source file hash, None if it was not hashed
+        :param archive_files: the archive files holding the same contents
+        :return: STAGE or GRAVEYARD
+        """
+        file_size = file_details[FileAttribute.ST_SIZE]
+        original = archive_files[0] if archive_files else None
+        staged_same_size = staged_files.get(file_size)
+        if original is None and staged_same_size:
+            if file_hash is None:
+                file_hash = self._hash_file(source_file, file_details)
+            for staged_file, staged_hash in staged_same_size.items():
+                if staged_hash is None:
+                    staged_hash = staged_same_size[staged_file] = \
+                        self._hash_file(
+                            staged_file, read_file_details(staged_file, False))
+                if staged_hash == file_hash:
+                    original = staged_file
+                    break
 
-    def read_source(self, paths):
-        print(f'read_source')  # TODO
+        # A file staged by an earlier run may be at the same path, it is
+        #   compared rather than replaced
+        staged_file = self.stage.get_staged_file(
+            source_file,
+            self.conf.get_path_source(collection_name),
+            self.conf.get_path_stage(collection_name))
+        if original is None and lexists(staged_file):
+            staged_details = read_file_details(staged_file, True)
+            if staged_details and \
+                    staged_details[FileAttribute.ST_SIZE] == file_size:
+                if file_hash is None:
+                    file_hash = self._hash_file(source_file, file_details)
+                if self._hash_file(staged_file, staged_details) == file_hash:
+                    original = staged_file
+
+        if original is not None:
+            self.stage.bury_source_file(
+                source_file,
+                original,
+                self.conf.get_path_graveyard(collection_name),
+                self.file)
+            return CollectionType.GRAVEYARD
+        staged_file = self.stage.stage_source_file(
+            source_file,
+            staged_file,
+            self.file)
+        staged_files.setdefault(file_size, {})[staged_file] = file_hash
+        return CollectionType.STAGE
+
+    def _hash_file(self,
+                   file: str,
+                   file_details: dict,
+                   hash_count: int = 0,
+                   hashes_needed: int = 1) -> str:
+        file_key = self.meta.get_file_key({file: file_details}, file)
+        return self.meta.get_cached_hash(
+            file_key,
+            self.generate_hash,
+            file,
+            file_details[FileAttribute.ST_SIZE],
+            hash_count,
+            hashes_needed,
+            file_key)
+
+    def _hash_small_files(self, executor, small_files: list) -> dict:
+        """Hash a batch of small files, several at a time
+
+        :param executor: the pool hashing the files
+        :param small_files: (file, file details) tuples
+        :return: for each file, its HASH
+        """
+        small_hashes = executor.map(
+            lambda small_file: self._hash_file(*small_file), small_files)
+        return {file: {FileAttribute.HASH: file_hash}
+                for (file, _), file_hash in zip(small_files, small_hashes)}
 
     def archive_metadata_sorting_algorithm(self, collection_name):
         """This is the core sorting algorithm and probably does too much.
+
+        Duplicate groups are found, sorted and saved one group at a time, so
+            only one group is held in memory.
         """
         print(f'archive_self_check')
 
         # Find duplicates
-        duplicate_metadata = self._get_archive_duplicates(collection_name)
+        duplicate_groups = self._get_archive_duplicates(collection_name)
 
         # Sort duplicates
-        duplicate_metadata = self._sort_unstaging_hierarchy(duplicate_metadata)
-
-        # Announce and return duplicates
-        if duplicate_metadata:
-            parent_count, children_count = self._count_duplicates(duplicate_metadata)
-            if parent_count > 0:
-                print(f'Archive invalid, {parent_count} parent file(s) found '
-                      f'with {children_count} duplicate children')
-            return duplicate_metadata
-
-    def _get_archive_duplicates(self, collection_name) -> dict:
+        duplicate_groups = self._sort_unstaging_hierarchy(
+            collection_name, duplicate_groups)
+
+        # Save and announce duplicates
+        parent_count, children_count = 0, 0
+        for duplicate_metadata in duplicate_groups:
+            self.meta.set_duplicate_metadata(collection_name, duplicate_metadata)
+            group_parent_count, group_children_count = \
+                self._count_duplicates(duplicate_metadata)
+            parent_count += group_parent_count
+            children_count += group_children_count
+        if parent_count > 0:
+            print(f'Archive invalid, {parent_count} parent file(s) found '
+                  f'with {children_count} duplicate children')
+
+    def _get_archive_duplicates(self, collection_name):
+        """Find the duplicate groups of an archive
+
+        :param collection_name: the collection label
+        :return: a generator of duplicate metadata for one group at a time,
+            keyed by the first file found
+        """
         print(f'_get_archive_duplicates')
 
         collection_metadata = \
             self.meta.get_collection_file_metadata(
                 collection_name,
                 CollectionType.ARCHIVE)
-        collection_metadata_dc = copy.deepcopy(collection_metadata)
-        found_duplicates = []
-        # While dictionary has files
-        duplicate_metadata = {}  # Duplicate metadata for all files
-        while list(collection_metadata_dc.keys()):
-            # This flag is used to escape the external for loop after a
-            #   duplicate file is found
-
-            # Iterate over a copy of the archive against another copy
-            for parent_file_check in collection_metadata_dc:
-                parent_hash = \
-                    self.meta.get_hash(collection_metadata_dc, parent_file_check)
-
-                if parent_file_check in found_duplicates:
-                    # Prevent infinite loop
-                    self.meta.delete_entry(
-                        collection_metadata_dc,
-                        parent_file_check)
-                    break  # This file is already identified as a duplicate
-
-                # Init duplicate tracking for this parent_file_check
-                duplicate_metadata_for_parent = {}  # Duplicates for this file
-                for child_file_check in collection_metadata:
-                    child_hash = \
-                        self.meta.get_hash(collection_metadata, child_file_check)
-
-                    if parent_file_check == child_file_check:
-                        continue  # Do not compare a file with itself
-
-                    # Compare the hashes of differing file paths
-                    if parent_hash == child_hash:
-                        print(f'Duplicate file found in archive : {child_file_check}')
-                        # Initialize list of duplicates
-                        found_duplicates.append(child_file_check)
-                        # Update collection of duplicates with new init
-                        self.meta.update_metadata_for_child(
-                            collection_name,
-                            collection_metadata,
-                            duplicate_metadata_for_parent,
-                            parent_name=parent_file_check,
-                            parent_hash=parent_hash,
-                            child_name=child_file_check,
-                            child_hash=child_hash)
-
-                        self.meta.update_metadata_for_parent(
-                            parent_file=parent_file_check,
-                            parent_metadata=duplicate_metadata_for_parent,
-                            child_metadata=duplicate_metadata)
-
-                # The internal loop has concluded, discard this value
-                self.meta.delete_entry(
-                    collection_metadata_dc,
-                    parent_file_check)
-                break  # Force restart of the for loop with new dict
-
-        return duplicate_metadata
-
-    def _sort_unstaging_hierarchy(self, duplicate_metadata):
+        for file_hash, files in self.meta.iter_hash_groups(
+                collection_name,
+                CollectionType.ARCHIVE):
+            # The first file found is the parent until the groups are sorted
+            parent_file_check, *child_file_checks = files
+
+            # Init duplicate tracking for this parent_file_check
+            duplicate_metadata_for_parent = {}  # Duplicates for this file
+            for child_file_check in child_file_checks:
+                print(f'Duplicate file found in archive : {child_file_check}')
+                self.meta.update_metadata_for_child(
+                    collection_name,
+                    collection_metadata,
+                    duplicate_metadata_for_parent,
+                    parent_name=parent_file_check,
+                    parent_hash=file_hash,
+                    child_name=child_file_check,
+                    child_hash=file_hash)
+
+            duplicate_metadata = {}  # Duplicate metadata for this group
+            self.meta.update_metadata_for_parent(
+                parent_file=parent_file_check,
+                parent_metadata=duplicate_metadata_for_parent,
+                child_metadata=duplicate_metadata)
+            yield duplicate_metadata
+
+    def _sort_unstaging_hierarchy(self, collection_name, duplicate_groups):
+        """Assign the parent role of each duplicate group using the configured
+            parent selection policies, all other files become its children
+
+        :param collection_name: the collection label
+        :param duplicate_groups: the duplicate groups, one group at a time,
+            keyed by parent file
+        :return: a generator of the duplicate groups, keyed by their selected
+            parent file
+        """
         print(f'_sort_unstage_hierarchy')
 
-        duplicate_metadata_dc = copy.deepcopy(duplicate_metadata)
-        for parent_file, child_files in duplicate_metadata_dc.items():
-
-            # Collect the lengths of each file name
-            file_name_data = []
-            file_name_datum = namedtuple(
-                'file_name_datum', ['index', 'length', 'name'])
-            # Collect data for each file
-            for idx, file in enumerate([parent_file, * list(child_files)]):
-                file_name_data.append(
-                    file_name_datum(index=idx, length=len(file), name=file))
-
-            # Get the shortest file length and its index
-            # Initial value beyond reasonable file lengths
-            shortest_len = self.conf.file_name_len_max_value
-            shortest_idx = None
-            file_lengths = []
-            for file_name_datum in file_name_data:
-                file_lengths.append(file_name_datum.length)
-                if file_name_datum.length < shortest_len:
-                    shortest_idx = file_name_datum.index
-                    shortest_len = file_name_datum.length
-
-            if shortest_len == self.conf.file_name_len_max_value:
-                raise Exception(f'No file lengths processed')
-
-            # Check if multiple files match the shortest length
-            shortest_length = file_name_data[shortest_idx].length
-            shortest_count = file_lengths.count(shortest_length)
-
-            # Check if multiple files were the same length
-            if shortest_count > 1:  # Two file lengths match, sort alphabetically instead
-                # Sort alphabetically
-                files_sorted = sorted([parent_file, * list(child_files)])
-            else:
-                # Sort by shortest file name
-                files_sorted = []
-                for sorted_file_length in sorted(file_lengths):
-                    for file_name_datum in file_name_data:
-                        if file_name_datum.name in files_sorted:
-                            continue  # don't add the same file twice
-                        if file_name_datum.length == sorted_file_length:
-                            files_sorted.append(file_name_datum.name)
-
-            # Update the dictionary with the sorted files
-            # TODO bug this should be reworked since it wipes the dict
-            # TODO revisit above message since rework
-            new_parent_file = files_sorted[0]
-            for file in files_sorted[1:]:
-                if file not in child_files:
-                    # Transform the former parent file into a child file
-                    old_parent_file = file
-                    file_metadata = {
-                        mk.COLLECTION: child_files[new_parent_file][mk.COLLECTION],
-                        mk.HASH: child_files[new_parent_file][mk.HASH],
-                        mk.NAME: old_parent_file,
-                        mk.ORIGINAL: new_parent_file,
-                        mk.PARENT: None,
-                        mk.SIZE: child_files[new_parent_file][mk.SIZE]
-                    }
-                    self.meta.update_duplicate_metadata(
-                        new_parent_file, duplicate_metadata,
-                        file, file_metadata)
-                    self.meta.delete_entry(duplicate_metadata, file)
-                    continue  # The former parent is handled separately
+        collection_metadata = \
+            self.meta.get_collection_file_metadata(
+                collection_name,
+                CollectionType.ARCHIVE)
+        parent_selection_key = build_parent_selection_key(
+            self.conf.parent_selection_policies,
+            self.conf.parent_preferred_prefixes,
+            collection_metadata)
+
+        hardlink_count = 0
+        for duplicate_metadata in duplicate_groups:
+            parent_file, child_files = next(iter(duplicate_metadata.items()))
+            sorted_duplicate_metadata = {}
+            new_parent_file = min(
+                [parent_file, *child_files], key=parent_selection_key)
+            parent_inode = self.meta.get_inode(collection_metadata, new_parent_file)
+
+            # All files in a group share the hash and size of the group
+            child_metadata = next(iter(child_files.values()))
+            parent_metadata = {
+                mk.HASH: child_metadata[mk.HASH],
+                mk.NAME: new_parent_file,
+                mk.SIZE: child_metadata[mk.SIZE]
+            }
+            for file in [parent_file, *child_files]:
+                if file == new_parent_file:
+                    continue
+                if self.meta.get_inode(collection_metadata, file) == parent_inode:
+                    hardlink_count += 1
+                    continue  # Unstaging a hardlink to the parent reclaims nothing
                 file_metadata = {
-                    mk.COLLECTION: child_files[file][mk.COLLECTION],
-                    mk.HASH: child_files[file][mk.HASH],
+                    mk.COLLECTION: child_metadata[mk.COLLECTION],
+                    mk.HASH: child_metadata[mk.HASH],
                     mk.NAME: file,
-                    mk.ORIGINAL: files_sorted[0],
-                    mk.PARENT: child_files[file][mk.PARENT],
-                    mk.SIZE: child_files[file][mk.SIZE]
+                    mk.ORIGINAL: new_parent_file,
+                    mk.PARENT: parent_metadata,
+                    mk.SIZE: child_metadata[mk.SIZE]
                 }
                 self.meta.update_duplicate_metadata(
-                    new_parent_file, duplicate_metadata,
+                    new_parent_file, sorted_duplicate_metadata,
                     file, file_metadata)
+            if sorted_duplicate_metadata:
+                yield sorted_duplicate_metadata
+
+        if hardlink_count:
+            print(f'{hardlink_count} hardlink(s) to their parent file '
+                  f'excluded from unstaging')
 
-        return duplicate_metadata
+    def generate_hashes(self, collection_name, file_type) -> None:
+        """Hash every file of a collection, saving the hashes to the collection
+            metadata in batches
 
-    def generate_hashes(self, collection_name, file_type) -> dict:
+        :param collection_name: the collection label
+        :param file_type: the type of files to hash, SOURCE or ARCHIVE
+        """
         print(f'generate_hashes')
 
         file_metadata = None
@@ -422,42 +875,87 @@ class CollectionManager:
 
         if not file_metadata:
             raise RuntimeError(f'No file metadata')
+        if self.conf.hash_auto_tune:
+            self.tune_buf_sizes(file_metadata)
 
         file_hashes = {}
         hash_count = 0
         hash_mod = 100
         hashes_needed = len(file_metadata)
-        file_metadata_dc = copy.deepcopy(file_metadata)
-        for file_dc, file_details_dc in file_metadata_dc.items():
-            file_size = \
-                self.meta.get_file_size_from(file_metadata, file_dc)
-            if not hash_count % hash_mod:
-                print(f'Generated {hash_count} of {hashes_needed}..')
-            file_hashes[file_dc] = {
-                FileAttribute.HASH: self.generate_hash(
-                    file_dc,
-                    file_size,
-                    hash_count,
-                    hashes_needed)}
-            hash_count += 1
-        return file_hashes
+        hash_bytes = 0
+        hash_start = perf_counter()
+        page_cache_start = read_page_cache_size()
+        hash_batch_size = self.conf.metadata_store_batch_size
+        small_file_threshold = self.conf.small_file_threshold
+        small_files = []
+        small_file_workers = \
+            1 if self.conf.profile else self.conf.small_file_workers
+        with ThreadPoolExecutor(
+                max_workers=small_file_workers,
+                thread_name_prefix='small_files') as executor:
+            for file_dc, file_details_dc in file_metadata.items():
+                file_size = file_details_dc[FileAttribute.ST_SIZE]
+                if not hash_count % hash_mod:
+                    print(f'Generated {hash_count} of {hashes_needed}..')
+                # Small files are set aside and hashed in batches, on the pool
+                if file_size < small_file_threshold:
+                    small_files.append((file_dc, file_details_dc))
+                else:
+                    file_hashes[file_dc] = {
+                        FileAttribute.HASH: self._hash_file(
+                            file_dc,
+                            file_details_dc,
+                            hash_count,
+                            hashes_needed)}
+                hash_bytes += file_size
+                hash_count += 1
+                if len(small_files) >= hash_batch_size:
+                    file_hashes.update(
+                        self._hash_small_files(executor, small_files))
+                    small_files = []
+
+                # Save the hashes in batches, bounding the hashes held in
+                #   memory
+                if len(file_hashes) >= hash_batch_size:
+                    self.meta.update_file_hashes(
+                        collection_name, file_type, file_hashes)
+                    file_hashes = {}
+            file_hashes.update(self._hash_small_files(executor, small_files))
+        self.meta.update_file_hashes(collection_name, file_type, file_hashes)
+
+        # Measure throughput and the system wide page cache growth
+        hash_seconds = perf_counter() - hash_start
+        page_cache_delta = read_page_cache_size() - page_cache_start
+        print(f'Hashed {hash_count} files, {hash_bytes} bytes in '
+              f'{hash_seconds:.2f} s '
+              f'({hash_bytes / max(hash_seconds, 1e-9) / 1e6:.1f} MB/s) '
+              f'using {self.conf.hash_read_mode} reads, '
+              f'page cache changed by {page_cache_delta} bytes')
 
     def generate_hash(self,
                       archive_file: str,
                       file_size: int,
                       hash_count: int,
-                      hashed_needed: int) -> None:
+                      hashed_needed: int,
+                      file_key: tuple = None) -> None:
         """Given a file, generate a hash and return it
 
         :param archive_file, the path to a file
         :param file_size, the size of the file
         :param hash_count, the number of the hash being processed
         :param hashed_needed, the total number of hashes to be processed
+        :param file_key, the file identity, required for block tree hashing
         :return a hash string
         """
 
+        # Small files are read whole, without any progress bookkeeping
+        if file_size < self.conf.small_file_threshold:
+            return self.conf.hasher_algo(read_small_file(
+                archive_file,
+                file_size,
+                self.conf.hash_read_mode)).hexdigest()
+
         # Initialize loading bar values
-        data_read_sum = 0
         large_file = True \
             if file_size > self.conf.large_file_threshold \
             else False
@@ -477,29 +975,165 @@ class CollectionManager:
             print(f'\nGenerating hash {hash_count + 1} of {hashed_needed}, '
                   f'file : {archive_file}')
 
+        # Huge files are hashed as a tree of blocks, in parallel
+        hash_tree_threshold = self.conf.hash_tree_threshold
+        if hash_tree_threshold and file_size > hash_tree_threshold:
+            return self.generate_tree_hash(
+                archive_file, file_key, progress_metadata, large_file)
+
         # Get the hash generator
         hasher = self.conf.hasher_algo()
 
         # Read the file and update progress
-        with open(archive_file, 'rb') as af:
-            while True:
-                data = af.read(self.conf.buf_size)
-                data_read_sum += self.conf.buf_size
-
-                # Update progress metadata with file read
-                progress_metadata[
-                    Progress.DATA_READ_SUM] += self.conf.buf_size
-
-                # Only show loading bars for large files
-                if large_file:
-                    self.display_loading_dialog(progress_metadata)
-                if not data:
-                    if large_file:
-                        self.display_loading_dialog(complete=True)
-                    break
-                hasher.update(data)
+        for data in read_file_chunks(
+                archive_file,
+                self.get_buf_size(file_key),
+                self.conf.hash_read_mode,
+                self.conf.hash_cache_drop_window,
+                self.conf.hash_sparse_files):
+            # Update progress metadata with file read
+            progress_metadata[
+                Progress.DATA_READ_SUM] += len(data)
+
+            # Only show loading bars for large files
+            if large_file:
+                self.display_loading_dialog(progress_metadata)
+            hasher.update(data)
+        if large_file:
+            self.display_loading_dialog(complete=True)
         return hasher.hexdigest()
 
+    def get_buf_size(self, file_key: tuple = None) -> int:
+        """Get the read size for hashing a file, tuned for its device when
+            auto tuning
+
+        :param file_key: the file identity, see MetadataManager.get_file_key
+        :return: the read size in bytes
+        """
+        if file_key is None:
+            return self.conf.buf_size
+        return self._device_buf_sizes.get(file_key[0], self.conf.buf_size)
+
+    def tune_hash_algo(self) -> None:
+        """Replace the configured hash algorithm with the fastest one of this
+            host, benchmarked once and then read from the tune file"""
+        host_name = get_host_name()
+        hash_tune = load_hash_tune(self.conf.hash_auto_tune_path)
+        host_tune = hash_tune.setdefault(host_name, {})
+        hash_algo = host_tune.get(HashTune.HASH_ALGO)
+        if hash_algo not in self.conf.hash_auto_tune_algos:
+            print(f'Tuning the hash algorithm of {host_name}')
+            hash_algo = tune_hash_algo(self.conf.hash_auto_tune_algos)
+            host_tune[HashTune.HASH_ALGO] = hash_algo
+            save_hash_tune(self.conf.hash_auto_tune_path, hash_tune)
+        if hash_algo != self.conf.hash_algo:
+            print(f'Warning : hashing with {hash_algo} instead of '
+                  f'{self.conf.hash_algo}, hashes saved by runs using '
+                  f'another algorithm will not match')
+            self.conf.hash_algo = hash_algo
+
+    def tune_buf_sizes(self, file_metadata: dict) -> None:
+        """Find the read size of each device holding files of a collection,
+            reading a sample of its files when it has not been tuned before
+
+        :param file_metadata: the files of the collection
+        """
+        with self._device_buf_sizes_lock:
+            sample_files = {}
+            sample_sizes = {}
+            sample_size = self.conf.hash_auto_tune_sample_size
+            for file, file_details in file_metadata.items():
+                st_dev = file_details[FileAttribute.ST_DEV]
+                if st_dev in self._device_buf_sizes:
+                    continue
+                sample_files.setdefault(st_dev, [])
+                file_size = file_details[FileAttribute.ST_SIZE]
+                if file_size < HashTune.MIN_SAMPLE_FILE_SIZE or \
+                        sample_sizes.get(st_dev, 0) >= sample_size:
+                    continue
+                sample_files[st_dev].append(file)
+                sample_sizes[st_dev] = sample_sizes.get(st_dev, 0) + file_size
+            if not sample_files:
+                return
+
+            host_name = get_host_name()
+            disk_state = read_disk_state()
+            hash_tune = load_hash_tune(self.conf.hash_auto_tune_path)
+            device_tune = hash_tune.setdefault(host_name, {}).setdefault(
+                HashTune.DEVICES, {})
+            for st_dev, files in sample_files.items():
+                device_name = get_device_name(st_dev, disk_state)
+                buf_size = device_tune.get(device_name, {}).get(
+                    HashTune.BUF_SIZE)
+                if buf_size is None:
+                    if sample_sizes.get(st_dev, 0) < \
+                            HashTune.MIN_SAMPLE_SIZE:
+                        # Too little to measure, tuned again next run
+                        self._device_buf_sizes[st_dev] = self.conf.buf_size
+                        continue
+                    print(f'Tuning the read size of {device_name} with '
+                          f'{len(files)} file(s), {sample_sizes[st_dev]} bytes')
+                    buf_size = tune_buf_size(
+                        files, self.conf.hasher_algo, self.conf.buf_size)
+                    device_tune[device_name] = {HashTune.BUF_SIZE: buf_size}
+                    save_hash_tune(self.conf.hash_auto_tune_path, hash_tune)
+                print(f'Reading {device_name} with {buf_size} byte reads')
+                self._device_buf_sizes[st_dev] = buf_size
+
+    def generate_tree_hash(self,
+                           archive_file: str,
+                           file_key: tuple,
+                           progress_metadata: dict,
+                           large_file: bool) -> str:
+        """Generate the block tree hash of a huge file, resuming from any
+            block hashes saved by an interrupted run
+
+        :param archive_file: the path to a file
+        :param file_key: the file identity
+        :param progress_metadata: tells the progress bar what to display
+        :param large_file: whether to display a loading bar
+        :return: a hash string
+        """
+        def on_block(block_length):
+            progress_metadata[Progress.DATA_READ_SUM] += block_length
+            if large_file:
+                self.display_loading_dialog(progress_metadata)
+
+        file_hash = generate_tree_hash(
+            archive_file,
+            file_key,
+            self.conf.hasher_algo,
+            self.conf.hash_algo,
+            self.conf.hash_tree_block_size,
+            self.get_buf_size(file_key),
+            1 if self.conf.profile else self.conf.hash_tree_workers,
+            self.conf.hash_tree_state_path,
+            self.conf.hash_read_mode,
+            on_block,
+            self.conf.hash_sparse_files)
+        if large_file:
+            self.display_loading_dialog(complete=True)
+        return file_hash
+
+    def report_cross_collection_duplicates(self) -> dict:
+        """Announce files duplicated between collections, using the hashes
+            already generated for each collection
+
+        :return: for each digest, the files holding it in each collection
+        """
+        print(f'report_cross_collection_duplicates')
+        cross_collection_duplicates = self.meta.get_cross_collection_duplicates()
+        for digest, collections in cross_collection_duplicates.items():
+            print(f'Duplicate across collections {", ".join(collections)} : '
+                  f'{digest}')
+            for collection_name, files in collections.items():
+                for file in files:
+                    print(f'    {collection_name} : {file}')
+        if cross_collection_duplicates:
+            print(f'{len(cross_collection_duplicates)} file(s) duplicated '
+                  f'across collections')
+        return cross_collection_duplicates
+
     def _count_duplicates(self, duplicate_metadata):
         parent_count = self.meta.get_parent_count_from(duplicate_metadata)
         children_count = 0
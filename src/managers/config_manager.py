@@ -11,18 +11,38 @@ class ConfigManager:
         self._config = config
         self._hasher_algo = None
 
+    @property
+    def binary_index_path(self):
+        return self.config[ConfigKey.BINARY_INDEX_PATH]
+
     @property
     def buf_size(self):
         return self.config[ConfigKey.BUF_SIZE]
 
     @property
     def collection_config(self):
-        return self.config[ConfigKey.COLLECTION]
+        return self.config[ConfigKey.ARCHIVES]
+
+    @property
+    def collection_workers(self):
+        return self.config[ConfigKey.COLLECTION_WORKERS]
 
     @property
     def config(self):
         return self._config
 
+    @property
+    def crawl_cache_path(self):
+        return self.config[ConfigKey.CRAWL_CACHE_PATH]
+
+    @property
+    def crawl_exclude(self):
+        return self.config[ConfigKey.CRAWL_EXCLUDE]
+
+    @property
+    def crawl_include(self):
+        return self.config[ConfigKey.CRAWL_INCLUDE]
+
     @property
     def create_default_archive_paths(self):
         return self.config[ConfigKey.CREATE_DEFAULT_ARCHIVE_PATHS]
@@ -35,10 +55,6 @@ class ConfigManager:
     def debug(self):
         return self.config[ConfigKey.DEBUG]
 
-    @property
-    def file_name_len_max_value(self):
-        return self.config[ConfigKey.FILE_NAME_LEN_MAX_VALUE]
-
     @property
     def file_size_limit_max(self):
         return self.config[ConfigKey.FILE_SIZE_TO_HASH_MAX]
@@ -51,6 +67,54 @@ class ConfigManager:
     def hash_algo(self):
         return self.config[ConfigKey.HASH_ALGO]
 
+    @hash_algo.setter
+    def hash_algo(self, value):
+        self.config[ConfigKey.HASH_ALGO] = value
+
+    @property
+    def hash_auto_tune(self):
+        return self.config[ConfigKey.HASH_AUTO_TUNE]
+
+    @property
+    def hash_auto_tune_algos(self):
+        return self.config[ConfigKey.HASH_AUTO_TUNE_ALGOS]
+
+    @property
+    def hash_auto_tune_path(self):
+        return self.config[ConfigKey.HASH_AUTO_TUNE_PATH]
+
+    @property
+    def hash_auto_tune_sample_size(self):
+        return self.config[ConfigKey.HASH_AUTO_TUNE_SAMPLE_SIZE]
+
+    @property
+    def hash_cache_drop_window(self):
+        return self.config[ConfigKey.HASH_CACHE_DROP_WINDOW]
+
+    @property
+    def hash_read_mode(self):
+        return self.config[ConfigKey.HASH_READ_MODE]
+
+    @property
+    def hash_sparse_files(self):
+        return self.config[ConfigKey.HASH_SPARSE_FILES]
+
+    @property
+    def hash_tree_block_size(self):
+        return self.config[ConfigKey.HASH_TREE_BLOCK_SIZE]
+
+    @property
+    def hash_tree_state_path(self):
+        return self.config[ConfigKey.HASH_TREE_STATE_PATH]
+
+    @property
+    def hash_tree_threshold(self):
+        return self.config[ConfigKey.HASH_TREE_THRESHOLD]
+
+    @property
+    def hash_tree_workers(self):
+        return self.config[ConfigKey.HASH_TREE_WORKERS]
+
     @property
     def hasher_algo(self):
         return self._hasher_algo
@@ -59,10 +123,38 @@ class ConfigManager:
     def hasher_algo(self, value):
         self._hasher_algo = value
 
+    @property
+    def ingest_workers(self):
+        return self.config[ConfigKey.INGEST_WORKERS]
+
     @property
     def large_file_threshold(self):
         return self.config[ConfigKey.LARGE_FILE_THRESHOLD]
 
+    @property
+    def duplicate_grouping(self):
+        return self.config[ConfigKey.DUPLICATE_GROUPING]
+
+    @property
+    def external_sort_path(self):
+        return self.config[ConfigKey.EXTERNAL_SORT_PATH]
+
+    @property
+    def external_sort_run_size(self):
+        return self.config[ConfigKey.EXTERNAL_SORT_RUN_SIZE]
+
+    @property
+    def metadata_backend(self):
+        return self.config[ConfigKey.METADATA_BACKEND]
+
+    @property
+    def metadata_store_batch_size(self):
+        return self.config[ConfigKey.METADATA_STORE_BATCH_SIZE]
+
+    @property
+    def metadata_store_path(self):
+        return self.config[ConfigKey.METADATA_STORE_PATH]
+
     @property
     def network_check_count(self):
         return self.config[ConfigKey.NETWORK_CHECK_COUNT]
@@ -71,6 +163,18 @@ class ConfigManager:
     def network_check_delay(self):
         return self.config[ConfigKey.NETWORK_CHECK_DELAY]
 
+    @property
+    def parent_preferred_prefixes(self):
+        return self.config[ConfigKey.PARENT_PREFERRED_PREFIXES]
+
+    @property
+    def parent_selection_policies(self):
+        return self.config[ConfigKey.PARENT_SELECTION_POLICIES]
+
+    @property
+    def query_socket_path(self):
+        return self.config[ConfigKey.QUERY_SOCKET_PATH]
+
     @property
     def require_network(self):
         return self.config[ConfigKey.REQUIRE_NETWORK]
@@ -79,6 +183,42 @@ class ConfigManager:
     def skip_soft_links(self):
         return self.config[ConfigKey.SKIP_SOFT_LINKS]
 
+    @property
+    def small_file_threshold(self):
+        return self.config[ConfigKey.SMALL_FILE_THRESHOLD]
+
+    @property
+    def small_file_workers(self):
+        return self.config[ConfigKey.SMALL_FILE_WORKERS]
+
+    @property
+    def system_checks_in_background(self):
+        return self.config[ConfigKey.SYSTEM_CHECKS_IN_BACKGROUND]
+
+    @property
+    def undo_unstage(self):
+        return self.config[ConfigKey.UNDO_UNSTAGE]
+
+    @property
+    def unstage_journal_path(self):
+        return self.config[ConfigKey.UNSTAGE_JOURNAL_PATH]
+
+    @property
+    def unstage_journal_sync_count(self):
+        return self.config[ConfigKey.UNSTAGE_JOURNAL_SYNC_COUNT]
+
+    @property
+    def unstage_workers(self):
+        return self.config[ConfigKey.UNSTAGE_WORKERS]
+
+    @property
+    def watch(self):
+        return self.config[ConfigKey.WATCH]
+
+    @property
+    def watch_rescan_interval(self):
+        return self.config[ConfigKey.WATCH_RESCAN_INTERVAL]
+
     # FILES
     @property
     def default_parent_folder(self):
@@ -106,8 +246,8 @@ class ConfigManager:
 
     def update_archive_paths(self, archive_paths):
         try:
-            self.config[ConfigKey.COLLECTION][ConfigKey.DEFAULT_COLLECTION].update({
-                ConfigKey.ARCHIVE_PATH_LABEL: archive_paths[ConfigKey.ARCHIVE_PATH_LABEL],
+            self.config[ConfigKey.ARCHIVES][ConfigKey.DEFAULT_ARCHIVE].update({
+                ConfigKey.ARCHIVE_PATH: archive_paths[ConfigKey.ARCHIVE_PATH],
                 ConfigKey.UNSTAGE_PATH: archive_paths[ConfigKey.UNSTAGE_PATH]
             })
         except Exception as exc:
@@ -116,7 +256,7 @@ class ConfigManager:
 
     def update_source_paths(self, archive_paths):
         try:
-            self.config[ConfigKey.COLLECTION][ConfigKey.DEFAULT_COLLECTION].update({
+            self.config[ConfigKey.ARCHIVES][ConfigKey.DEFAULT_ARCHIVE].update({
                 ConfigKey.GRAVEYARD_PATH: archive_paths[ConfigKey.GRAVEYARD_PATH],
                 ConfigKey.SOURCE_PATH: archive_paths[ConfigKey.SOURCE_PATH],
                 ConfigKey.STAGE_PATH: archive_paths[ConfigKey.STAGE_PATH],
@@ -127,7 +267,7 @@ class ConfigManager:
 
     def get_path_archive(self, collection_name) -> dict:
         path = self.config[
-            ConfigKey.COLLECTION][
+            ConfigKey.ARCHIVES][
             collection_name][
             ConfigKey.ARCHIVE_PATH
         ]
@@ -135,7 +275,7 @@ class ConfigManager:
 
     def get_path_graveyard(self, collection_name) -> dict:
         path = self.config[
-            ConfigKey.COLLECTION][
+            ConfigKey.ARCHIVES][
             collection_name][
             ConfigKey.GRAVEYARD_PATH
         ]
@@ -143,7 +283,7 @@ class ConfigManager:
 
     def get_path_source(self, collection_name) -> dict:
         path = self.config[
-            ConfigKey.COLLECTION][
+            ConfigKey.ARCHIVES][
             collection_name][
             ConfigKey.SOURCE_PATH
         ]
@@ -151,7 +291,7 @@ class ConfigManager:
 
     def get_path_stage(self, collection_name) -> dict:
         path = self.config[
-            ConfigKey.COLLECTION][
+            ConfigKey.ARCHIVES][
             collection_name][
             ConfigKey.STAGE_PATH
         ]
@@ -159,12 +299,25 @@ class ConfigManager:
 
     def get_path_unstage(self, collection_name) -> dict:
         path = self.config[
-            ConfigKey.COLLECTION][
+            ConfigKey.ARCHIVES][
             collection_name][
             ConfigKey.UNSTAGE_PATH
         ]
         return path
 
+    # Profiling
+    @property
+    def profile(self):
+        return self.config[ConfigKey.PROFILE]
+
+    @property
+    def profile_path(self):
+        return self.config[ConfigKey.PROFILE_PATH]
+
+    @property
+    def profile_top_allocations(self):
+        return self.config[ConfigKey.PROFILE_TOP_ALLOCATIONS]
+
     # Progress
     @property
     def progress_bar_increment(self):
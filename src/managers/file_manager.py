@@ -43,7 +43,7 @@ class FileManager:
         self.create_default_path(default_unstage_path)
 
         self.conf.update_archive_paths({
-            ConfigKey.ARCHIVE_PATH_LABEL: default_archive_path,
+            ConfigKey.ARCHIVE_PATH: default_archive_path,
             ConfigKey.UNSTAGE_PATH: default_unstage_path
         })
 
@@ -108,6 +108,8 @@ class FileManager:
             if not exists(progressive_path):
                 try:
                     mkdir(progressive_path)
+                except FileExistsError:
+                    pass  # Made meanwhile, by another unstaging worker
                 except OSError as exc:
                     print(f'Failed to make path : {progressive_path}, {exc}')
                     raise exc
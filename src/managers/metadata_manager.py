@@ -1,15 +1,69 @@
 # Manage the file metadata
 
+# imports, python
+from threading import Event
+from threading import Lock
+from threading import RLock
+
+# imports, project
+from src.enumerations import Class
 from src.enumerations import CollectionType
+from src.enumerations import DuplicateGrouping
 from src.enumerations import FileAttribute
+from src.enumerations import MetadataBackend
+from src.enumerations import MetadataIndex
 from src.enumerations import MetadataKey as mk
+from src.lib.external_sort import iter_sorted_groups
+from src.lib.folder_file_table import FolderFileTable
+from src.lib.metadata_store import SqliteMetadataStore
 
 
 class MetadataManager:
-    def __init__(self):
+    def __init__(self, managers):
+        """Initialize the metadata storage
+
+        File metadata is kept in dictionaries by default. With the FOLDERS
+            backend the files are grouped by folder, so deep archives do not
+            repeat their folder paths. Duplicate records are built for the
+            files of duplicate groups only, and keep full paths, as the
+            unstaging reads them. With the SQLITE backend it is kept in
+            an embedded database instead, and read back as it is needed, for
+            collections that do not fit in memory.
+
+        :param managers: collection of manager classes
+        """
         print(f'Init {self.__class__.__name__}')
+        self.conf = managers[Class.CONFIG_MANAGER]
         self._collection_metadata = {}
 
+        # The disk backed store, None when metadata is kept in memory
+        self._store = None
+        if self.conf.metadata_backend == MetadataBackend.SQLITE:
+            self._store = SqliteMetadataStore(
+                self.conf.metadata_store_path,
+                self.conf.metadata_store_batch_size)
+        elif self.conf.metadata_backend not in (
+                MetadataBackend.DICT, MetadataBackend.FOLDERS):
+            raise RuntimeError(f'Unknown metadata_backend value set : '
+                               f'{self.conf.metadata_backend}')
+
+        # Hashes are shared by every collection, keyed by file identity
+        self._hash_cache = {}
+        self._hash_cache_lock = Lock()
+        self._hashes_in_flight = {}
+
+        # Content index spanning every collection, digest to the inodes
+        #   holding it in each collection, paths are only found when reported
+        self._digest_index = {}
+        self._digest_indexed_files = set()
+        self._digest_index_lock = Lock()
+
+        # Files by size, digest or inode for each collection and file type,
+        #   each index built on its first use and then kept up to date, the
+        #   store is indexed already
+        self._file_indexes = {}
+        self._file_indexes_lock = RLock()
+
     # Parent Properties
 
     @property
@@ -22,12 +76,21 @@ class MetadataManager:
 
     # Children Properties
 
-    @staticmethod
-    def delete_entry(metadata: dict, key: str):
-        if key not in metadata:
-            print(f'Error, {key} not found in metadata')
-            return
-        del metadata[key]
+    def close(self) -> None:
+        """Save and close the disk backed store, if one is used"""
+        if self._store is not None:
+            self._store.close()
+
+    def delete_entry(self, collection_name: str, file_type: str, file: str):
+        files = self.get_files(collection_name, file_type)
+        with self._file_indexes_lock:
+            if file not in files:
+                print(f'Error, {file} not found in metadata')
+                return
+            file_indexes = self._file_indexes.get((collection_name, file_type))
+            if file_indexes:
+                _reindex_file(file_indexes, files, file, files[file], None)
+            del files[file]
 
     def get_collection_file_metadata(
             self,
@@ -62,6 +125,127 @@ class MetadataManager:
             mk.FILES][
             file_type]
 
+    def get_collections_holding(self, digest: str) -> list:
+        """Get the names of the collections holding a file with this digest
+
+        Every hashed collection is searched, whether or not it was added to
+            the content index, which is only built when collections are
+            checked against each other.
+
+        :param digest: the hash of a file
+        :return: the collection names
+        """
+        if self._store is not None:
+            return self._store.get_collections_holding(digest)
+        return [collection_name
+                for collection_name, collection in
+                self.collection_metadata.items()
+                if any(self.get_files_by_digest(
+                    collection_name, file_type, digest)
+                    for file_type in collection.get(mk.FILES, {}))]
+
+    def get_cross_collection_duplicates(self) -> dict:
+        """Get the digests held by distinct files in more than one collection
+
+        A file reachable from several collections, through overlapping paths
+            or bind mounts, is the same file and not a duplicate.
+
+        :return: for each digest, the files holding it in each collection
+        """
+        if self._store is not None:
+            return self._store.get_cross_collection_duplicates()
+        cross_collection_duplicates = {}
+        with self._digest_index_lock:
+            for digest, collections in self._digest_index.items():
+                if len(collections) < 2:
+                    continue
+                inodes = set().union(*collections.values())
+                if len(inodes) < 2:
+                    continue
+                cross_collection_duplicates[digest] = {
+                    collection_name: [] for collection_name in collections}
+            indexed_files = list(self._digest_indexed_files)
+
+        # The index holds no paths, find the files holding each digest
+        if cross_collection_duplicates:
+            for collection_name, file_type in indexed_files:
+                for file, file_details in self.get_files(
+                        collection_name, file_type).items():
+                    collections = cross_collection_duplicates.get(
+                        file_details[mk.HASH])
+                    if collections is not None:
+                        collections[collection_name].append(file)
+        return cross_collection_duplicates
+
+    @staticmethod
+    def get_file_key(collection_metadata: dict, file: str) -> tuple:
+        file_metadata = collection_metadata[file]
+        return (file_metadata[FileAttribute.ST_DEV],
+                file_metadata[FileAttribute.ST_INO],
+                file_metadata[FileAttribute.ST_SIZE],
+                file_metadata[FileAttribute.ST_MTIME_NS])
+
+    def get_cached_hash(self, file_key: tuple, generate_hash, *args) -> str:
+        """Get the hash of a file, generating it only if no collection has
+            hashed the same file already
+
+        If another collection is hashing the same file, wait for its result
+            instead of reading the file again.
+
+        :param file_key: the file identity, see get_file_key
+        :param generate_hash: called with args to hash the file when needed
+        :return: the hash of the file
+        """
+        with self._hash_cache_lock:
+            file_hash = self._get_cached_hash(file_key)
+            if file_hash is not None:
+                return file_hash
+            in_flight = self._hashes_in_flight.get(file_key)
+            hashing = in_flight is None
+            if hashing:
+                in_flight = self._hashes_in_flight[file_key] = Event()
+
+        if not hashing:
+            in_flight.wait()
+            # Retry, in case the other collection failed to hash the file
+            return self.get_cached_hash(file_key, generate_hash, *args)
+
+        try:
+            file_hash = generate_hash(*args)
+            with self._hash_cache_lock:
+                self._set_cached_hash(file_key, file_hash)
+        finally:
+            with self._hash_cache_lock:
+                del self._hashes_in_flight[file_key]
+            in_flight.set()
+        return file_hash
+
+    def clear_hash_cache(self) -> None:
+        """Forget the hashes shared between collections, once every
+            collection that could share them has been hashed"""
+        with self._hash_cache_lock:
+            if self._store is not None:
+                self._store.clear_hash_cache()
+            else:
+                self._hash_cache.clear()
+
+    def _get_cached_hash(self, file_key: tuple):
+        if self._store is not None:
+            return self._store.get_cached_hash(file_key)
+        return self._hash_cache.get(file_key)
+
+    def _set_cached_hash(self, file_key: tuple, file_hash: str) -> None:
+        if self._store is not None:
+            self._store.set_cached_hash(file_key, file_hash)
+        else:
+            self._hash_cache[file_key] = file_hash
+
+    @staticmethod
+    def get_inode(collection_metadata: dict, file: str) -> tuple:
+        file_metadata = collection_metadata[file]
+        return (file_metadata[FileAttribute.ST_DEV],
+                file_metadata[FileAttribute.ST_INO])
+
     @staticmethod
     def get_hash(collection_metadata: dict, file: str) -> str:
         return collection_metadata[file][mk.HASH]
@@ -70,19 +254,209 @@ class MetadataManager:
     def get_parent_count_from(duplicate_metadata: dict):
         return len(duplicate_metadata)
 
+    def index_file_hashes(
+            self,
+            collection_name: str,
+            file_type: str) -> None:
+        """Add the hashed files of a collection to the content index
+
+        :param collection_name: the collection label
+        :param file_type: the type of files to index, SOURCE or ARCHIVE
+        """
+        if self._store is not None:
+            return  # The store is indexed by hash already
+        files = self.collection_metadata[collection_name][mk.FILES][file_type]
+        with self._digest_index_lock:
+            self._digest_indexed_files.add((collection_name, file_type))
+            for file_details in files.values():
+                collections = self._digest_index.setdefault(
+                    file_details[mk.HASH], {})
+                collections.setdefault(collection_name, set()).add((
+                    file_details[FileAttribute.ST_DEV],
+                    file_details[FileAttribute.ST_INO]))
+
     def init_collection_metadata(
             self,
             collection_name: str,
             collection_paths: dict):
-        self.collection_metadata = {
-            collection_name: {
-                mk.COLLECTION_PATHS: collection_paths}}
+        self.collection_metadata[collection_name] = {
+            mk.COLLECTION_PATHS: collection_paths}
+        if self._store is not None:
+            self._store.clear_collection(collection_name)
+
+    def init_file_store(self, collection_name: str, file_type: str):
+        """Get an empty mapping for the files of a collection, for the crawl
+            to fill
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :return: a dictionary, a mapping grouped by folder, or a disk backed
+            mapping
+        """
+        if self._store is not None:
+            return self._store.files(collection_name, file_type)
+        if self.conf.metadata_backend == MetadataBackend.FOLDERS:
+            return FolderFileTable()
+        return {}
+
+    def iter_hash_groups(self, collection_name: str, file_type: str):
+        """Iterate over the files of a collection that share a hash
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :return: a generator of (hash, files) tuples, files in crawl order,
+            or in path order when the collection is indexed or grouped with
+            EXTERNAL_SORT
+        """
+        with self._file_indexes_lock:
+            digest_index = self._file_indexes.get(
+                (collection_name, file_type), {}).get(MetadataIndex.DIGEST)
+            if digest_index is not None:
+                hash_groups = [
+                    (file_hash, sorted(map(_get_entry_path, entries)))
+                    for file_hash, entries in digest_index.items()
+                    if isinstance(entries, set)]
+        if digest_index is not None:
+            yield from hash_groups
+            return
+
+        if self.conf.duplicate_grouping == DuplicateGrouping.EXTERNAL_SORT:
+            yield from iter_sorted_groups(
+                ((file_details[FileAttribute.ST_SIZE], file_details[mk.HASH], file)
+                 for file, file_details in
+                 self.get_files(collection_name, file_type).items()),
+                self.conf.external_sort_run_size,
+                self.conf.external_sort_path)
+            return
+        if self.conf.duplicate_grouping != DuplicateGrouping.MEMORY:
+            raise RuntimeError(f'Unknown duplicate_grouping value set : '
+                               f'{self.conf.duplicate_grouping}')
+        if self._store is not None:
+            yield from self._store.iter_hash_groups(collection_name, file_type)
+            return
+        # Count the hashes first, so only duplicate paths are held
+        files = self.get_files(collection_name, file_type)
+        hash_counts = {}
+        for file_details in files.values():
+            file_hash = file_details[mk.HASH]
+            hash_counts[file_hash] = hash_counts.get(file_hash, 0) + 1
+        hash_groups = {}
+        for file, file_details in files.items():
+            if hash_counts[file_details[mk.HASH]] > 1:
+                hash_groups.setdefault(file_details[mk.HASH], []).append(file)
+        del hash_counts
+        yield from hash_groups.items()
+
+    def get_files_by_digest(self, collection_name: str, file_type: str,
+                            digest: str) -> list:
+        """Get the files of a collection holding a digest
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :param digest: the hash of a file
+        :return: the files holding the digest
+        """
+        if self._store is not None:
+            return self._store.get_files_by(
+                collection_name, file_type, hash=digest)
+        return self._get_indexed_files(
+            collection_name, file_type, MetadataIndex.DIGEST, digest)
+
+    def get_files_by_inode(self, collection_name: str, file_type: str,
+                           inode: tuple) -> list:
+        """Get the files of a collection that are the same file, hardlinks
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :param inode: the (st_dev, st_ino) of a file
+        :return: the files with this inode
+        """
+        if self._store is not None:
+            return self._store.get_files_by(
+                collection_name, file_type, dev=inode[0], ino=inode[1])
+        return self._get_indexed_files(
+            collection_name, file_type, MetadataIndex.INODE, tuple(inode))
+
+    def get_files_by_size(self, collection_name: str, file_type: str,
+                          size: int) -> list:
+        """Get the files of a collection of a size
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :param size: the file size in bytes
+        :return: the files of this size
+        """
+        if self._store is not None:
+            return self._store.get_files_by(
+                collection_name, file_type, size=size)
+        return self._get_indexed_files(
+            collection_name, file_type, MetadataIndex.SIZE, size)
+
+    def has_files_of_size(self, collection_name: str, file_type: str,
+                          size: int) -> bool:
+        """Check if a collection holds files of a size, without finding them
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :param size: the file size in bytes
+        :return: True if any file is of this size
+        """
+        if self._store is not None:
+            return bool(self._store.get_files_by(
+                collection_name, file_type, size=size))
+        with self._file_indexes_lock:
+            return size in self.index_files(
+                collection_name, file_type, MetadataIndex.SIZE)
+
+    def index_files(self, collection_name: str, file_type: str,
+                    index_name: str) -> dict:
+        """Build an index of a collection, if it is not built already
+
+        Each index is built on its first use. Once built it is kept up to
+            date by init_file_metadata, set_file, update_file_hashes and
+            delete_entry.
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :param index_name: the index to build, DIGEST, INODE or SIZE
+        :return: the index, None with the SQLITE backend
+        """
+        if self._store is not None:
+            return None
+        with self._file_indexes_lock:
+            file_indexes = self._file_indexes.setdefault(
+                (collection_name, file_type), {})
+            index = file_indexes.get(index_name)
+            if index is None:
+                index = file_indexes[index_name] = _build_index(
+                    self.get_files(collection_name, file_type), index_name)
+            return index
+
+    def _get_indexed_files(self, collection_name: str, file_type: str,
+                           index_name: str, key) -> list:
+        with self._file_indexes_lock:
+            index = self.index_files(collection_name, file_type, index_name)
+            entries = index.get(key)
+            if entries is None:
+                return []
+            if isinstance(entries, set):
+                return sorted(map(_get_entry_path, entries))
+            if index_name in _COUNTED_INDEXES:
+                # Only the count is kept for a key held by a single file
+                return [
+                    _get_entry_path(entry) for entry, file_details in
+                    _iter_entries(self.get_files(collection_name, file_type))
+                    if _get_index_key(index_name, file_details) == key]
+            return [_get_entry_path(entries)]
 
     def init_file_metadata(
             self,
             collection_name: str,
             files_at_path: dict,
             path_type: str):
+        # Indexes of the files being replaced are built again on their next use
+        with self._file_indexes_lock:
+            self._file_indexes.pop((collection_name, path_type), None)
         if mk.FILES not in self.collection_metadata[collection_name]:
             self.collection_metadata[collection_name][mk.FILES] = {}
         if path_type == CollectionType.ARCHIVE:
@@ -106,33 +480,11 @@ class MetadataManager:
         if duplicate_metadata is None:
             return
         for parent_file, children_files in duplicate_metadata.items():
-            collection_file_metadata[parent_file].update({
+            parent_file_metadata = collection_file_metadata[parent_file]
+            parent_file_metadata.update({
                 mk.DUPLICATES: children_files
             })
-
-    @staticmethod
-    def set_soft_link_command(collection_metadata: dict,
-                              duplicate_metadata: dict,
-                              command: list):
-        original = duplicate_metadata[mk.ORIGINAL]
-        duplicate = duplicate_metadata[mk.NAME]
-        collection_metadata[
-            original][
-            mk.DUPLICATES][
-            duplicate][
-            mk.SOFT_LINK_COMMAND] = command
-
-    @staticmethod
-    def set_unstage_storage_details(
-            collection_metadata: dict,
-            duplicate_file_metadata: dict,
-            unstage_storage_details: dict):
-        unstage_file_dc = duplicate_file_metadata[mk.NAME]
-        original_file_dc = duplicate_file_metadata[mk.ORIGINAL]
-        collection_metadata[
-            original_file_dc][
-            mk.DUPLICATES][
-            unstage_file_dc].update(unstage_storage_details)
+            collection_file_metadata[parent_file] = parent_file_metadata
 
     @staticmethod
     def update_duplicate_metadata(
@@ -179,7 +531,159 @@ class MetadataManager:
             file_type: str,
             file_hashes: dict) -> None:
         files = self.collection_metadata[collection_name][mk.FILES][file_type]
-        for file, file_details in files.items():
-            file_details.update({
-                mk.HASH: file_hashes[file][mk.HASH]
-            })
+        with self._file_indexes_lock:
+            file_indexes = self._file_indexes.get((collection_name, file_type))
+            for file, file_hash in file_hashes.items():
+                file_details = files[file]
+                old_file_details = dict(file_details) if file_indexes else None
+                file_details.update({
+                    mk.HASH: file_hash[mk.HASH]
+                })
+                files[file] = file_details
+                if file_indexes:
+                    _reindex_file(file_indexes, files, file,
+                                  old_file_details, file_details)
+
+    def set_file(self, collection_name: str, file_type: str, file: str,
+                 file_details: dict) -> None:
+        """Add a file to a collection, or replace it, keeping the indexes up
+            to date
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :param file: the path to the file
+        :param file_details: the file metadata
+        """
+        files = self.get_files(collection_name, file_type)
+        with self._file_indexes_lock:
+            file_indexes = self._file_indexes.get((collection_name, file_type))
+            if file_indexes:
+                _reindex_file(file_indexes, files, file,
+                              files[file] if file in files else None,
+                              file_details)
+            files[file] = file_details
+
+    def update_files(self, collection_name: str, file_type: str,
+                     removed_files, changed_files: dict) -> None:
+        """Remove and set files of a collection at once, lookups see either
+            none or all of the changes
+
+        :param collection_name: the collection label
+        :param file_type: the type of files, SOURCE or ARCHIVE
+        :param removed_files: the paths of the files removed
+        :param changed_files: the metadata of the files added or changed
+        """
+        with self._file_indexes_lock:
+            for file in removed_files:
+                self.delete_entry(collection_name, file_type, file)
+            for file, file_details in changed_files.items():
+                self.set_file(collection_name, file_type, file, file_details)
+
+
+
+# Indexes holding only a count for keys held by a single file, these keys are
+#   mostly unique, and a lookup of them is only ever a check if they are held
+_COUNTED_INDEXES = (MetadataIndex.INODE, MetadataIndex.SIZE)
+
+
+def _build_index(files, index_name: str) -> dict:
+    """Build an index of files, a key held by several files maps to a set of
+        their entries, a key held by a single file maps to its entry, or to
+        1 in a counted index"""
+    index = {}
+    if index_name not in _COUNTED_INDEXES:
+        for entry, file_details in _iter_entries(files):
+            key = _get_index_key(index_name, file_details)
+            if key is not None:
+                _add_entry(index, index_name, files, entry, key)
+        return index
+    # Count the keys first, so only keys held by several files hold entries
+    for file_details in files.values():
+        key = _get_index_key(index_name, file_details)
+        index[key] = index.get(key, 0) + 1
+    for entry, file_details in _iter_entries(files):
+        key = _get_index_key(index_name, file_details)
+        entries = index[key]
+        if isinstance(entries, set):
+            entries.add(entry)
+        elif entries > 1:
+            index[key] = {entry}
+    return index
+
+
+def _reindex_file(file_indexes: dict, files, file: str,
+                  old_file_details, file_details) -> None:
+    """Move a file in the indexes whose key changed, None details for a file
+        being added or removed"""
+    entry = _get_entry(files, file)
+    for index_name, index in file_indexes.items():
+        old_key = _get_index_key(index_name, old_file_details)
+        key = _get_index_key(index_name, file_details)
+        if old_key == key:
+            continue
+        if old_key is not None:
+            _remove_entry(index, index_name, entry, old_key)
+        if key is not None:
+            _add_entry(index, index_name, files, entry, key)
+
+
+def _add_entry(index: dict, index_name: str, files, entry, key) -> None:
+    entries = index.get(key)
+    if entries is None:
+        index[key] = 1 if index_name in _COUNTED_INDEXES else entry
+    elif isinstance(entries, set):
+        entries.add(entry)
+    elif index_name in _COUNTED_INDEXES:
+        # The single file already holding the key is not kept, find it
+        entries = {
+            other_entry for other_entry, file_details in _iter_entries(files)
+            if _get_index_key(index_name, file_details) == key}
+        entries.add(entry)
+        index[key] = entries
+    elif entries != entry:
+        index[key] = {entries, entry}
+
+
+def _remove_entry(index: dict, index_name: str, entry, key) -> None:
+    entries = index.get(key)
+    if isinstance(entries, set):
+        entries.discard(entry)
+        if len(entries) == 1:
+            index[key] = \
+                1 if index_name in _COUNTED_INDEXES else entries.pop()
+    elif entries is not None and (
+            index_name in _COUNTED_INDEXES or entries == entry):
+        del index[key]
+
+
+def _get_index_key(index_name: str, file_details):
+    if file_details is None:
+        return None
+    if index_name == MetadataIndex.DIGEST:
+        return file_details.get(mk.HASH)
+    if index_name == MetadataIndex.INODE:
+        return (file_details[FileAttribute.ST_DEV],
+                file_details[FileAttribute.ST_INO])
+    return file_details[FileAttribute.ST_SIZE]
+
+
+def _iter_entries(files):
+    """Iterate over files as index entries and their metadata, a folder file
+        table gives (folder, file name) tuples sharing its strings, other
+        tables give paths"""
+    if isinstance(files, FolderFileTable):
+        return files.entries()
+    return files.items()
+
+
+def _get_entry(files, file: str):
+    if isinstance(files, FolderFileTable):
+        folder, _, file_name = file.rpartition('/')
+        return folder, file_name
+    return file
+
+
+def _get_entry_path(entry) -> str:
+    if isinstance(entry, tuple):
+        return entry[0] + '/' + entry[1]
+    return entry
@@ -1,16 +1,31 @@
 # A class to handle the staging and unstaging of files
 
 # imports, python
-import copy
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from os import lstat
+from os import remove
+from os import rmdir
+from os import statvfs
+from os.path import dirname
+from os.path import exists
+from os.path import islink
+from os.path import lexists
+from os.path import relpath
 from pathlib import Path
+from time import perf_counter
 
 # imports, project
 from src.lib.lib import build_soft_link_command
 from src.lib.lib import convert_filepath_to_filename
 from src.lib.lib import convert_filepath_to_soft_link_name
-from src.enumerations import CollectionType
+from src.lib.unstage_journal import UnstageJournal
+from src.lib.unstage_journal import read_journal
+from src.lib.unstage_journal import remove_journal
 from src.enumerations import Class
+from src.enumerations import Journal
 from src.enumerations import MetadataKey as mk
+from src.enumerations import Plan
 
 
 class StageManager:
@@ -25,104 +40,338 @@ class StageManager:
         self.conf = managers[Class.CONFIG_MANAGER]
         self.meta = managers[Class.METADATA_MANAGER]
 
-    def load_metadata(self,
-                      collection_metadata: dict,
-                      unstage_path: str,
-                      file_type: str) -> None:
-        """Populate the staging and unstaging metadata
+    @staticmethod
+    def plan_unstage(collection_metadata: dict, unstage_path: str) -> dict:
+        """Check the unstaging destinations can hold every planned move before
+            any file is touched
 
-        :param collection_metadata: the collection name
-        :param unstage_path: path to the unstaging area
-        :file_type: the type of archive to load SOURCE or ARCHIVE
-        """
-        print(f'load_metadata')
-        if file_type == CollectionType.ARCHIVE:
-            self.populate_unstage_metadata(collection_metadata, unstage_path)
+        Moves within a device are renames and need no free space, so they are
+            planned first. Moves across devices are copies, their sizes are
+            summed per destination device and compared against its free space.
+            Cross device moves that do not fit are deferred. Hardlinked files
+            are only counted as reclaimable when every link is moved.
 
-    def populate_unstage_metadata(self,
-                                  collection_metadata: dict,
-                                  unstage_path: str) -> None:
-        """Update the unstaging metadata
+        Every destination is below the unstaging path, so its device and free
+            space are looked up once.
 
         :param collection_metadata: dictionary containing details about the archive
         :param unstage_path: path to the unstaging area
+        :return: the unstaging plan, the planned moves are (source device,
+            duplicate metadata) tuples
         """
-        print(f'populate_unstage_metadata')
-        self._update_with_unstaging_destinations(collection_metadata, unstage_path)
-        self._update_with_soft_links(collection_metadata, unstage_path)
+        print(f'plan_unstage')
+        dst_device = _get_device(unstage_path)
+        same_device = []
+        cross_device = []
+        src_stats = {}
+        for original_file, duplicate_metadata in collection_metadata.items():
+            if mk.DUPLICATES not in duplicate_metadata:
+                continue  # no duplicates for this file
+            for _, duplicate_details in duplicate_metadata[mk.DUPLICATES].items():
+                src_stat = src_stats[duplicate_details[mk.NAME]] = \
+                    lstat(duplicate_details[mk.NAME])
+                src_device = src_stat.st_dev
+                if src_device == dst_device:
+                    same_device.append((src_device, duplicate_details))
+                else:
+                    cross_device.append((src_device, duplicate_details))
 
-    def _update_with_unstaging_destinations(self,
-                                            collection_metadata: dict,
-                                            unstage_path: str) -> None:
-        """Build the unstaging destinations for each file to be unstaged
+        # Smallest first, so the most moves fit when space is short
+        devices = {}
+        planned_cross_device = []
+        deferred = []
+        cross_device.sort(key=lambda move: move[1][mk.SIZE])
+        for src_device, duplicate_details in cross_device:
+            if dst_device not in devices:
+                devices[dst_device] = {
+                    mk.NAME: unstage_path,
+                    Plan.FREE: _get_free_space(unstage_path),
+                    Plan.REQUIRED: 0
+                }
+            device = devices[dst_device]
+            size = duplicate_details[mk.SIZE]
+            if device[Plan.REQUIRED] + size > device[Plan.FREE]:
+                deferred.append(duplicate_details)
+                continue
+            device[Plan.REQUIRED] += size
+            planned_cross_device.append((src_device, duplicate_details))
 
-        :param collection_metadata: dictionary containing details about the collection
-        :param unstage_path: path to the unstaging area
-        """
-        print(f'_update_with_unstaging_destinations')
-        unstage_metadata_dc = copy.deepcopy(collection_metadata)
-        for original_file_dc, original_file_metadata_dc in unstage_metadata_dc.items():
-            if mk.DUPLICATES not in original_file_metadata_dc:
-                continue  # items without duplicates are unprocessed
-            duplicate_metadata_dc = original_file_metadata_dc[mk.DUPLICATES]
-            for _, duplicate_file_metadata in duplicate_metadata_dc.items():
-                unstage_storage_details = \
-                    _build_unstage_storage_details(
-                        duplicate_file_metadata,
-                        unstage_path
-                    )
-
-                self.meta.set_unstage_storage_details(
-                    collection_metadata,
-                    duplicate_file_metadata,
-                    unstage_storage_details
-                )
-
-    def _update_with_soft_links(self,
-                                collection_metadata: dict,
-                                unstage_path: str) -> None:
-        """Build the soft link destinations for each file to be unstaged
+        # Count the planned links to each inode, deferred moves excluded, an
+        #   inode is only reclaimed once all of its links are moved
+        inode_links = {}
+        for _, duplicate_details in same_device + planned_cross_device:
+            src_stat = src_stats[duplicate_details[mk.NAME]]
+            inode = (src_stat.st_dev, src_stat.st_ino)
+            if inode not in inode_links:
+                inode_links[inode] = [src_stat.st_nlink, src_stat.st_size, 0]
+            inode_links[inode][2] += 1
+        reclaimable = sum(
+            size for link_count, size, planned_count in inode_links.values()
+            if planned_count >= link_count)
 
-        :param collection_metadata: dictionary containing details about the archive
-        :param unstage_path: path to the unstaging area
-        """
-        print(f'_update_with_soft_links')
-        collection_metadata_dc = copy.deepcopy(collection_metadata)
-        for original_file_dc, original_file_metadata_dc in collection_metadata_dc.items():
-            if mk.DUPLICATES not in original_file_metadata_dc:
-                continue  # items without duplicates are unprocessed
-            duplicate_metadata_dc = original_file_metadata_dc[mk.DUPLICATES]
-            for duplicate_file_dc, duplicate_file_metadata in duplicate_metadata_dc.items():
-                soft_link_command = _build_soft_link_command(
-                    original_file_dc,
-                    unstage_path
-                )
-
-                self.meta.set_soft_link_command(
-                    collection_metadata,
-                    duplicate_file_metadata,
-                    soft_link_command
-                )
+        unstage_plan = {
+            Plan.SAME_DEVICE: same_device,
+            Plan.CROSS_DEVICE: planned_cross_device,
+            Plan.DEFERRED: deferred,
+            Plan.DEVICES: devices,
+            Plan.RECLAIMABLE: reclaimable,
+            Plan.UNSTAGE_PATH: unstage_path
+        }
+        _report_unstage_plan(unstage_plan)
+        return unstage_plan
 
-    @staticmethod
-    def unstage_files(collection_metadata, file_manager):
+    def unstage_files(self,
+                      unstage_plan: dict,
+                      file_manager,
+                      journal_file: str = '') -> None:
         """Execute the unstaging action, moving files from the archive to their
             respective unstaging destination
 
-        :param collection_metadata: dictionary containing details about the archive
+        The folder of each original is made first, then its soft link inside
+            it, so every destination exists before any file is moved. The
+            moves are then queued per source device, each device with its own
+            workers, so a slow device does not hold back the others.
+            Destinations and soft link commands are built as they are used.
+            The first failure stops the moves not yet started and is raised.
+
+        With a journal file, every action is written to it before any of them
+            runs, and marked done as it runs, see resume_unstage and
+            undo_unstage. It replaces the journal of the last unstaging, unless
+            there is nothing to unstage.
+
+        :param unstage_plan: the unstaging plan, see plan_unstage
         :param file_manager: the file manager class
+        :param journal_file: the journal to record the actions to, empty to
+            disable the journal
         """
         print(f'unstage_files')
-        for original_file, duplicate_metadata in collection_metadata.items():
-            if mk.DUPLICATES not in duplicate_metadata:
-                continue  # no duplicates for this file
-            duplicate_details = duplicate_metadata[mk.DUPLICATES]
-            for duplicate_file, duplicate_details in duplicate_details.items():
-                duplicate_unstage_parent_folder = duplicate_details[mk.UNSTAGE_ROOT]
-                file_manager.create_required_folders(duplicate_unstage_parent_folder)
-                soft_link_command = duplicate_details[mk.SOFT_LINK_COMMAND]
-                file_manager.create_soft_link(soft_link_command)
-                file_manager.move_duplicate_file(duplicate_details)
+        unstage_path = unstage_plan[Plan.UNSTAGE_PATH]
+        moves = [*unstage_plan[Plan.SAME_DEVICE], *unstage_plan[Plan.CROSS_DEVICE]]
+        if not moves:
+            return
+        unstage_start = perf_counter()
+
+        # The unstaging path is shared by every original, make it before the
+        #   workers make the folders below it
+        file_manager.create_required_folders(unstage_path)
+        originals = list(dict.fromkeys(
+            duplicate_details[mk.ORIGINAL] for _, duplicate_details in moves))
+        journal = None
+        if journal_file:
+            journal = UnstageJournal(
+                journal_file, self.conf.unstage_journal_sync_count)
+        try:
+            self._run_unstage(
+                file_manager, originals, moves, unstage_path, journal)
+        finally:
+            if journal is not None:
+                journal.close()
+
+        # Each original is a folder and a soft link, each duplicate a move
+        action_count = 2 * len(originals) + len(moves)
+        unstage_seconds = perf_counter() - unstage_start
+        print(f'Unstaged {len(moves)} file(s) from '
+              f'{len(set(src_device for src_device, _ in moves))} '
+              f'device(s), {action_count} actions in {unstage_seconds:.2f} s '
+              f'({action_count / max(unstage_seconds, 1e-9):.1f} actions/s)')
+
+    def _run_unstage(self,
+                     file_manager,
+                     originals: list,
+                     moves: list,
+                     unstage_path: str,
+                     journal: UnstageJournal = None) -> None:
+        """Journal the actions, then prepare the originals, then move the
+            duplicates, see unstage_files"""
+        unstage_workers = 1 if self.conf.profile else self.conf.unstage_workers
+        if journal is not None:
+            _journal_actions(journal, originals, moves, unstage_path)
+
+        # Each original is a folder then a soft link, numbered in that order
+        #   in the journal, followed by the moves
+        _run_actions(
+            [ThreadPoolExecutor(max_workers=unstage_workers,
+                                thread_name_prefix='unstage_prepare')],
+            [[(_prepare_original, file_manager, original, unstage_path,
+               journal, 2 * original_idx)
+              for original_idx, original in enumerate(originals)]])
+
+        device_moves = {}
+        for move_idx, (src_device, duplicate_details) in enumerate(moves):
+            device_moves.setdefault(src_device, []).append(
+                (_move_duplicate, file_manager, duplicate_details, unstage_path,
+                 journal, 2 * len(originals) + move_idx))
+        _run_actions(
+            [ThreadPoolExecutor(max_workers=unstage_workers,
+                                thread_name_prefix=f'unstage_{src_device}')
+             for src_device in device_moves],
+            list(device_moves.values()))
+        if journal is not None:
+            journal.complete()
+
+    @staticmethod
+    def bury_source_file(source_file: str,
+                         original: str,
+                         graveyard_path: str,
+                         file_manager) -> str:
+        """Move a source file the archive already holds to the graveyard, next
+            to a soft link to the file holding it, laid out as the unstaging
+            area is
+
+        :param source_file: the path to the source file
+        :param original: the file already holding its contents
+        :param graveyard_path: the path to the graveyard
+        :param file_manager: the file manager class
+        :return: the path of the file in the graveyard
+        """
+        graveyard_details = _build_unstage_storage_details(
+            {mk.NAME: source_file, mk.ORIGINAL: original},
+            graveyard_path)
+        file_manager.create_required_folders(graveyard_details[mk.UNSTAGE_ROOT])
+        file_manager.create_soft_link(
+            _build_soft_link_command(original, graveyard_path))
+        file_manager.move_file(
+            src=source_file,
+            dst=graveyard_details[mk.UNSTAGE_DST])
+        return graveyard_details[mk.UNSTAGE_DST]
+
+    @staticmethod
+    def get_staged_file(source_file: str,
+                        source_path: str,
+                        stage_path: str) -> str:
+        """Get the path a source file is staged to, the same path below the
+            stage as it had below the source
+
+        :param source_file: the path to the source file
+        :param source_path: the path to the source
+        :param stage_path: the path to the stage
+        :return: the path of the staged file
+        """
+        return str(Path(stage_path, relpath(source_file, source_path)))
+
+    @staticmethod
+    def stage_source_file(source_file: str,
+                          staged_file: str,
+                          file_manager) -> str:
+        """Move a unique source file to the stage, never replacing a file
+            already staged, a different file already at the same path is kept
+            and the source file is staged next to it under a numbered name
+
+        :param source_file: the path to the source file
+        :param staged_file: the path to stage it to, see get_staged_file
+        :param file_manager: the file manager class
+        :return: the path of the staged file
+        """
+        staged_path = Path(staged_file)
+        staged_count = 0
+        while lexists(staged_file):
+            staged_count += 1
+            staged_file = str(staged_path.with_name(
+                f'{staged_path.stem}_{staged_count}{staged_path.suffix}'))
+        if staged_count:
+            print(f'Stage already holds a different {staged_path}, staging '
+                  f'{source_file} as {staged_file}')
+        file_manager.create_required_folders(dirname(staged_file))
+        file_manager.move_file(src=source_file, dst=staged_file)
+        return staged_file
+
+    @staticmethod
+    def is_unstage_interrupted(journal_file: str) -> bool:
+        """Check whether the unstaging recorded by a journal was interrupted
+
+        :param journal_file: the journal of a collection
+        :return: whether some of its actions may not have run
+        """
+        journal_state = read_journal(journal_file)
+        return journal_state is not None and not journal_state[2]
+
+    def resume_unstage(self, journal_file: str, file_manager) -> None:
+        """Finish an interrupted unstaging from its journal, without crawling
+            or hashing
+
+        The actions not marked done are run again. Each is checked against
+            the file system first, since it may have run before the crash
+            without being marked. A move whose file is still in place is run
+            again, replacing a copy across devices that was cut short.
+        Actions that fail are reported and the journal is abandoned, so it is
+            not resumed again, it is kept to undo the actions that did run.
+
+        :param journal_file: the journal of a collection
+        :param file_manager: the file manager class
+        """
+        print(f'resume_unstage')
+        actions, done, complete = read_journal(journal_file)
+        if complete:
+            return
+        unstage_workers = 1 if self.conf.profile else self.conf.unstage_workers
+        pending = [(action_number, action)
+                   for action_number, action in enumerate(actions)
+                   if action_number not in done]
+        failed = []
+        journal = UnstageJournal(
+            journal_file, self.conf.unstage_journal_sync_count, resume=True)
+        try:
+            # Folders and soft links first, as when they were planned
+            for action_number, action in pending:
+                if action[0] != Journal.MOVE:
+                    _replay_action(
+                        file_manager, action, journal, action_number, failed)
+            _run_actions(
+                [ThreadPoolExecutor(max_workers=unstage_workers,
+                                    thread_name_prefix='unstage_resume')],
+                [[(_replay_action, file_manager, action, journal,
+                   action_number, failed)
+                  for action_number, action in pending
+                  if action[0] == Journal.MOVE]])
+            if failed:
+                journal.abandon()
+            else:
+                journal.complete()
+        finally:
+            journal.close()
+        print(f'Resumed unstaging, {len(pending)} of {len(actions)} '
+              f'action(s) were left')
+        if failed:
+            print(f'Abandoned resuming {len(failed)} action(s), the journal '
+                  f'is kept to undo the others with --undo-unstage : '
+                  f'{journal_file}')
+
+    def undo_unstage(self, journal_file: str, file_manager) -> None:
+        """Move the unstaged files back to where they were, from the journal
+            of the last unstaging, then remove the soft links and the folders
+            it made, and the journal
+
+        :param journal_file: the journal of a collection
+        :param file_manager: the file manager class
+        """
+        print(f'undo_unstage')
+        actions, _, _ = read_journal(journal_file)
+        unstage_workers = 1 if self.conf.profile else self.conf.unstage_workers
+
+        # Only moves that ran are undone, their folders are made first since
+        #   the workers share them
+        moves = [(action[1], action[2]) for action in actions
+                 if action[0] == Journal.MOVE
+                 and lexists(action[2]) and not lexists(action[1])]
+        for folder in dict.fromkeys(dirname(src) for src, _ in moves):
+            file_manager.create_required_folders(folder)
+        _run_actions(
+            [ThreadPoolExecutor(max_workers=unstage_workers,
+                                thread_name_prefix='unstage_undo')],
+            [[(file_manager.move_file, dst, src) for src, dst in moves]])
+
+        # Only the folders and soft links this unstaging made are removed
+        for action in reversed(actions):
+            if action[0] == Journal.LINK and not _existed(action, 3) \
+                    and islink(action[2]):
+                remove(action[2])
+            elif action[0] == Journal.MKDIR and not _existed(action, 2):
+                try:
+                    rmdir(action[1])
+                except OSError:
+                    pass  # Not empty, or already removed
+        remove_journal(journal_file)
+        print(f'Undid unstaging, {len(moves)} file(s) moved back')
 
 
 def _build_unstage_storage_details(
@@ -148,6 +397,153 @@ def _build_unstage_storage_details(
     return unstage_storage_details
 
 
+def _journal_actions(journal: UnstageJournal,
+                     originals: list,
+                     moves: list,
+                     unstage_path: str) -> None:
+    """Write every unstaging action to the journal and sync it, numbered as
+        unstage_files numbers them
+
+    :param journal: the journal to write to
+    :param originals: the originals, in the order they are prepared
+    :param moves: the planned moves, see StageManager.plan_unstage
+    :param unstage_path: the unstaging path
+    """
+    # Folders and soft links made by an earlier unstaging are recorded as
+    #   such, so undoing this one leaves them to the duplicates still there
+    for original in originals:
+        folder = str(Path(unstage_path, convert_filepath_to_filename(original)))
+        journal.write_action(Journal.MKDIR, folder, lexists(folder))
+        soft_link = _build_soft_link_command(original, unstage_path)[-1]
+        journal.write_action(
+            Journal.LINK, original, soft_link, lexists(soft_link))
+    for _, duplicate_details in moves:
+        journal.write_action(
+            Journal.MOVE,
+            duplicate_details[mk.NAME],
+            _build_unstage_storage_details(
+                duplicate_details, unstage_path)[mk.UNSTAGE_DST])
+    journal.sync()
+
+
+def _move_duplicate(file_manager,
+                    duplicate_details: dict,
+                    unstage_path: str,
+                    journal: UnstageJournal = None,
+                    action_number: int = 0) -> None:
+    """Move a duplicate to its unstaging destination
+
+    :param file_manager: the file manager class
+    :param duplicate_details: the duplicate file metadata
+    :param unstage_path: the unstaging path
+    :param journal: the journal to mark the move done in, if any
+    :param action_number: the number of the move in the journal
+    """
+    file_manager.move_duplicate_file(dict(
+        duplicate_details,
+        **_build_unstage_storage_details(duplicate_details, unstage_path)))
+    if journal is not None:
+        journal.mark_done(action_number)
+
+
+def _prepare_original(file_manager,
+                      original: str,
+                      unstage_path: str,
+                      journal: UnstageJournal = None,
+                      action_number: int = 0) -> None:
+    """Make the unstaging folder of an original, then the soft link to the
+        original inside it
+
+    :param file_manager: the file manager class
+    :param original: the file the duplicates are duplicates of
+    :param unstage_path: the unstaging path
+    :param journal: the journal to mark the actions done in, if any
+    :param action_number: the number of the folder in the journal, the soft
+        link follows it
+    """
+    file_manager.create_required_folders(
+        str(Path(unstage_path, convert_filepath_to_filename(original))))
+    if journal is not None:
+        journal.mark_done(action_number)
+    file_manager.create_soft_link(
+        _build_soft_link_command(original, unstage_path))
+    if journal is not None:
+        journal.mark_done(action_number + 1)
+
+
+def _replay_action(file_manager,
+                   action: list,
+                   journal: UnstageJournal,
+                   action_number: int,
+                   failed: list) -> None:
+    """Run a journaled action again, unless it already ran
+
+    :param file_manager: the file manager class
+    :param action: the action, see UnstageJournal
+    :param journal: the journal to mark the action done in
+    :param action_number: the number of the action in the journal
+    :param failed: the actions that failed, appended to
+    """
+    try:
+        if action[0] == Journal.MKDIR:
+            file_manager.create_required_folders(action[1])
+        elif action[0] == Journal.LINK:
+            file_manager.create_soft_link(
+                build_soft_link_command(action[1], action[2]))
+        elif lexists(action[1]):
+            # The folder may have been removed since it was made
+            file_manager.create_required_folders(dirname(action[2]))
+            if lexists(action[2]):
+                _remove_cut_short_copy(action[1], action[2])
+            file_manager.move_file(src=action[1], dst=action[2])
+        elif not lexists(action[2]):
+            print(f'Cannot resume moving {action[1]}, it is gone')
+    except OSError as exc:
+        print(f'Failed to resume {" ".join(map(str, action))} : {exc}')
+        failed.append(action)
+        return
+    journal.mark_done(action_number)
+
+
+def _existed(action: list, existed_idx: int) -> bool:
+    # Journals written before existed was recorded made everything
+    return len(action) > existed_idx and action[existed_idx]
+
+
+def _remove_cut_short_copy(src: str, dst: str) -> None:
+    """Remove the destination of a move across devices that was cut short,
+        the copy is never larger than the file it copies
+
+    :param src: the file still in place
+    :param dst: the destination already holding a file
+    :raises OSError: when the destination holds some other file
+    """
+    dst_stat = lstat(dst)
+    if islink(dst) or dst_stat.st_size > lstat(src).st_size:
+        raise OSError(f'Dst holds another file : {dst}')
+    remove(dst)
+
+
+def _run_actions(executors: list, action_queues: list) -> None:
+    """Run queues of actions, each queue on its own executor, until they are
+        all done or one fails
+
+    :param executors: the executors, one for each queue
+    :param action_queues: lists of (function, *args) tuples
+    :raises OSError: the first failure, once the actions not yet started
+        are cancelled and the running ones are done
+    """
+    try:
+        futures = [executor.submit(*action)
+                   for executor, actions in zip(executors, action_queues)
+                   for action in actions]
+        for future in as_completed(futures):
+            future.result()
+    finally:
+        for executor in executors:
+            executor.shutdown(cancel_futures=True)
+
+
 def _build_soft_link_command(original: str, unstage_path: str) -> list:
     """
 
@@ -158,3 +554,45 @@ def _build_soft_link_command(original: str, unstage_path: str) -> list:
     soft_link_label = str(Path(unstage_path, soft_link_name, soft_link_name))
     soft_link_command = build_soft_link_command(original, soft_link_label)
     return soft_link_command
+
+
+def _get_device(path: str) -> int:
+    """Get the device of a path, or of its nearest existing parent folder
+
+    :param path: a path that may not exist yet
+    :return: the st_dev of the device that would hold the path
+    """
+    while not exists(path):
+        path = dirname(path)
+    return lstat(path).st_dev
+
+
+def _get_free_space(path: str) -> int:
+    """Get the bytes available to unprivileged users on the device of a path
+
+    :param path: a path that may not exist yet
+    :return: the free space in bytes
+    """
+    while not exists(path):
+        path = dirname(path)
+    fs_stat = statvfs(path)
+    return fs_stat.f_bavail * fs_stat.f_frsize
+
+
+def _report_unstage_plan(unstage_plan: dict) -> None:
+    """Announce what the unstaging plan will do
+
+    :param unstage_plan: the unstaging plan, see StageManager.plan_unstage
+    """
+    print(f'Unstaging will reclaim {unstage_plan[Plan.RECLAIMABLE]} bytes, '
+          f'{len(unstage_plan[Plan.SAME_DEVICE])} file(s) renamed, '
+          f'{len(unstage_plan[Plan.CROSS_DEVICE])} file(s) copied across devices')
+    for device in unstage_plan[Plan.DEVICES].values():
+        print(f'Unstaging requires {device[Plan.REQUIRED]} of '
+              f'{device[Plan.FREE]} free bytes on the device holding '
+              f'{device[mk.NAME]}')
+    deferred = unstage_plan[Plan.DEFERRED]
+    if deferred:
+        deferred_size = sum(details[mk.SIZE] for details in deferred)
+        print(f'Not enough free space, deferring {len(deferred)} file(s) '
+              f'totalling {deferred_size} bytes')
@@ -1,14 +1,16 @@
 # Perform checks and fixes related to the operating system
 
 # imports, python
-from subprocess import run
+from os import statvfs
+from re import sub
+from threading import Thread
 from time import sleep
 
 # imports, project
 from src.enumerations import Class
-from src.enumerations import Command
 from src.enumerations import Disk
 from src.enumerations import Network
+from src.enumerations import Proc
 
 
 class SystemManager:
@@ -22,25 +24,61 @@ class SystemManager:
         self.conf = managers[Class.CONFIG_MANAGER]
         self._debug = self.conf.debug
         self._network_connected = None
+        self._checks = None
+        self._checks_error = None
 
     def run(self):
-        """Primary actions of the system manager"""
+        """Primary actions of the system manager
+
+        The checks only read kernel interfaces, so by default they run in the
+            background while the collections are crawled and hashed. Call
+            wait_until_ready before acting on any files.
+        """
         print(f'Running {self.__class__.__name__}')
 
+        # Checks run inline when profiling so they appear in the stage profile
+        if self.conf.system_checks_in_background and not self.conf.profile:
+            self._checks = Thread(
+                target=self._run_checks_in_background,
+                name='system_checks',
+                daemon=True)
+            self._checks.start()
+        else:
+            self.check()
+
+    def check(self):
+        """Check the disks, and the network if required"""
         self.disk_check()
 
         if self.conf.require_network:
             self.network_check()
 
+    def wait_until_ready(self):
+        """Block until the background checks finish, raise if any failed"""
+        checks = self._checks
+        if checks is not None:
+            print(f'wait_until_ready')
+            checks.join()
+        if self._checks_error is not None:
+            raise self._checks_error
+
+    def _run_checks_in_background(self):
+        """Run the checks, keeping any failure for wait_until_ready"""
+        try:
+            self.check()
+        except Exception as exc:
+            # Any failure, not only a failed check, must stop files moving
+            self._checks_error = exc
+
     @staticmethod
     def disk_check():
-        """Check the disks from the command line"""
+        """Check the disks from the kernel mount table"""
         print(f'disk_check')
         if not disks_ready():
             raise OSError(f'Disks in unexpected state')
 
     def network_check(self):
-        """Check the network from the command line"""
+        """Check the network from the kernel interface counters"""
         print(f'network_check')
         if not network_ready(self.conf):
             raise OSError(f'Network in unexpected state')
@@ -48,7 +86,7 @@ class SystemManager:
 
 def disks_ready():
     """Ensure that disks are mounted at expected mount points"""
-    disk_state = read_disk_state(cmd=Command.Disk.df)
+    disk_state = read_disk_state()
     for dev, mount in Disk.Dev.mount.items():
         if dev not in disk_state:
             print(f'Expected disk missing : {dev}')
@@ -58,15 +96,22 @@ def disks_ready():
         if mount != mounted_on:
             print(f'Unexpected mount point for {mount} : {mounted_on}')
             return False
+
+        try:
+            read_disk_usage(mounted_on)
+        except OSError as exc:
+            print(f'Mount point not accessible : {mounted_on}, {exc}')
+            return False
     return True
 
 
 def network_ready(detail_manager):
     """Ensure that network is available and active"""
     network_snapshots = []
-    for _ in range(detail_manager.network_check_count):
-        network_snapshots.append(read_network_state(cmd=Command.Network.ifconfig))
-        sleep(detail_manager.network_check_delay)
+    for check_idx in range(detail_manager.network_check_count):
+        if check_idx:
+            sleep(detail_manager.network_check_delay)
+        network_snapshots.append(read_network_state())
         if not network_snapshots[0]:
             return False  # No interfaces found, is Wi-Fi disabled?
     try:
@@ -77,179 +122,136 @@ def network_ready(detail_manager):
     return True
 
 
-def read_disk_state(cmd=Command.Disk.df) -> dict:
+def read_disk_state(path: str = Proc.mountinfo) -> dict:
     """Get information about the current state of disks"""
-    return _parse_raw_disk_state(_read_raw_disk_state(cmd))
-
-
-def read_network_state(cmd=Command.Network.ifconfig) -> dict:
-    """Get information about the current state the network"""
-    return _parse_raw_network_state(_read_raw_network_state(cmd))
+    with open(path) as mountinfo:
+        return _parse_mountinfo(mountinfo.read())
 
 
-def _read_raw_disk_state(cmd: list) -> str:
-    """Read and return the raw disk information
+def read_disk_usage(mount_point: str) -> dict:
+    """Get the usage of the filesystem mounted at a mount point
 
-    :param cmd: the disk information command
-    :return: the raw disk information from the command line
+    :param mount_point: the mount point to measure
+    :return: a dictionary containing the filesystem usage in 1K blocks
     """
-    if cmd == Command.Disk.df:
-        return str(run(['df'], capture_output=True).stdout.decode())
-
+    fs_stat = statvfs(mount_point)
+    blocks = fs_stat.f_blocks * fs_stat.f_frsize // 1024
+    available = fs_stat.f_bavail * fs_stat.f_frsize // 1024
+    used = (fs_stat.f_blocks - fs_stat.f_bfree) * fs_stat.f_frsize // 1024
+    return {
+        '1K-blocks': blocks,
+        'Used': used,
+        'Available': available,
+        'Use%': round(100 * used / (used + available)) if used + available else 0
+    }
+
+
+def read_network_state(path: str = Proc.net_dev) -> dict:
+    """Get information about the current state the network"""
+    with open(path) as net_dev:
+        return _parse_net_dev(net_dev.read())
 
-def _read_raw_network_state(cmd: str) -> str:
-    """Read and return the raw network information
 
-    :param cmd: the network information command
-    :return: the raw network information from the command line
-    """
-    if cmd == Command.Network.ifconfig:
-        return str(run(['ifconfig'], capture_output=True).stdout.decode())
+def _parse_mountinfo(raw_disk_state: str) -> dict:
+    """Parse the kernel mount table into a python dictionary
 
+    Each line is formatted as :
+        id parent major:minor root mount_point options [optional..] - type source super_options
 
-def _parse_raw_disk_state(raw_disk_state: str,
-                          cmd: str = Command.Disk.df) -> dict:
-    """Parse the raw disk state into a python dictionary
-
-    :param raw_disk_state: the raw disk state from the command line
-    :param cmd: the command used to generate the raw disk state information
-    :return: a dictionary containing the parsed disk state
+    :param raw_disk_state: the contents of /proc/self/mountinfo
+    :return: a dictionary containing the parsed disk state, keyed by source
     """
-    raw_disk_state_lines = raw_disk_state.split('\n')
-    _verify_header(raw_disk_state_lines, cmd)
     disk_state = {}
-    for raw_disk_state_line in raw_disk_state_lines[1:]:
-        if cmd == Command.Disk.df:
-            # Split and remove blank entries
-            disk_state_line = [val for val in raw_disk_state_line.split(' ') if val]
-
-            if not disk_state_line:
-                continue
-
-            if disk_state_line[0] in Disk.Dev.skip:
-                continue  # Skip some Filesystems
-
-            disk_state.update({
-                disk_state_line[0]: {
-                    '1K-blocks': disk_state_line[1],
-                    'Used': disk_state_line[2],
-                    'Available': disk_state_line[3],
-                    'Use%': disk_state_line[4],
-                    'Mounted on': disk_state_line[5],
-                }
-            })
+    for raw_disk_state_line in raw_disk_state.split('\n'):
+        disk_state_line = raw_disk_state_line.split()
+        if '-' not in disk_state_line:
+            continue
+
+        separator_idx = disk_state_line.index('-')
+        fs_type, source = disk_state_line[separator_idx + 1:separator_idx + 3]
+        if fs_type in Disk.Dev.skip or source in Disk.Dev.skip:
+            continue  # Skip some Filesystems
+
+        # The first mount of a source wins, matching the df listing
+        if source in disk_state:
+            continue
+        disk_state.update({
+            source: {
+                'Device': disk_state_line[2],
+                'Filesystem type': fs_type,
+                'Mounted on': _unescape_mountinfo(disk_state_line[4]),
+            }
+        })
     return disk_state
 
 
-def _parse_raw_network_state(raw_network_state: str,
-                             cmd: str = Command.Network.ifconfig) -> dict:
-    """Parse the raw network state into a python dictionary
+def _parse_net_dev(raw_network_state: str) -> dict:
+    """Parse the kernel interface counters into a python dictionary
+
+    The first two lines are headers, each following line is formatted as :
+        interface: rx_bytes rx_packets rx_errs rx_drop .. tx_bytes tx_packets tx_errs tx_drop ..
 
-    :param raw_network_state: the raw network state from the command line
-    :param cmd: the command used to generate the raw network state information
+    :param raw_network_state: the contents of /proc/net/dev
     :return: a dictionary containing the parsed network state
     """
-    raw_network_state_lines = raw_network_state.split('\n')
-    _verify_header(raw_network_state_lines, cmd)
     network_state = {}
-    # This flag is necessary because when an interface is skipped, the lines
-    #   following will attempt to be parsed. This prevents that and instead
-    #   directs the loop to search for the next line containing 'flags'. That
-    #   line will be the interface, and then the flag is deactivated.
-    interface_search_active = True
-    for raw_network_state_line in raw_network_state_lines:
-        if cmd == Command.Network.ifconfig:
-            # Split and remove blank entries
-            nsl = network_state_line = [val for val in raw_network_state_line.split(' ') if val]
-
-            if not network_state_line:
-                continue
-
-            if 'flags' in raw_network_state_line:
-                interface_search_active = False
-                interface = network_state_line[0]
-
-            if interface_search_active:
-                continue  # These lines are part of a skipped interface
-
-            if network_state_line[0] in Network.Interface.skip:
-                interface_search_active = True
-                continue  # Skip some interfaces
-
-            # An interface has been found, read and populate until the next
-            if network_state_line[0] == interface:
-                # Initialize the new entry
-                network_state.update({
-                    interface: {
-                        'flags': network_state_line[1],
-                        'maximum_transmission_unit': nsl[2] + ' ' + nsl[3]
-                    }
-                })
-            elif nsl[0] == 'inet':
-                network_state[interface].update({
-                    nsl[0] + ' ' + nsl[1]: nsl[2] + ' ' + nsl[3]
-                })
-            elif nsl[1] == 'packets':
-                network_state[interface].update({
-                    nsl[0] + ' ' + nsl[1]: {
-                        nsl[1]: nsl[2],
-                        nsl[3]: nsl[4],
-                        'xfer': nsl[5] + nsl[6]
-                    }
-                })
-            elif nsl[1] == 'errors':
-                network_state[interface].update({
-                    nsl[0] + ' ' + nsl[1]: {
-                        nsl[1]: nsl[2],
-                        nsl[3]: nsl[4],
-                        nsl[5]: nsl[6],
-                        nsl[7]: nsl[8]
-                    }
-                })
-
+    for raw_network_state_line in raw_network_state.split('\n')[2:]:
+        if ':' not in raw_network_state_line:
+            continue
+
+        interface, counters = raw_network_state_line.split(':', 1)
+        interface = interface.strip()
+        if interface in Network.Interface.skip:
+            continue  # Skip some interfaces
+
+        counters = [int(counter) for counter in counters.split()]
+        network_state.update({
+            interface: {
+                'RX packets': {
+                    'packets': counters[1],
+                    'bytes': counters[0]
+                },
+                'RX errors': {
+                    'errors': counters[2],
+                    'dropped': counters[3]
+                },
+                'TX packets': {
+                    'packets': counters[9],
+                    'bytes': counters[8]
+                },
+                'TX errors': {
+                    'errors': counters[10],
+                    'dropped': counters[11]
+                }
+            }
+        })
     return network_state
 
 
-def _validate_network_snapshots(network_snapshots: dict) -> None:
+def _unescape_mountinfo(field: str) -> str:
+    """Decode the octal escapes the kernel uses for whitespace in paths
+
+    :param field: a mountinfo field, like '/mnt/my\\040disk'
+    :return: the decoded field
+    """
+    return sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def _validate_network_snapshots(network_snapshots: list) -> None:
     """Read the network snapshots to verify network activity is ongoing
 
     :param network_snapshots: time-spaced snapshots of the network interfaces
     """
     byte_rx_snapshots = []
     byte_tx_snapshots = []
-    for idx, network_snapshot in enumerate(network_snapshots):
-        for interface, details in network_snapshot.items():
-            byte_rx_snapshots.append(int(details['RX packets']['bytes']))
-            byte_tx_snapshots.append(int(details['TX packets']['bytes']))
+    for network_snapshot in network_snapshots:
+        byte_rx_snapshots.append(sum(
+            details['RX packets']['bytes']
+            for details in network_snapshot.values()))
+        byte_tx_snapshots.append(sum(
+            details['TX packets']['bytes']
+            for details in network_snapshot.values()))
     byte_rx_delta = byte_rx_snapshots[-1] - byte_rx_snapshots[0]
     byte_tx_delta = byte_tx_snapshots[-1] - byte_tx_snapshots[0]
-    if not byte_rx_delta or byte_tx_delta:
+    if not (byte_rx_delta or byte_tx_delta):
         raise OSError('No network activity detected')
-
-
-def _verify_header(raw_disk_state_lines: list, cmd: str) -> None:
-    """Validate the raw disk state header is in expected format
-
-    :param raw_disk_state_lines: a list of raw disk state lines
-    :param cmd: the command used to generate the raw disk state lines
-    """
-    if cmd == Command.Disk.df:
-        header_cols = Command.Output.df['Header Columns']
-        header = raw_disk_state_lines[0]
-        valid_df_header = _validate_df_header(header, header_cols)
-        if not valid_df_header:
-            raise OSError(f'Invalid {cmd} header found : {header}')
-
-
-def _validate_df_header(header: str, header_cols: list) -> bool:
-    """Validate the raw disk state header is in expected format
-
-    :param header: the unparsed disk header
-    :param header_cols: the disk header columns
-    :return: bool indicating all expected headers found in header string
-    """
-    header_cols_state = [0 for _ in header_cols]
-    for idx, header_col in enumerate(header_cols):
-        if header_col in header:
-            header_cols_state[idx] = header_col
-    return all(header_cols_state)
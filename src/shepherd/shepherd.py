@@ -2,6 +2,7 @@
 
 # imports, project
 from src.enumerations import Class
+from src.lib.profiling import run_stage
 
 
 class Shepherd:
@@ -16,10 +17,17 @@ class Shepherd:
         )
         managers[Class.CONFIG_MANAGER] = config_manager
         self._debug = config_manager.debug
-        self.system_manager = managers[Class.SYSTEM_MANAGER](managers)
+        system_manager = self.system_manager = \
+            managers[Class.SYSTEM_MANAGER](managers)
+        managers[Class.SYSTEM_MANAGER] = system_manager
         self.collection_manager = managers[Class.COLLECTION_MANAGER](managers)
 
     def run(self):
         print(f'Running {self.__class__.__name__}')
-        self.system_manager.run()
-        self.collection_manager.run()
+        run_stage(self.conf, 'system_manager_run', self.system_manager.run)
+        if self.conf.undo_unstage:
+            self.collection_manager.undo_unstage()
+        elif self.conf.watch:
+            self.collection_manager.watch()
+        else:
+            self.collection_manager.run()